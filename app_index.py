@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+App Index - Compiled port and process-name classification
+Maps every port to the applications using it through one flat array per
+protocol and matches process names against keyword lists with an
+Aho-Corasick automaton, so labelling a socket costs two array reads
+"""
+
+from array import array
+from collections import deque, namedtuple
+
+PROTOCOLS = ('tcp', 'udp')
+
+AppProfile = namedtuple('AppProfile', 'app_id category name')
+
+
+def expand_ports(ports):
+    """(protocol, port) pairs; a plain list applies to every protocol, a dict names them"""
+    if isinstance(ports, dict):
+        return [(proto, int(port)) for proto, entries in ports.items() for port in entries]
+    return [(proto, int(port)) for port in ports for proto in PROTOCOLS]
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton: every label whose keywords occur in a name, in one pass"""
+
+    def __init__(self, keywords):
+        # keywords: {label: [substring, ...]}, matched case-insensitively
+        self.labels = list(keywords)
+        self.goto = [{}]
+        self.fail = [0]
+        # Bitmask of label indexes ending at each state
+        self.output = [0]
+        for index, label in enumerate(self.labels):
+            for word in keywords[label]:
+                state = 0
+                for char in word.lower():
+                    following = self.goto[state].get(char)
+                    if following is None:
+                        following = len(self.goto)
+                        self.goto.append({})
+                        self.fail.append(0)
+                        self.output.append(0)
+                        self.goto[state][char] = following
+                    state = following
+                self.output[state] |= 1 << index
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] |= self.output[self.fail[child]]
+        # Process names repeat across sockets, so each is scanned once
+        self.cache = {}
+
+    def match(self, text):
+        """Tuple of labels with a keyword occurring in text"""
+        found = self.cache.get(text)
+        if found is not None:
+            return found
+        goto, fail, output = self.goto, self.fail, self.output
+        state, mask = 0, 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            mask |= output[state]
+        found = self.cache[text] = tuple(label for index, label in enumerate(self.labels)
+                                         if mask >> index & 1)
+        return found
+
+
+class AppIndex:
+    """Port -> applications lookup built once from {category: {app: ports}} profiles"""
+
+    def __init__(self, profiles, keywords=None):
+        self.apps = []
+        # Distinct sets of apps sharing a port; index 0 is the empty set
+        self.port_sets = [()]
+        interned = {(): 0}
+        members = {proto: {} for proto in PROTOCOLS}
+        for category, apps in profiles.items():
+            for name, ports in apps.items():
+                app = AppProfile(len(self.apps), category, name)
+                self.apps.append(app)
+                for proto, port in expand_ports(ports):
+                    if not 0 < port < 65536:
+                        raise ValueError(f"invalid port {port} for {name}")
+                    owners = members[proto].setdefault(port, [])
+                    if app not in owners:
+                        owners.append(app)
+
+        self.ports = {}
+        for proto, owners_by_port in members.items():
+            table = self.ports[proto] = array('H', bytes(2 * 65536))
+            for port, owners in owners_by_port.items():
+                key = tuple(owners)
+                if key not in interned:
+                    interned[key] = len(self.port_sets)
+                    self.port_sets.append(key)
+                table[port] = interned[key]
+        # Unions of two port sets, for sockets whose local and remote ports both match
+        self.unions = {}
+        self.names = KeywordMatcher(keywords or {})
+
+    def lookup(self, proto, port):
+        """Applications using a port, most recently added profile last"""
+        return self.port_sets[self.ports[proto][port]]
+
+    def label(self, proto, lport, rport):
+        """Applications matching either end of a socket"""
+        table = self.ports.get(proto)
+        if table is None:
+            return ()
+        local, remote = table[lport], table[rport]
+        if not remote or local == remote:
+            return self.port_sets[local]
+        if not local:
+            return self.port_sets[remote]
+        key = (local, remote)
+        union = self.unions.get(key)
+        if union is None:
+            union = self.unions[key] = tuple(dict.fromkeys(self.port_sets[local] + self.port_sets[remote]))
+        return union
+
+    def match_name(self, name):
+        """Keyword labels matching a process name"""
+        return self.names.match(name or '')
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Autorate - Closed-loop uplink shaping from RTT under load
+Probes a few reflectors every cycle, compares their RTT against a slowly
+tracked baseline and retunes the HTB hierarchy so the queueing delay added
+under load stays below a target
+"""
+
+import asyncio
+import signal
+import statistics
+import threading
+import time
+from array import array
+from collections import deque
+
+from bandwidth_sampler import InterfaceSampler
+from latency_probe import LatencyProber, icmp_available
+
+# Well-connected anycast resolvers; the median over several hides one reflector's own jitter
+DEFAULT_REFLECTORS = ('1.1.1.1', '8.8.8.8', '9.9.9.9', '208.67.222.222')
+# Lowest rate a bloated link is cut to unless a floor is given, in bits/s
+DEFAULT_MIN_RATE = 10 ** 6
+
+
+class AutorateController:
+    """Track the usable uplink rate of a TCProgram's interface and keep its ceilings there"""
+
+    def __init__(self, program, base_rate=None, min_rate=None, max_rate=None, reflectors=DEFAULT_REFLECTORS,
+                 interval=0.5, target_delay_ms=15.0, increase=1.05, decrease=0.9, decay=0.1,
+                 load_threshold=0.75, baseline_alpha=0.002, refractory=3, min_change=0.01,
+                 on_change=None, max_changes=1000, **probe_options):
+        self.program = program
+        self.interface = program.interface
+        # Rates in bits/s; the installed rate is the starting point
+        self.base_rate = base_rate or program.link_rate()
+        # A starting rate from the NIC speed can be far above the real uplink, so the floor is absolute
+        self.min_rate = min_rate or min(DEFAULT_MIN_RATE, self.base_rate)
+        self.max_rate = max_rate or self.base_rate
+        self.rate = self.applied = self.base_rate
+        # Where the rate settles while the link is lightly used: lowered by cuts under load and
+        # raised by clean increases
+        self.resting_rate = self.base_rate
+        self.reflectors = list(dict.fromkeys(reflectors))
+        self.interval = interval
+        self.target_delay_ms = target_delay_ms
+        self.increase = increase
+        self.decrease = decrease
+        # Fraction of the gap to resting_rate closed per cycle while the link is lightly used
+        self.decay = decay
+        # Share of the current rate the interface must be sending to count as loaded
+        self.load_threshold = load_threshold
+        # Baselines drop to any lower RTT at once and drift up slowly, absorbing route changes
+        self.baseline_alpha = baseline_alpha
+        # Cycles after a cut during which the queue drains and no further cut is made
+        self.refractory = refractory
+        self.min_change = min_change
+        self.on_change = on_change
+        probe_options.setdefault('bind_device', self.interface)
+        if probe_options.setdefault('transport', 'icmp') == 'icmp' and not icmp_available():
+            # TCP probes would queue behind bulk transfers and the controller would chase its own queue
+            raise OSError("ICMP echo sockets are not permitted (see net.ipv4.ping_group_range)")
+        self.prober = LatencyProber(count=1, timeout=min(1.0, interval), **probe_options)
+        self.sampler = InterfaceSampler([self.interface], interval=interval, window=600)
+
+        self.baselines = array('d', [0.0] * len(self.reflectors))
+        self.hold = 0
+        # Most recent rate changes only; stats['changes'] keeps the running total
+        self.changes = deque(maxlen=max_changes)
+        self.stop_event = threading.Event()
+        self._wake = None
+        self._loop = None
+        self.stats = {'cycles': 0, 'changes': 0, 'errors': 0, 'cpu_seconds': 0.0, 'started': time.time()}
+
+    def queueing_delay(self, rtts):
+        """Median RTT above baseline across reflectors that answered, or None if none did"""
+        baselines = self.baselines
+        alpha = self.baseline_alpha
+        deltas = []
+        for i, rtt in enumerate(rtts):
+            if rtt is None:
+                continue
+            baseline = baselines[i]
+            if not baseline or rtt < baseline:
+                baselines[i] = baseline = rtt
+            else:
+                baselines[i] = baseline + alpha * (rtt - baseline)
+            deltas.append(rtt - baseline)
+        return statistics.median(deltas) if deltas else None
+
+    def step(self, delay_ms, tx_bps, rx_bps=0.0):
+        """Next shaped rate from one cycle's queueing delay and measured send and receive rates"""
+        rate = self.rate
+        loaded = tx_bps >= self.load_threshold * rate
+        if self.hold:
+            self.hold -= 1
+        if delay_ms is None:
+            # Every probe lost is an outage or filtered reflectors, not a measurement: hold
+            pass
+        elif delay_ms > self.target_delay_ms:
+            # RTT cannot tell which direction queued, so only a busy uplink is blamed; an idle
+            # one never lowers the rate or the resting rate on a spike caused by downloads
+            if loaded and not self.hold:
+                # Drop below what actually got through so the standing queue drains
+                rate = max(self.min_rate, min(rate, tx_bps) * self.decrease)
+                self.resting_rate = min(self.resting_rate, rate)
+                self.hold = self.refractory
+        elif loaded:
+            self.resting_rate = max(self.resting_rate, rate)
+            rate = min(self.max_rate, rate * self.increase)
+        else:
+            rate += (self.resting_rate - rate) * self.decay
+        self.rate = rate
+        return rate
+
+    def apply(self, rate, delay_ms, tx_bps):
+        """Retune the classes if the rate moved enough to matter; returns a change dict or None"""
+        if abs(rate - self.applied) < self.min_change * self.applied:
+            return None
+        errors = self.program.retune(rate)
+        if errors:
+            self.stats['errors'] += 1
+            for command, message in errors.values():
+                print(f"[-] {command}: {message[:200]}")
+            # Keep steering from what is really installed
+            self.rate = self.applied
+            return None
+        change = {'time': time.time(), 'interface': self.interface, 'before': self.applied,
+                  'after': self.program.link_rate(),
+                  'delay_ms': delay_ms, 'tx_bps': tx_bps}
+        self.applied = rate
+        self.changes.append(change)
+        self.stats['changes'] += 1
+        if self.on_change:
+            self.on_change(change)
+        return change
+
+    async def cycle(self):
+        """Probe every reflector once, measure the send rate and retune; returns a change or None"""
+        results = await self.prober.probe_many_async(self.reflectors)
+        self.sampler.sample()
+        rings = self.sampler.rings.get(self.interface)
+        rx_bps, tx_bps = (rings[0].last(), rings[1].last()) if rings else (0.0, 0.0)
+        delay_ms = self.queueing_delay([results[target]['sequence'][0] for target in self.reflectors])
+        return self.apply(self.step(delay_ms, tx_bps, rx_bps), delay_ms, tx_bps)
+
+    def stop(self, *_):
+        self.stop_event.set()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def report(self):
+        """Current rate and own overhead since start"""
+        stats = self.stats
+        uptime = max(time.time() - stats['started'], 1e-9)
+        return (f"rate {self.applied / 1e6:.1f} Mbit/s | cycles {stats['cycles']} | "
+                f"changes {stats['changes']} | errors {stats['errors']} | "
+                f"cpu {stats['cpu_seconds'] * 1000:.0f} ms ({stats['cpu_seconds'] / uptime * 100:.2f}% of uptime)")
+
+    async def run_async(self, cycles=None):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self.sampler.open()
+        self.sampler.sample()
+        next_run = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                cpu_start = time.process_time()
+                try:
+                    await self.cycle()
+                except Exception as e:
+                    print(f"[-] Autorate cycle failed: {e}")
+                self.stats['cycles'] += 1
+                self.stats['cpu_seconds'] += time.process_time() - cpu_start
+                if cycles is not None and self.stats['cycles'] >= cycles:
+                    break
+                next_run += self.interval
+                try:
+                    await asyncio.wait_for(self._wake.wait(), max(0.0, next_run - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.sampler.close()
+            self._loop = None
+
+    def run(self, cycles=None):
+        """Loop until stopped (SIGINT/SIGTERM) or after the given number of cycles"""
+        previous = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                previous[signum] = signal.signal(signum, self.stop)
+        try:
+            asyncio.run(self.run_async(cycles))
+        finally:
+            # The caller may be an interactive menu that still needs Ctrl+C
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Bandwidth Sampler - High-resolution per-interface rate sampling
+Reads /proc/net/dev through one reused descriptor into fixed-size ring buffers
+"""
+
+import os
+import time
+from array import array
+
+from probe_stats import percentile
+
+PROC_NET_DEV = '/proc/net/dev'
+
+# Rates tracked per interface, in ring-buffer order
+METRICS = ('rx_bps', 'tx_bps', 'rx_pps', 'tx_pps')
+
+
+class RingBuffer:
+    """Fixed-capacity float ring backed by a preallocated array('d')"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = array('d', bytes(8 * capacity))
+        self.index = 0
+        self.count = 0
+
+    def append(self, value):
+        self.data[self.index] = value
+        self.index += 1
+        if self.index == self.capacity:
+            self.index = 0
+        if self.count < self.capacity:
+            self.count += 1
+
+    def last(self):
+        if not self.count:
+            return 0.0
+        return self.data[self.index - 1]
+
+    def values(self):
+        """Samples oldest-first"""
+        if self.count < self.capacity:
+            return self.data[:self.count]
+        return self.data[self.index:] + self.data[:self.index]
+
+    def stats(self):
+        """min/avg/max and percentiles over the window"""
+        ordered = sorted(self.values())
+        if not ordered:
+            return {'min': 0.0, 'avg': 0.0, 'max': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+        return {
+            'min': ordered[0],
+            'avg': sum(ordered) / len(ordered),
+            'max': ordered[-1],
+            'p50': percentile(ordered, 50),
+            'p95': percentile(ordered, 95),
+            'p99': percentile(ordered, 99),
+        }
+
+
+class InterfaceSampler:
+    """Sample per-interface bps/pps at a fixed interval into ring buffers"""
+
+    def __init__(self, interfaces=None, interval=0.1, window=600):
+        self.interfaces = set(interfaces) if interfaces else None
+        self.interval = interval
+        self.window = window
+        self.rings = {}
+        self.previous = {}
+        self.last_time = None
+        self.fd = None
+        self.buffer = None
+        self.use_proc = os.path.exists(PROC_NET_DEV)
+
+    def open(self):
+        if self.use_proc and self.fd is None:
+            self.fd = os.open(PROC_NET_DEV, os.O_RDONLY)
+            self.buffer = bytearray(16384)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _read_proc(self):
+        """Re-read /proc/net/dev from offset 0 into the reused buffer"""
+        while True:
+            size = os.preadv(self.fd, [self.buffer], 0)
+            if size < len(self.buffer):
+                break
+            self.buffer = bytearray(len(self.buffer) * 2)
+
+        counters = {}
+        # Skip the two header lines
+        for line in bytes(self.buffer[:size]).splitlines()[2:]:
+            name, _, fields = line.partition(b':')
+            name = name.strip().decode()
+            if self._wanted(name):
+                values = fields.split()
+                counters[name] = (int(values[0]), int(values[1]), int(values[8]), int(values[9]))
+        return counters
+
+    def _read_psutil(self):
+        """Fallback for platforms without procfs"""
+        import psutil
+        counters = {}
+        for name, io in psutil.net_io_counters(pernic=True).items():
+            if self._wanted(name):
+                counters[name] = (io.bytes_recv, io.packets_recv, io.bytes_sent, io.packets_sent)
+        return counters
+
+    def _wanted(self, name):
+        if self.interfaces is None:
+            return name != 'lo'
+        return name in self.interfaces
+
+    def sample(self):
+        """Take one sample; rates are recorded from the second sample onwards"""
+        now = time.perf_counter()
+        counters = self._read_proc() if self.fd is not None else self._read_psutil()
+
+        if self.last_time is not None:
+            elapsed = now - self.last_time
+            for name, current in counters.items():
+                previous = self.previous.get(name)
+                if previous is None:
+                    continue
+                rings = self.rings.get(name)
+                if rings is None:
+                    rings = self.rings[name] = tuple(RingBuffer(self.window) for _ in METRICS)
+                rx_bytes = current[0] - previous[0]
+                rx_packets = current[1] - previous[1]
+                tx_bytes = current[2] - previous[2]
+                tx_packets = current[3] - previous[3]
+                # A negative delta means the counters were reset; skip the tick
+                if min(rx_bytes, rx_packets, tx_bytes, tx_packets) < 0:
+                    continue
+                rings[0].append(rx_bytes * 8 / elapsed)
+                rings[1].append(tx_bytes * 8 / elapsed)
+                rings[2].append(rx_packets / elapsed)
+                rings[3].append(tx_packets / elapsed)
+
+        self.previous = counters
+        self.last_time = now
+
+    def run(self, duration, on_tick=None):
+        """Sample on a drift-free schedule for duration seconds"""
+        self.open()
+        next_tick = time.perf_counter()
+        end = next_tick + duration
+        self.sample()
+        while True:
+            next_tick += self.interval
+            if next_tick > end:
+                break
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.sample()
+            if on_tick:
+                on_tick(self)
+
+    def latest(self, name):
+        """Most recent {metric: value} for an interface"""
+        return {metric: ring.last() for metric, ring in zip(METRICS, self.rings[name])}
+
+    def summary(self):
+        """{interface: {metric: stats}} over the current window"""
+        return {name: {metric: ring.stats() for metric, ring in zip(METRICS, rings)}
+                for name, rings in sorted(self.rings.items())}
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Multipath Benchmark - Path ranking through veth uplinks into network namespaces
+Builds one veth pair per simulated uplink, each ending in its own namespace that
+owns the same destination address and echoes UDP probes after a configured
+delay, routes the destination over every uplink (the slowest one preferred by
+metric) and checks that MultipathProber probes each path separately and ranks
+them by their delay
+
+Usage:
+    sudo python benchmarks/multipath_bench.py [--delays 40,5,20] [--count 20] [--runs 3]
+Requires root, iproute2, veth and network namespace support; everything is removed afterwards.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from multipath import MultipathProber  # noqa: E402
+
+PREFIX = 'mpbench'
+DESTINATION = '10.214.99.1'
+PORT = 40999
+
+# Runs inside each namespace: echo every probe back after delay_ms
+RESPONDER = """
+import socket, sys, threading
+delay = float(sys.argv[1]) / 1000
+sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+sock.bind((sys.argv[2], int(sys.argv[3])))
+print('ready', flush=True)
+while True:
+    data, addr = sock.recvfrom(2048)
+    threading.Timer(delay, sock.sendto, (data, addr)).start()
+"""
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def run(command, check=True):
+    return subprocess.run(command, shell=True, capture_output=True, text=True, check=check)
+
+
+def uplink(index):
+    """(device, namespace, local address, gateway address) of one simulated uplink"""
+    return f'{PREFIX}{index}', f'{PREFIX}ns{index}', f'10.214.{index}.1', f'10.214.{index}.2'
+
+
+def setup(delays):
+    """Create every uplink and start its responder; returns the responder processes"""
+    responders = []
+    for index, delay_ms in enumerate(delays):
+        device, namespace, local, gateway = uplink(index)
+        run(f'ip netns add {namespace}')
+        run(f'ip link add {device} type veth peer name {device}p netns {namespace}')
+        run(f'ip addr add {local}/30 dev {device} && ip link set {device} up')
+        inside = f'ip netns exec {namespace}'
+        run(f'{inside} ip link set lo up && {inside} ip link set {device}p up')
+        run(f'{inside} ip addr add {gateway}/30 dev {device}p')
+        run(f'{inside} ip addr add {DESTINATION}/32 dev lo')
+        # The first uplink, the slowest by default, gets the lowest metric: the current route
+        run(f'ip route add {DESTINATION}/32 via {gateway} dev {device} metric {100 + index}')
+        process = subprocess.Popen(['ip', 'netns', 'exec', namespace, sys.executable, '-c', RESPONDER,
+                                    str(delay_ms), DESTINATION, str(PORT)],
+                                   stdout=subprocess.PIPE, text=True)
+        responders.append(process)
+        process.stdout.readline()
+    return responders
+
+
+def teardown(count, responders):
+    for process in responders:
+        process.kill()
+        process.wait()
+    for index in range(count):
+        device, namespace, _, _ = uplink(index)
+        run(f'ip route del {DESTINATION}/32 dev {device}', check=False)
+        run(f'ip link del {device}', check=False)
+        run(f'ip netns del {namespace}', check=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='multipath ranking benchmark over veth uplinks')
+    parser.add_argument('--delays', default='40,5,20', help='Per-uplink echo delay in ms')
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    if not sys.platform.startswith('linux') or os.geteuid() != 0:
+        print('multipath benchmark needs root on Linux', file=sys.stderr)
+        return 2
+
+    delays = [float(delay) for delay in args.delays.split(',')]
+    devices = [uplink(index)[0] for index in range(len(delays))]
+    expected = [device for _, device in sorted(zip(delays, devices))]
+    prober = MultipathProber(count=args.count, interval=0.02, timeout=1.0, bind='device',
+                             transport='udp', udp_port=PORT)
+    report = {'destination': DESTINATION, 'delays_ms': dict(zip(devices, delays)),
+              'expected_order': expected, 'runs': []}
+    responders = []
+    try:
+        responders = setup(delays)
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            # Only the simulated uplinks; the host's own default route would join the ranking
+            paths = [path for path in prober.paths(DESTINATION) if path.interface in devices]
+            ranking = prober.compare(DESTINATION, paths)
+            elapsed = time.perf_counter() - start
+            report['runs'].append({
+                'order': [result['path'].interface for result in ranking],
+                'current': next((result['path'].interface for result in ranking if result['current']), None),
+                'seconds': round(elapsed, 3),
+                'paths': {result['path'].interface: {
+                    'p50_ms': None if result['p50'] is None else round(result['p50'], 2),
+                    'loss': result['loss']} for result in ranking}})
+    finally:
+        teardown(len(delays), responders)
+
+    # Paths are probed together, so a run takes one probe window rather than one per uplink
+    report['median_seconds'] = median([entry['seconds'] for entry in report['runs']])
+    report['ranked_correctly'] = all(entry['order'] == expected for entry in report['runs'])
+    print(json.dumps(report, indent=2))
+    return 0 if report['ranked_correctly'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark - Import-time and cold-start regression check
+Measures each entry point's import cost (python -X importtime) and the
+wall-clock time of `network_optimizer.py --stats --json` in fresh interpreters
+
+Usage:
+    python benchmarks/startup_bench.py [--runs 20] [--max-import-ms 25] [--max-start-ms 120]
+Exits non-zero when a budget is exceeded so it can gate CI or monitoring rollouts.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINTS = ('network_optimizer', 'route_optimizer', 'traffic_prioritizer')
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def import_time_ms(module):
+    """Cumulative import time of module in a fresh interpreter, in ms"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True)
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000.0
+    raise RuntimeError(f"could not import {module}: {result.stderr.strip()[-200:]}")
+
+
+def heavy_imports(module, names=('psutil', 'asyncio', 'subprocess', 'platform', 'json')):
+    """Which of the known heavy modules get pulled in by importing module"""
+    code = f'import sys, {module}; print(",".join(n for n in {names!r} if n in sys.modules))'
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    return [name for name in result.stdout.strip().split(',') if name]
+
+
+def cold_start_ms(args, runs):
+    """Wall-clock time of a full CLI invocation, one fresh process per run"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {'median': median(timings), 'p95': timings[int(0.95 * (len(timings) - 1))],
+            'min': timings[0], 'max': timings[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup regression benchmark')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--max-import-ms', type=float, default=25.0,
+                        help='budget for importing network_optimizer')
+    parser.add_argument('--max-start-ms', type=float, default=120.0,
+                        help='budget for the median --stats --json cold start')
+    args = parser.parse_args()
+
+    # Baseline: an empty interpreter, so results can be read as overhead
+    report = {
+        'python': sys.version.split()[0],
+        'interpreter_ms': cold_start_ms(['-c', 'pass'], args.runs),
+        'imports': {},
+        'stats_cold_start_ms': cold_start_ms(['network_optimizer.py', '--stats', '--json'], args.runs),
+    }
+    for module in ENTRY_POINTS:
+        report['imports'][module] = {
+            'import_ms': median([import_time_ms(module) for _ in range(5)]),
+            'heavy_modules': heavy_imports(module),
+        }
+
+    failures = []
+    if report['imports']['network_optimizer']['import_ms'] > args.max_import_ms:
+        failures.append('network_optimizer import time over budget')
+    if report['stats_cold_start_ms']['median'] > args.max_start_ms:
+        failures.append('--stats cold start over budget')
+    report['failures'] = failures
+
+    print(json.dumps(report, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
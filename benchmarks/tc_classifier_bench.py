@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+TC Classifier Benchmark - Per-packet classification cost of the tc filter layouts
+Builds a veth pair, installs the gaming-port hierarchy as the legacy one-filter-
+per-port chain, a single linear u32 chain and port-keyed u32 hash tables, then
+sends UDP packets through each and reports sender CPU time per packet
+
+Usage:
+    sudo python benchmarks/tc_classifier_bench.py [--packets 200000] [--runs 5]
+Requires root, iproute2 and veth support; the veth pair is removed afterwards.
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tc_program import HTBClass, TCProgram, unique_ports  # noqa: E402
+from traffic_prioritizer import TrafficPrioritizer  # noqa: E402
+
+DEVICE, PEER = 'tcbench0', 'tcbench1'
+LOCAL, REMOTE = '10.213.0.1', '10.213.0.2'
+# Rates high enough that shaping never drops benchmark traffic; leaves keep HTB's fifo
+# so the layouts differ only in classification
+CLASSES = (HTBClass('1:10', '10gbit', '10gbit', 0), HTBClass('1:20', '10gbit', '10gbit', 1),
+           HTBClass('1:30', '10gbit', '10gbit', 2))
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def run(command, check=True):
+    return subprocess.run(command, shell=True, capture_output=True, text=True, check=check)
+
+
+def setup_link():
+    run(f'ip link del {DEVICE}', check=False)
+    run(f'ip link add {DEVICE} type veth peer name {PEER}')
+    run(f'ip link set {DEVICE} up && ip link set {PEER} up')
+    run(f'ip addr add {LOCAL}/30 dev {DEVICE}')
+    mac = open(f'/sys/class/net/{PEER}/address').read().strip()
+    # The peer has no address, so packets are dropped right after the veth hop
+    run(f'ip neigh replace {REMOTE} lladdr {mac} dev {DEVICE} nud permanent')
+
+
+def legacy_program(ports):
+    """The pre-compiler hierarchy: every filter added at prio 0, i.e. its own classifier instance"""
+    program = TCProgram(DEVICE, classes=CLASSES, classifier='linear', leaf_qdisc=None)
+    lines = [line for line in program.compile() if not line.startswith('filter ')]
+    for port in ports:
+        for direction in ('dport', 'sport'):
+            lines.append(f"filter add dev {DEVICE} protocol ip parent 1:0 prio 0 u32 "
+                         f"match ip {direction} {port} 0xffff flowid 1:10")
+    return lines
+
+
+def install(layout, ports):
+    if layout == 'legacy':
+        lines = legacy_program(ports)
+        subprocess.run(['tc', '-force', '-batch', '-'], input='\n'.join(lines) + '\n',
+                       capture_output=True, text=True)
+        return 2 * len(ports)
+    program = TCProgram(DEVICE, classes=CLASSES, classifier=layout, leaf_qdisc=None)
+    if layout != 'none':
+        program.add_ports(ports, '1:10')
+    report = program.apply(force=True)
+    if report['errors']:
+        raise RuntimeError(f"{layout}: {report['errors']}")
+    return program.cost()
+
+
+def class_packets(classid):
+    output = run(f'tc -s class show dev {DEVICE} classid {classid}').stdout
+    for line in output.splitlines():
+        if 'Sent' in line:
+            return int(line.split()[3])
+    return 0
+
+
+def send(ports, packets):
+    """Sender CPU seconds for packets UDP datagrams cycling through ports"""
+    payload = b'\0' * 64
+    targets = [(REMOTE, port) for port in ports]
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((LOCAL, 0))
+        sendto = sock.sendto
+        rounds, rest = divmod(packets, len(targets))
+        start = time.process_time()
+        for _ in range(rounds):
+            for target in targets:
+                sendto(payload, target)
+        for target in targets[:rest]:
+            sendto(payload, target)
+        return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='tc classifier layout benchmark')
+    parser.add_argument('--packets', type=int, default=200000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    if not sys.platform.startswith('linux') or os.geteuid() != 0:
+        print('tc classifier benchmark needs root on Linux', file=sys.stderr)
+        return 2
+
+    ports = unique_ports(TrafficPrioritizer().gaming_ports.values())
+    port_set = set(ports)
+    # Misses walk every rule of a linear chain; hits stop at the matching one
+    traffic = {'hit': ports, 'miss': [port for port in range(40000, 40064) if port not in port_set]}
+
+    layouts = ('none', 'legacy', 'linear', 'hashed')
+    report = {'ports': len(ports), 'packets': args.packets, 'layouts': {}}
+    timings = {(layout, kind): [] for layout in layouts for kind in traffic}
+    classified = dict.fromkeys(timings, 0)
+    try:
+        setup_link()
+        # Layouts are interleaved within each run so drift in machine load hits all of them
+        for _ in range(args.runs):
+            for layout in layouts:
+                nodes = install(layout, ports)
+                report['layouts'].setdefault(layout, {'worst_case_nodes': nodes})
+                for kind, dports in traffic.items():
+                    before = class_packets('1:10')
+                    timings[layout, kind].append(send(dports, args.packets) / args.packets * 1e9)
+                    classified[layout, kind] += class_packets('1:10') - before
+    finally:
+        run(f'ip link del {DEVICE}', check=False)
+
+    for (layout, kind), values in timings.items():
+        # The fastest run is the one least disturbed by unrelated work
+        report['layouts'][layout][kind] = {
+            'ns_per_packet': round(min(values), 1), 'median_ns': round(median(values), 1),
+            'to_gaming_class': round(classified[layout, kind] / (args.packets * args.runs), 3)}
+
+    # Classification cost is what each layout adds over the filterless hierarchy
+    baseline = report['layouts']['none']
+    for entry in report['layouts'].values():
+        for kind in traffic:
+            entry[kind]['classify_ns'] = round(entry[kind]['ns_per_packet'] - baseline[kind]['ns_per_packet'], 1)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
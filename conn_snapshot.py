@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Connection Snapshot - Socket-to-process attribution straight from /proc
+Builds an inode -> (pid, comm) index once and refreshes only changed PIDs
+"""
+
+import os
+import socket
+import struct
+from collections import namedtuple
+
+SOCKET_TABLES = (
+    ('tcp', 'tcp', socket.AF_INET),
+    ('tcp6', 'tcp', socket.AF_INET6),
+    ('udp', 'udp', socket.AF_INET),
+    ('udp6', 'udp', socket.AF_INET6),
+)
+
+TCP_STATES = {
+    '01': 'ESTABLISHED', '02': 'SYN_SENT', '03': 'SYN_RECV', '04': 'FIN_WAIT1',
+    '05': 'FIN_WAIT2', '06': 'TIME_WAIT', '07': 'CLOSE', '08': 'CLOSE_WAIT',
+    '09': 'LAST_ACK', '0A': 'LISTEN', '0B': 'CLOSING',
+}
+
+SocketEntry = namedtuple('SocketEntry', 'proto laddr lport raddr rport state inode pid name')
+
+
+def decode_address(hex_address, family):
+    """Decode a /proc/net address such as '0100007F:0035' into (ip, port)"""
+    host, port = hex_address.split(':')
+    if family == socket.AF_INET:
+        packed = struct.pack('<I', int(host, 16))
+    else:
+        packed = b''.join(struct.pack('<I', int(host[i:i + 8], 16)) for i in range(0, 32, 8))
+    return socket.inet_ntop(family, packed), int(port, 16)
+
+
+class ConnectionSnapshot:
+    """Join /proc/net/{tcp,udp}[6] against a per-PID socket inode index"""
+
+    def __init__(self, proc_root='/proc'):
+        self.proc_root = proc_root
+        # pid -> {'start', 'comm', 'fds', 'inodes'}
+        self.processes = {}
+        self.inode_owner = {}
+        # Inodes no process in this namespace owns (kernel sockets, other netns)
+        self.orphans = set()
+        self.rows = []
+
+    @staticmethod
+    def available():
+        return os.path.exists('/proc/net/tcp')
+
+    def _read_tables(self):
+        """Raw (proto, family, fields) rows from every socket table"""
+        rows = []
+        for table, proto, family in SOCKET_TABLES:
+            try:
+                with open(os.path.join(self.proc_root, 'net', table), 'r') as f:
+                    lines = f.read().splitlines()[1:]
+            except OSError:
+                continue
+            for line in lines:
+                rows.append((proto, family, line.split()))
+        return rows
+
+    def _start_time(self, pid):
+        """Process start time, used to detect PID reuse"""
+        try:
+            with open(os.path.join(self.proc_root, str(pid), 'stat'), 'rb') as f:
+                stat = f.read()
+            # comm may contain spaces, so split after the closing paren
+            return int(stat[stat.rindex(b')') + 2:].split()[19])
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _scan_fds(self, pid, entry, fds):
+        """readlink each fd of pid and rebuild its socket inode set"""
+        fd_dir = os.path.join(self.proc_root, str(pid), 'fd')
+        for inode in entry['inodes']:
+            if self.inode_owner.get(inode) == pid:
+                del self.inode_owner[inode]
+
+        inodes = set()
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if target.startswith('socket:['):
+                inode = int(target[8:-1])
+                inodes.add(inode)
+                self.inode_owner[inode] = pid
+
+        entry['inodes'] = inodes
+        entry['fds'] = fds
+
+    def _refresh_processes(self, unresolved):
+        """Update the inode index, touching only PIDs that changed"""
+        live = set()
+        for name in os.listdir(self.proc_root):
+            if name.isdigit():
+                live.add(int(name))
+
+        for pid in list(self.processes):
+            if pid not in live:
+                self._forget(pid)
+
+        rescanned = set()
+        for pid in live:
+            start = self._start_time(pid)
+            entry = self.processes.get(pid)
+            if entry is not None and entry['start'] != start:
+                self._forget(pid)
+                entry = None
+            if entry is None:
+                entry = self.processes[pid] = {'start': start, 'comm': None,
+                                               'fds': None, 'inodes': set()}
+                try:
+                    with open(os.path.join(self.proc_root, str(pid), 'comm'), 'r') as f:
+                        entry['comm'] = f.read().strip()
+                except OSError:
+                    entry['comm'] = str(pid)
+
+            try:
+                fds = frozenset(os.listdir(os.path.join(self.proc_root, str(pid), 'fd')))
+            except OSError:
+                continue
+            if fds != entry['fds']:
+                self._scan_fds(pid, entry, fds)
+                rescanned.add(pid)
+
+        # An fd number reused for a new socket leaves the fd set unchanged;
+        # fall back to rescanning socket holders only if inodes are still unknown
+        if any(inode not in self.inode_owner for inode in unresolved):
+            for pid, entry in self.processes.items():
+                if entry['inodes'] and pid not in rescanned and entry['fds'] is not None:
+                    self._scan_fds(pid, entry, entry['fds'])
+
+    def _forget(self, pid):
+        entry = self.processes.pop(pid)
+        for inode in entry['inodes']:
+            if self.inode_owner.get(inode) == pid:
+                del self.inode_owner[inode]
+
+    def refresh(self):
+        """Take a new snapshot of the socket tables and owning processes"""
+        self.rows = self._read_tables()
+        current = set()
+        for _, _, fields in self.rows:
+            current.add(int(fields[9]))
+        current.discard(0)
+
+        unresolved = {inode for inode in current
+                      if inode not in self.inode_owner and inode not in self.orphans}
+        self._refresh_processes(unresolved)
+        self.orphans = {inode for inode in (self.orphans & current) | unresolved
+                        if inode not in self.inode_owner}
+        return self
+
+    def resolve(self, inodes):
+        """Index owners for sockets found by another source (e.g. sock_diag) without reading the tables"""
+        current = set(inodes)
+        current.discard(0)
+        unresolved = {inode for inode in current
+                      if inode not in self.inode_owner and inode not in self.orphans}
+        # No new sockets means no process can have gained one worth attributing
+        if unresolved:
+            self._refresh_processes(unresolved)
+        self.orphans = {inode for inode in (self.orphans & current) | unresolved
+                        if inode not in self.inode_owner}
+        return self
+
+    def owner(self, inode):
+        """(pid, comm) owning a socket inode, or (None, None)"""
+        pid = self.inode_owner.get(inode)
+        if pid is None:
+            return None, None
+        return pid, self.processes[pid]['comm']
+
+    def count_by_process(self):
+        """{pid: socket count} without decoding any addresses"""
+        counts = {}
+        owner = self.inode_owner
+        for _, _, fields in self.rows:
+            pid = owner.get(int(fields[9]))
+            if pid is not None:
+                counts[pid] = counts.get(pid, 0) + 1
+        return counts
+
+    def connections(self, states=None):
+        """Decoded SocketEntry rows, optionally filtered by state name"""
+        entries = []
+        for proto, family, fields in self.rows:
+            state = TCP_STATES.get(fields[3], fields[3]) if proto == 'tcp' else (
+                'ESTABLISHED' if fields[3] == '01' else 'NONE')
+            if states and state not in states:
+                continue
+            inode = int(fields[9])
+            pid, name = self.owner(inode)
+            laddr, lport = decode_address(fields[1], family)
+            raddr, rport = decode_address(fields[2], family)
+            entries.append(SocketEntry(proto, laddr, lport, raddr, rport, state, inode, pid, name))
+        return entries
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+DNS Probe Engine - Concurrent multi-sample resolver latency testing
+Probes every primary and secondary resolver at once under a global deadline
+using real UDP DNS queries built in wire format
+"""
+
+import asyncio
+import random
+import struct
+import time
+
+from probe_stats import summarize, score
+
+# Public resolvers tested by find_fastest_dns (primary first)
+DNS_PROVIDERS = {
+    'Cloudflare': ['1.1.1.1', '1.0.0.1'],
+    'Google': ['8.8.8.8', '8.8.4.4'],
+    'Quad9': ['9.9.9.9', '149.112.112.112'],
+    'OpenDNS': ['208.67.222.222', '208.67.220.220'],
+    'AdGuard': ['94.140.14.14', '94.140.15.15'],
+}
+
+# Popular name that every public resolver keeps warm
+CACHED_NAME = 'www.google.com'
+
+# Zone under which random labels are queried to force a recursive lookup
+UNCACHED_ZONE = 'example.com'
+
+# RCODEs that mean the resolver did the lookup: NOERROR, and NXDOMAIN for the random labels
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+ANSWER_RCODES = (RCODE_NOERROR, RCODE_NXDOMAIN)
+
+
+def build_query(qid, name, qtype=1):
+    """Build a recursive DNS query (class IN) in wire format"""
+    header = struct.pack('!HHHHHH', qid, 0x0100, 1, 0, 0, 0)
+    labels = b''.join(bytes([len(label)]) + label.encode('ascii')
+                      for label in name.rstrip('.').split('.'))
+    return header + labels + b'\x00' + struct.pack('!HH', qtype, 1)
+
+
+def parse_response(data):
+    """(ID, answered) of a DNS response datagram, or None if it is not one; answered is
+    False for error RCODEs (FORMERR, SERVFAIL, NOTIMP, REFUSED, ...), which time nothing"""
+    if len(data) < 12:
+        return None
+    qid, flags = struct.unpack_from('!HH', data)
+    if not flags & 0x8000:
+        return None
+    return qid, (flags & 0x000f) in ANSWER_RCODES
+
+
+class _DNSClientProtocol(asyncio.DatagramProtocol):
+    """One UDP socket per resolver; matches replies to in-flight query IDs"""
+
+    def __init__(self):
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        response = parse_response(data)
+        if response is None:
+            return
+        qid, answered = response
+        waiter = self.pending.pop(qid, None)
+        if waiter and not waiter[0].done():
+            # A refusal or SERVFAIL comes back fast but resolved nothing: count it as lost
+            waiter[0].set_result((time.perf_counter() - waiter[1]) * 1000 if answered else None)
+
+    def error_received(self, exc):
+        # ICMP unreachable: nothing in flight on this socket will be answered
+        self._fail_pending()
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self._fail_pending()
+
+    def _fail_pending(self):
+        for future, _ in self.pending.values():
+            if not future.done():
+                future.set_result(None)
+        self.pending.clear()
+
+    async def query(self, name, deadline):
+        """Send one query and return its RTT in ms, or None on timeout/error"""
+        loop = asyncio.get_running_loop()
+        remaining = deadline - loop.time()
+        if remaining <= 0 or self.transport is None:
+            return None
+
+        qid = random.getrandbits(16)
+        while qid in self.pending:
+            qid = random.getrandbits(16)
+
+        future = loop.create_future()
+        self.pending[qid] = (future, time.perf_counter())
+        self.transport.sendto(build_query(qid, name))
+        try:
+            return await asyncio.wait_for(future, remaining)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.pending.pop(qid, None)
+
+
+class DNSProbeEngine:
+    """Sample many resolvers concurrently and rank them on median, p95 and loss"""
+
+    def __init__(self, samples=5, timeout=2.0, spacing=0.02, port=53,
+                 max_in_flight=256, loss_penalty=1000.0,
+                 cached_name=CACHED_NAME, uncached_zone=UNCACHED_ZONE):
+        self.samples = samples
+        self.timeout = timeout
+        self.spacing = spacing
+        self.port = port
+        self.max_in_flight = max_in_flight
+        self.loss_penalty = loss_penalty
+        self.cached_name = cached_name
+        self.uncached_zone = uncached_zone
+
+    def _uncached_name(self):
+        """Random label the resolver cannot have cached"""
+        return f"{random.getrandbits(48):012x}.{self.uncached_zone}"
+
+    async def _sample(self, protocol, name, delay, deadline, semaphore):
+        """Run one staggered query over the resolver's shared socket"""
+        if delay:
+            await asyncio.sleep(delay)
+        async with semaphore:
+            return await protocol.query(name, deadline)
+
+    async def _probe_server(self, server, deadline, semaphore):
+        """Pipeline cached and uncached queries to one resolver over one socket"""
+        loop = asyncio.get_running_loop()
+        try:
+            transport, protocol = await loop.create_datagram_endpoint(
+                _DNSClientProtocol, remote_addr=(server, self.port))
+        except OSError:
+            return [], []
+
+        try:
+            uncached = asyncio.gather(*(
+                self._sample(protocol, self._uncached_name(), i * self.spacing, deadline, semaphore)
+                for i in range(self.samples)))
+
+            # Warm the cached name first so every timed sample is a cache hit
+            await self._sample(protocol, self.cached_name, 0, deadline, semaphore)
+            cached = await asyncio.gather(*(
+                self._sample(protocol, self.cached_name, i * self.spacing, deadline, semaphore)
+                for i in range(self.samples)))
+            uncached = await uncached
+        finally:
+            transport.close()
+
+        return ([rtt for rtt in cached if rtt is not None],
+                [rtt for rtt in uncached if rtt is not None])
+
+    async def probe_async(self, servers):
+        """Probe all servers concurrently; returns {server: summary}"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        measured = await asyncio.gather(*(
+            self._probe_server(server, deadline, semaphore) for server in servers))
+
+        results = {}
+        for server, (cached, uncached) in zip(servers, measured):
+            summary = summarize(cached + uncached, 2 * self.samples)
+            summary['cached'] = summarize(cached, self.samples)
+            summary['uncached'] = summarize(uncached, self.samples)
+            results[server] = summary
+        return results
+
+    def probe(self, servers):
+        """Blocking wrapper around probe_async"""
+        return asyncio.run(self.probe_async(list(dict.fromkeys(servers))))
+
+    def rank_providers(self, providers=None):
+        """Probe every address of every provider and return providers best-first"""
+        providers = providers or DNS_PROVIDERS
+        all_servers = [server for servers in providers.values() for server in servers]
+        return self.rank(providers, self.probe(all_servers))
+
+    def rank(self, providers, results):
+        """Rank providers best-first from per-server summaries"""
+        ranking = []
+        for name, servers in providers.items():
+            # Fastest address of the provider becomes the primary
+            ordered = sorted(servers, key=lambda s: score(results[s], self.loss_penalty))
+            pooled = [rtt for s in servers for rtt in results[s]['samples']]
+            summary = summarize(pooled, sum(results[s]['sent'] for s in servers))
+            ranking.append({
+                'name': name,
+                'servers': ordered,
+                'summary': summary,
+                'per_server': {s: results[s] for s in servers},
+                'score': score(summary, self.loss_penalty),
+            })
+
+        ranking.sort(key=lambda entry: entry['score'])
+        return ranking
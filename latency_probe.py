@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+Latency Probe - In-process ICMP/UDP/TCP round-trip measurement
+Probes many targets over one event loop and streams samples as they arrive
+"""
+
+import asyncio
+import errno
+import socket
+import struct
+import time
+from collections import OrderedDict
+
+from probe_stats import summarize_sequence
+from traceroute_engine import IP_RECVERR, IPV6_RECVERR
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+# Payload marker so UDP echo replies can be told apart from stray datagrams
+PROBE_MAGIC = b'NOPR'
+PAYLOAD_SIZE = 56
+
+# Receive buffer asked for on shared sockets; the kernel caps it at net.core.rmem_max
+SHARED_RCVBUF = 4 * 1024 * 1024
+
+# Fallback destinations when ICMP datagram sockets are not permitted
+DEFAULT_UDP_PORT = 33434
+DEFAULT_TCP_PORT = 443
+
+
+def icmp_checksum(data):
+    """RFC 1071 internet checksum"""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def build_payload(seq, size=PAYLOAD_SIZE):
+    """Probe payload carrying the sequence number and send timestamp"""
+    header = PROBE_MAGIC + struct.pack('!Hd', seq, time.perf_counter())
+    return header + b'\x00' * max(0, size - len(header))
+
+
+def parse_payload(data):
+    """Sequence number from an echoed probe payload, or None"""
+    if len(data) < 6 or data[:4] != PROBE_MAGIC:
+        return None
+    return struct.unpack_from('!H', data, 4)[0]
+
+
+def build_echo_request(seq, ipv6=False, size=PAYLOAD_SIZE):
+    """ICMP(v6) echo request; the kernel fills in the identifier for ping sockets"""
+    icmp_type = ICMPV6_ECHO_REQUEST if ipv6 else ICMP_ECHO_REQUEST
+    payload = build_payload(seq, size)
+    header = struct.pack('!BBHHH', icmp_type, 0, 0, 0, seq)
+    if ipv6:
+        # ICMPv6 checksums cover a pseudo-header the kernel computes itself
+        return header + payload
+    checksum = icmp_checksum(header + payload)
+    return struct.pack('!BBHHH', icmp_type, 0, checksum, 0, seq) + payload
+
+
+def parse_echo_reply(data, ipv6=False):
+    """Sequence number of an ICMP(v6) echo reply, or None"""
+    if len(data) < 8:
+        return None
+    if data[0] != (ICMPV6_ECHO_REPLY if ipv6 else ICMP_ECHO_REPLY):
+        return None
+    return struct.unpack_from('!H', data, 6)[0]
+
+
+def icmp_available(family=socket.AF_INET):
+    """True if the kernel lets this user open an ICMP datagram (ping) socket"""
+    proto = socket.IPPROTO_ICMPV6 if family == socket.AF_INET6 else socket.IPPROTO_ICMP
+    try:
+        socket.socket(family, socket.SOCK_DGRAM, proto).close()
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+class _EchoProtocol(asyncio.DatagramProtocol):
+    """Match echo replies on one socket back to in-flight sequence numbers"""
+
+    def __init__(self, parse_reply, unreachable_is_reply=False, address=None):
+        self.parse_reply = parse_reply
+        self.unreachable_is_reply = unreachable_is_reply
+        # Destination for sockets handed over unconnected (ping sockets)
+        self.address = address
+        self.pending = OrderedDict()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self._resolve(self.parse_reply(data))
+
+    def error_received(self, exc):
+        # UDP to a closed port: the ICMP port unreachable is the reply
+        if self.unreachable_is_reply and isinstance(exc, ConnectionRefusedError) and self.pending:
+            self._resolve(next(iter(self.pending)))
+
+    def connection_lost(self, exc):
+        self.transport = None
+
+    def _resolve(self, seq):
+        waiter = self.pending.pop(seq, None)
+        if waiter and not waiter[0].done():
+            waiter[0].set_result((time.perf_counter() - waiter[1]) * 1000)
+
+    async def send(self, seq, packet, timeout):
+        """Send packet and wait for its reply; RTT in ms or None"""
+        if self.transport is None:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self.pending[seq] = (future, time.perf_counter())
+        self.transport.sendto(packet, self.address)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.pending.pop(seq, None)
+
+
+class _SharedEchoSocket:
+    """One unconnected datagram socket probing many targets; replies match on (source, seq)"""
+
+    def __init__(self, sock, kind, family, port, payload_size):
+        self.sock = sock
+        self.kind = kind
+        self.family = family
+        self.ipv6 = family == socket.AF_INET6
+        self.port = port
+        self.payload_size = payload_size
+        # (packed address, seq) -> (future, send time)
+        self.pending = {}
+        self.seq = 0
+        try:
+            # Replies (and queued ICMP errors) for a whole cycle's targets share one buffer
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SHARED_RCVBUF)
+        except OSError:
+            pass
+        if kind == 'udp':
+            # Unconnected UDP sockets only hear about port unreachables through the error queue
+            if self.ipv6:
+                sock.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVERR, 1)
+            else:
+                sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(sock.fileno(), self._on_readable)
+
+    def _key(self, address, seq):
+        try:
+            return socket.inet_pton(self.family, address), seq
+        except (OSError, ValueError):
+            return address, seq
+
+    def _on_readable(self):
+        now = time.perf_counter()
+        if self.kind == 'udp':
+            self._drain_errors(now)
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                # A queued ICMP error reported through recvfrom; the error queue holds the detail
+                self._drain_errors(now)
+                continue
+            if self.kind == 'icmp':
+                seq = parse_echo_reply(data, self.ipv6)
+            else:
+                seq = parse_payload(data)
+            if seq is not None:
+                self._resolve(self._key(addr[0], seq), now)
+
+    def _drain_errors(self, now):
+        # UDP to a closed port: the ICMP port unreachable is the reply. The error message
+        # carries the original destination and as much of the probe as the ICMP quoted
+        while True:
+            try:
+                data, ancdata, _, addr = self.sock.recvmsg(64, 512, socket.MSG_ERRQUEUE)
+            except OSError:
+                break
+            refused = any(len(cmsg) >= 4 and struct.unpack_from('=I', cmsg)[0] == errno.ECONNREFUSED
+                          for level, kind, cmsg in ancdata
+                          if (level, kind) in ((socket.IPPROTO_IP, IP_RECVERR),
+                                               (socket.IPPROTO_IPV6, IPV6_RECVERR)))
+            if not refused or not addr:
+                continue
+            seq = parse_payload(data)
+            if seq is not None:
+                self._resolve(self._key(addr[0], seq), now)
+                continue
+            # Quote too short to hold the payload: credit the oldest probe to that address
+            address = self._key(addr[0], 0)[0]
+            key = next((key for key in self.pending if key[0] == address), None)
+            if key is not None:
+                self._resolve(key, now)
+
+    def _resolve(self, key, now):
+        waiter = self.pending.pop(key, None)
+        if waiter and not waiter[0].done():
+            waiter[0].set_result((now - waiter[1]) * 1000)
+
+    async def send(self, address, timeout):
+        """Probe address once; RTT in ms or None"""
+        if self.sock is None:
+            return None
+        # One sequence space across all targets, so a late reply from an earlier
+        # probe to the same address cannot be taken for this one
+        self.seq = seq = (self.seq + 1) & 0xffff
+        if self.kind == 'icmp':
+            packet = build_echo_request(seq, self.ipv6, self.payload_size)
+        else:
+            packet = build_payload(seq, self.payload_size)
+        key = self._key(address, seq)
+        future = self.loop.create_future()
+        self.pending[key] = (future, time.perf_counter())
+        try:
+            try:
+                self.sock.sendto(packet, (address, self.port))
+            except OSError:
+                # A send reports (and clears) the ICMP error an earlier probe left pending
+                self.sock.sendto(packet, (address, self.port))
+            return await asyncio.wait_for(future, timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        finally:
+            self.pending.pop(key, None)
+
+    def close(self):
+        if self.sock is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+
+class LatencyProber:
+    """Measure RTT to many targets at once with ICMP, UDP or TCP probes"""
+
+    def __init__(self, count=10, interval=0.2, timeout=1.0, transport='auto',
+                 udp_port=DEFAULT_UDP_PORT, tcp_port=DEFAULT_TCP_PORT, payload_size=PAYLOAD_SIZE,
+                 max_in_flight=256, bind_device=None, source_address=None, shared_sockets=False):
+        self.count = count
+        self.interval = interval
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.transport = transport
+        self.udp_port = udp_port
+        self.tcp_port = tcp_port
+        self.payload_size = payload_size
+        # Pin probes to one egress path: an interface (SO_BINDTODEVICE) and/or a source address
+        self.bind_device = bind_device
+        self.source_address = source_address
+        # Probe every target through one unconnected socket per transport and family, kept
+        # open across calls on the same event loop until close(). Long-running monitors use
+        # this instead of opening a socket per target per cycle
+        self.shared_sockets = shared_sockets
+        self._shared = {}
+        self._shared_loop = None
+
+    def _pick_transport(self, family):
+        if self.transport != 'auto':
+            return self.transport
+        return 'icmp' if icmp_available(family) else 'tcp'
+
+    async def _resolve(self, target):
+        """(family, address) for a host name or literal"""
+        # Literals skip the resolver thread pool entirely
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                socket.inet_pton(family, target)
+                return family, target
+            except (OSError, ValueError):
+                pass
+        loop = asyncio.get_running_loop()
+        infos = await asyncio.wait_for(
+            loop.getaddrinfo(target, None, type=socket.SOCK_DGRAM), self.timeout)
+        family, _, _, _, sockaddr = infos[0]
+        return family, sockaddr[0]
+
+    def _socket(self, family, kind, proto=0):
+        """Non-blocking socket bound to the configured device and source address"""
+        sock = socket.socket(family, kind, proto)
+        try:
+            sock.setblocking(False)
+            if self.bind_device:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, self.bind_device.encode())
+            if self.source_address:
+                sock.bind((self.source_address, 0))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    async def _open_datagram(self, kind, family, address):
+        """Connected datagram endpoint and a packet builder for seq numbers"""
+        loop = asyncio.get_running_loop()
+        ipv6 = family == socket.AF_INET6
+        size = self.payload_size
+        if kind == 'icmp':
+            proto = socket.IPPROTO_ICMPV6 if ipv6 else socket.IPPROTO_ICMP
+            sock = self._socket(family, socket.SOCK_DGRAM, proto)
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda: _EchoProtocol(lambda data: parse_echo_reply(data, ipv6), address=(address, 0)),
+                sock=sock)
+            return transport, protocol, lambda seq: build_echo_request(seq, ipv6, size)
+
+        sock = self._socket(family, socket.SOCK_DGRAM)
+        try:
+            sock.connect((address, self.udp_port))
+        except OSError:
+            sock.close()
+            raise
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: _EchoProtocol(parse_payload, unreachable_is_reply=True), sock=sock)
+        return transport, protocol, lambda seq: build_payload(seq, size)
+
+    def _shared_socket(self, kind, family):
+        """The long-lived socket for a transport and family, opened on first use"""
+        loop = asyncio.get_running_loop()
+        if self._shared_loop is not loop:
+            # Sockets registered with an earlier loop cannot be used from this one
+            self._shared = {}
+            self._shared_loop = loop
+        shared = self._shared.get((kind, family))
+        if shared is None:
+            if kind == 'icmp':
+                proto = socket.IPPROTO_ICMPV6 if family == socket.AF_INET6 else socket.IPPROTO_ICMP
+                port = 0
+            else:
+                proto, port = 0, self.udp_port
+            sock = self._socket(family, socket.SOCK_DGRAM, proto)
+            try:
+                shared = _SharedEchoSocket(sock, kind, family, port, self.payload_size)
+            except OSError:
+                sock.close()
+                raise
+            self._shared[(kind, family)] = shared
+        return shared
+
+    def close(self):
+        """Close the shared sockets; call from the loop they were opened on"""
+        for shared in self._shared.values():
+            shared.close()
+        self._shared = {}
+
+    async def _tcp_sample(self, family, address, timeout):
+        """TCP handshake time; a RST also proves the host answered"""
+        loop = asyncio.get_running_loop()
+        try:
+            sock = self._socket(family, socket.SOCK_STREAM)
+        except OSError:
+            return None
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (address, self.tcp_port)), timeout)
+            return (time.perf_counter() - start) * 1000
+        except ConnectionRefusedError:
+            return (time.perf_counter() - start) * 1000
+        except (OSError, asyncio.TimeoutError):
+            return None
+        finally:
+            sock.close()
+
+    def window(self):
+        """Seconds one target's probe train takes, including the last reply timeout"""
+        return (self.count - 1) * self.interval + self.timeout
+
+    async def probe_target(self, target, offset=0.0, on_sample=None, semaphore=None):
+        """Probe one target; offset staggers its schedule against other targets"""
+        loop = asyncio.get_running_loop()
+        semaphore = semaphore or asyncio.Semaphore(self.max_in_flight)
+        try:
+            family, address = await self._resolve(target)
+        except (OSError, UnicodeError, asyncio.TimeoutError):
+            return self._result(target, None, [None] * self.count, error='could not resolve')
+
+        kind = self._pick_transport(family)
+        transport = protocol = build = shared = None
+        if kind != 'tcp':
+            try:
+                if self.shared_sockets:
+                    shared = self._shared_socket(kind, family)
+                else:
+                    transport, protocol, build = await self._open_datagram(kind, family, address)
+            except OSError as e:
+                return self._result(target, kind, [None] * self.count, error=str(e))
+
+        start = loop.time() + offset
+        # Probes delayed by the in-flight limit still have to finish in the window
+        deadline = start + self.window()
+        rtts = [None] * self.count
+
+        async def one(seq):
+            delay = start + seq * self.interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            rtt = None
+            async with semaphore:
+                timeout = min(self.timeout, deadline - loop.time())
+                if timeout > 0 and kind == 'tcp':
+                    rtt = await self._tcp_sample(family, address, timeout)
+                elif timeout > 0 and shared is not None:
+                    rtt = await shared.send(address, timeout)
+                elif timeout > 0:
+                    rtt = await protocol.send(seq, build(seq), timeout)
+            rtts[seq] = rtt
+            if on_sample:
+                on_sample(target, seq, rtt)
+
+        try:
+            await asyncio.gather(*(one(seq) for seq in range(self.count)))
+        finally:
+            if transport is not None:
+                transport.close()
+        return self._result(target, kind, rtts)
+
+    def _result(self, target, kind, rtts, error=None):
+        result = summarize_sequence(rtts)
+        result.update({
+            'target': target,
+            'transport': kind,
+            'error': error,
+        })
+        return result
+
+    async def probe_many_async(self, targets, on_sample=None):
+        """Probe every target concurrently on the running loop"""
+        targets = list(dict.fromkeys(targets))
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        # Spread targets across one interval so their probes interleave
+        step = self.interval / len(targets) if targets else 0
+        results = await asyncio.gather(*(
+            self.probe_target(target, i * step, on_sample, semaphore)
+            for i, target in enumerate(targets)))
+        return dict(zip(targets, results))
+
+    def probe_many(self, targets, on_sample=None):
+        """Blocking wrapper around probe_many_async"""
+        return asyncio.run(self.probe_many_async(targets, on_sample))
+
+    def probe(self, target, on_sample=None):
+        return self.probe_many([target], on_sample)[target]
+
+    async def stream(self, targets):
+        """Async iterator of (target, seq, rtt) as samples arrive"""
+        queue = asyncio.Queue()
+        task = asyncio.ensure_future(self.probe_many_async(
+            targets, lambda target, seq, rtt: queue.put_nowait((target, seq, rtt))))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            yield item
+        await task
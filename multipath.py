@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Multipath - Compare the paths to one destination through every uplink
+Probes through each candidate interface at the same time, pinned with
+SO_BINDTODEVICE or the interface's source address, and ranks the paths
+"""
+
+import asyncio
+import socket
+import struct
+from collections import OrderedDict, namedtuple
+
+from latency_probe import LatencyProber
+from probe_stats import score
+from routing_table import RoutingTable
+
+NetworkPath = namedtuple('NetworkPath', 'interface gateway source metric prefix_len')
+
+SIOCGIFADDR = 0x8915
+
+
+def interface_address(interface, family=socket.AF_INET, proc_net='/proc/net'):
+    """Primary address of an interface (global scope for IPv6), or None"""
+    if family == socket.AF_INET6:
+        try:
+            with open(f'{proc_net}/if_inet6') as f:
+                for line in f:
+                    fields = line.split()
+                    # Scope 00 is global; link-local addresses would need a scope id
+                    if len(fields) == 6 and fields[5] == interface and fields[3] == '00':
+                        return socket.inet_ntop(socket.AF_INET6, bytes.fromhex(fields[0]))
+        except OSError:
+            pass
+        return None
+    try:
+        import fcntl
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            request = struct.pack('256s', interface.encode()[:15])
+            return socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)[20:24])
+    except (OSError, ImportError):
+        return None
+
+
+def can_bind_device(interface):
+    """True if this process may pin sockets with SO_BINDTODEVICE (CAP_NET_RAW)"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, interface.encode())
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+class MultipathProber:
+    """Probe a destination through every candidate interface at once and rank the paths"""
+
+    def __init__(self, count=10, interval=0.2, timeout=1.0, bind='auto', jitter_weight=1.0,
+                 table=None, **probe_options):
+        self.count = count
+        self.interval = interval
+        self.timeout = timeout
+        # 'device' (SO_BINDTODEVICE), 'source' (bind to the interface address) or 'auto'
+        self.bind = bind
+        self.jitter_weight = jitter_weight
+        self.table = table or RoutingTable()
+        self.probe_options = probe_options
+
+    def paths(self, address):
+        """One candidate path per interface with a route covering address
+
+        SO_BINDTODEVICE selects an interface, not a next hop, so gateways
+        sharing an interface collapse into that interface's best route.
+        """
+        self.table.refresh()
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        paths = OrderedDict()
+        for route in self.table.candidates(address):
+            if route.interface in paths or route.interface == 'lo':
+                continue
+            paths[route.interface] = NetworkPath(route.interface, route.gateway,
+                                                 interface_address(route.interface, family),
+                                                 route.metric, route.prefix_len)
+        return list(paths.values())
+
+    def _prober(self, path):
+        device = self.bind == 'device' or (self.bind == 'auto' and can_bind_device(path.interface))
+        return LatencyProber(count=self.count, interval=self.interval, timeout=self.timeout,
+                             bind_device=path.interface if device else None,
+                             source_address=None if device else path.source,
+                             **self.probe_options)
+
+    async def compare_async(self, destination, paths=None):
+        """Results per path, best score first; each carries 'path', 'score' and 'current'"""
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await asyncio.wait_for(
+                loop.getaddrinfo(destination, None, type=socket.SOCK_DGRAM), self.timeout)
+        except (OSError, UnicodeError, asyncio.TimeoutError):
+            return []
+        address = infos[0][4][0]
+        paths = self.paths(address) if paths is None else paths
+        current = self.table.lookup(address)
+
+        # Room for every probe of every path: a smaller limit lets a dead path's probes sit
+        # in the slots for a full timeout each and starve the live paths into false loss
+        semaphore = asyncio.Semaphore(max(len(paths), 1) * self.count)
+        step = self.interval / len(paths) if paths else 0
+        results = await asyncio.gather(*(
+            self._prober(path).probe_target(address, i * step, semaphore=semaphore)
+            for i, path in enumerate(paths)))
+
+        ranking = []
+        for path, result in zip(paths, results):
+            result.update({'path': path, 'score': score(result, jitter_weight=self.jitter_weight),
+                           'current': current is not None and current.interface == path.interface})
+            ranking.append(result)
+        ranking.sort(key=lambda result: result['score'])
+        return ranking
+
+    def compare(self, destination, paths=None):
+        """Blocking wrapper around compare_async"""
+        return asyncio.run(self.compare_async(destination, paths))
@@ -4,23 +4,41 @@ Network Optimizer Pro - Comprehensive Network Optimization Toolkit
 Reduces latency, optimizes routing, and monitors network performance
 """
 
+# Heavy and platform-specific modules (psutil, subprocess, asyncio-based
+# probes, json, ...) are imported inside the methods that need them so the
+# monitoring paths such as --stats start as fast as possible.
 import os
 import sys
-import platform
-import subprocess
-import socket
 import time
-import psutil
-import json
-from datetime import datetime
-from pathlib import Path
+
+from os_detect import os_type
 
 class NetworkOptimizer:
     def __init__(self):
-        self.os_type = platform.system()
+        self.os_type = os_type()
         self.is_admin = self.check_admin()
-        self.config_file = Path.home() / '.network_optimizer_config.json'
+        self.config_file = os.path.join(os.path.expanduser('~'), '.network_optimizer_config.json')
         self.load_config()
+        self._probe_cache = None
+        self._history = None
+        self.refresh = False
+        self.conn_snapshot = None
+    
+    @property
+    def probe_cache(self):
+        """Shared probe-result cache, opened on first use"""
+        if self._probe_cache is None:
+            from probe_cache import ProbeCache
+            self._probe_cache = ProbeCache()
+        return self._probe_cache
+    
+    @property
+    def history(self):
+        """Append-only probe sample history, opened on first use"""
+        if self._history is None:
+            from probe_history import ProbeHistory
+            self._history = ProbeHistory()
+        return self._history
         
     def check_admin(self):
         """Check if running with admin/root privileges"""
@@ -35,7 +53,8 @@ class NetworkOptimizer:
     
     def load_config(self):
         """Load saved configuration"""
-        if self.config_file.exists():
+        if os.path.exists(self.config_file):
+            import json
             with open(self.config_file, 'r') as f:
                 self.config = json.load(f)
         else:
@@ -47,6 +66,7 @@ class NetworkOptimizer:
     
     def save_config(self):
         """Save configuration"""
+        import json
         with open(self.config_file, 'w') as f:
             json.dump(self.config, f, indent=2)
     
@@ -60,42 +80,75 @@ class NetworkOptimizer:
         print()
     
     def test_dns_latency(self, dns_server, timeout=2):
-        """Test DNS server response time"""
+        """Test DNS server response time (median UDP query RTT for a cached name)"""
+        from dns_probe import DNSProbeEngine
         try:
-            start = time.time()
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(timeout)
-            sock.connect((dns_server, 53))
-            sock.close()
-            latency = (time.time() - start) * 1000
-            return latency
-        except:
+            summary = DNSProbeEngine(samples=3, timeout=timeout).probe([dns_server])[dns_server]
+            cached = summary['cached']
+            self.history.record('dns', dns_server,
+                                cached['samples'] + [None] * (cached['sent'] - cached['received']))
+            if summary['cached']['received']:
+                return summary['cached']['p50']
+            return 9999
+        except Exception:
             return 9999
     
-    def find_fastest_dns(self):
+    def find_fastest_dns(self, samples=5, timeout=2.0):
         """Find the fastest DNS servers"""
+        from dns_probe import DNSProbeEngine, DNS_PROVIDERS
         print("[*] Testing DNS servers for lowest latency...")
         
-        dns_servers = {
-            'Cloudflare': ['1.1.1.1', '1.0.0.1'],
-            'Google': ['8.8.8.8', '8.8.4.4'],
-            'Quad9': ['9.9.9.9', '149.112.112.112'],
-            'OpenDNS': ['208.67.222.222', '208.67.220.220'],
-            'AdGuard': ['94.140.14.14', '94.140.15.15'],
-        }
+        engine = DNSProbeEngine(samples=samples, timeout=timeout)
+        servers = [server for group in DNS_PROVIDERS.values() for server in group]
+        ranking = engine.rank(DNS_PROVIDERS, self.probe_dns_servers(engine, servers))
         
+        for entry in ranking:
+            summary = entry['summary']
+            if summary['received']:
+                primary = entry['per_server'][entry['servers'][0]]
+                split = ' / '.join(
+                    f"{kind} {primary[kind]['p50']:.2f}ms" if primary[kind]['received'] else f"{kind} -"
+                    for kind in ('cached', 'uncached'))
+                print(f"    {entry['name']}: p50 {summary['p50']:.2f}ms | "
+                      f"p95 {summary['p95']:.2f}ms | loss {summary['loss'] * 100:.0f}% ({split})")
+            else:
+                print(f"    {entry['name']}: TIMEOUT")
+        
+        fastest = ranking[0]
+        if not fastest['summary']['received']:
+            print("\n[-] No DNS server responded, keeping current servers")
+            return self.config['dns_servers']
+        
+        print(f"\n[+] Fastest DNS: {fastest['name']} ({fastest['summary']['p50']:.2f}ms median)")
+        return fastest['servers']
+    
+    def probe_dns_servers(self, engine, servers, ttl=300):
+        """Probe DNS servers, reusing cached results unless a refresh was requested"""
+        from probe_cache import source_address
         results = {}
-        for name, servers in dns_servers.items():
-            latency = self.test_dns_latency(servers[0])
-            results[name] = {'servers': servers, 'latency': latency}
-            print(f"    {name}: {latency:.2f}ms")
-        
-        fastest = min(results.items(), key=lambda x: x[1]['latency'])
-        print(f"\n[+] Fastest DNS: {fastest[0]} ({fastest[1]['latency']:.2f}ms)")
-        return fastest[1]['servers']
+        interfaces = {server: source_address(server) for server in servers}
+        
+        if not self.refresh:
+            for server in servers:
+                cached = self.probe_cache.get(server, 'dns', interfaces[server])
+                if cached is not None:
+                    results[server] = cached
+        
+        missing = [server for server in servers if server not in results]
+        if missing:
+            fresh = engine.probe(missing)
+            for server, summary in fresh.items():
+                self.probe_cache.put(server, 'dns', summary, interfaces[server], ttl)
+            self.probe_cache.save()
+            results.update(fresh)
+        else:
+            print("    (using cached results, pass --refresh to re-probe)")
+        
+        return results
     
     def set_dns_windows(self, dns_servers):
         """Set DNS servers on Windows"""
+        import subprocess
         try:
             # Get active network interface
             cmd = 'netsh interface show interface'
@@ -144,6 +197,7 @@ class NetworkOptimizer:
     
     def optimize_tcp_windows(self):
         """Optimize TCP/IP settings for Windows"""
+        import subprocess
         print("\n[*] Optimizing TCP/IP settings...")
         
         commands = [
@@ -172,30 +226,45 @@ class NetworkOptimizer:
         
         print("[+] TCP/IP optimization complete")
     
-    def optimize_tcp_linux(self):
+    def optimize_tcp_linux(self, extra_settings=None):
         """Optimize TCP/IP settings for Linux"""
+        from sysctl_engine import SysctlTransaction, TCP_LATENCY_SETTINGS
         print("\n[*] Optimizing TCP/IP settings...")
         
-        settings = {
-            'net.ipv4.tcp_fastopen': '3',
-            'net.ipv4.tcp_low_latency': '1',
-            'net.ipv4.tcp_timestamps': '1',
-            'net.ipv4.tcp_sack': '1',
-            'net.core.netdev_max_backlog': '5000',
-            'net.ipv4.tcp_congestion_control': 'bbr',
-        }
+        # Extra keys can come from the caller or the 'sysctl_settings' config entry
+        settings = dict(TCP_LATENCY_SETTINGS)
+        settings.update(self.config.get('sysctl_settings', {}))
+        settings.update(extra_settings or {})
         
-        for key, value in settings.items():
-            try:
-                subprocess.run(f'sysctl -w {key}={value}', shell=True, check=True, capture_output=True)
-                print(f"    ✓ {key}")
-            except:
-                pass
+        transaction = SysctlTransaction(settings)
+        ok = transaction.apply()
+        
+        for key, old, new in transaction.changed:
+            print(f"    ✓ {key}: {old} -> {new}")
+        for key in transaction.unchanged:
+            print(f"    = {key} (already {settings[key]})")
+        for key in transaction.unsupported:
+            print(f"    - {key} (not supported by this kernel)")
+        for key, reason in transaction.failed:
+            print(f"    ✗ {key}: {reason}")
+        
+        if not ok:
+            print(f"[-] Rolled back {len(transaction.changed)} setting(s)")
+            for key, reason in transaction.rollback_errors:
+                print(f"[-] Could not restore {key}: {reason}")
+            return transaction
+        
+        # Keep the original values so the tuning can be reverted later
+        backup = self.config.setdefault('sysctl_backup', {})
+        for key, old, _ in transaction.changed:
+            backup.setdefault(key, old)
         
         print("[+] TCP/IP optimization complete")
+        return transaction
     
     def flush_dns_cache(self):
         """Flush DNS cache"""
+        import subprocess
         print("\n[*] Flushing DNS cache...")
         try:
             if self.os_type == 'Windows':
@@ -208,132 +277,270 @@ class NetworkOptimizer:
         except Exception as e:
             print(f"[-] Could not flush DNS cache: {e}")
     
+    def _read_sysfs(self, path, default=0):
+        try:
+            with open(path, 'r') as f:
+                return int(f.read().strip(), 0)
+        except (OSError, ValueError):
+            return default
+    
+    def collect_network_stats(self):
+        """Interface, I/O and connection statistics as a plain dict"""
+        stats = {'interfaces': {}, 'io': {}, 'connections': 0}
+        
+        if self.os_type == 'Linux' and os.path.isdir('/sys/class/net'):
+            # procfs/sysfs fast path: no psutil import, no per-process fd scan
+            for iface in sorted(os.listdir('/sys/class/net')):
+                base = os.path.join('/sys/class/net', iface)
+                if self._read_sysfs(os.path.join(base, 'flags')) & 0x1:
+                    stats['interfaces'][iface] = {
+                        'speed': max(self._read_sysfs(os.path.join(base, 'speed')), 0),
+                        'mtu': self._read_sysfs(os.path.join(base, 'mtu')),
+                    }
+            
+            totals = [0, 0, 0, 0]
+            with open('/proc/net/dev', 'r') as f:
+                for line in f.readlines()[2:]:
+                    fields = line.split(':', 1)[1].split()
+                    totals[0] += int(fields[8])
+                    totals[1] += int(fields[0])
+                    totals[2] += int(fields[9])
+                    totals[3] += int(fields[1])
+            stats['io'] = dict(zip(('bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv'), totals))
+            
+            for table in ('tcp', 'tcp6', 'udp', 'udp6'):
+                try:
+                    with open(f'/proc/net/{table}', 'r') as f:
+                        stats['connections'] += max(sum(1 for _ in f) - 1, 0)
+                except OSError:
+                    pass
+            return stats
+        
+        import psutil
+        for iface, if_stats in psutil.net_if_stats().items():
+            if if_stats.isup:
+                stats['interfaces'][iface] = {'speed': if_stats.speed, 'mtu': if_stats.mtu}
+        net_io = psutil.net_io_counters()
+        stats['io'] = {'bytes_sent': net_io.bytes_sent, 'bytes_recv': net_io.bytes_recv,
+                       'packets_sent': net_io.packets_sent, 'packets_recv': net_io.packets_recv}
+        stats['connections'] = len(psutil.net_connections(kind='inet'))
+        return stats
+    
     def get_network_stats(self):
         """Get current network statistics"""
+        stats = self.collect_network_stats()
         print("\n[*] Current Network Statistics:")
         print("-" * 60)
         
         # Get network interfaces
-        interfaces = psutil.net_if_stats()
-        for iface, stats in interfaces.items():
-            if stats.isup:
-                print(f"\nInterface: {iface}")
-                print(f"  Speed: {stats.speed} Mbps")
-                print(f"  MTU: {stats.mtu}")
+        for iface, info in stats['interfaces'].items():
+            print(f"\nInterface: {iface}")
+            print(f"  Speed: {info['speed']} Mbps")
+            print(f"  MTU: {info['mtu']}")
         
         # Get network IO
-        net_io = psutil.net_io_counters()
+        net_io = stats['io']
         print(f"\nNetwork I/O:")
-        print(f"  Bytes Sent: {net_io.bytes_sent / 1024 / 1024:.2f} MB")
-        print(f"  Bytes Received: {net_io.bytes_recv / 1024 / 1024:.2f} MB")
-        print(f"  Packets Sent: {net_io.packets_sent}")
-        print(f"  Packets Received: {net_io.packets_recv}")
+        print(f"  Bytes Sent: {net_io['bytes_sent'] / 1024 / 1024:.2f} MB")
+        print(f"  Bytes Received: {net_io['bytes_recv'] / 1024 / 1024:.2f} MB")
+        print(f"  Packets Sent: {net_io['packets_sent']}")
+        print(f"  Packets Received: {net_io['packets_recv']}")
         
         # Get connections
-        connections = psutil.net_connections(kind='inet')
-        print(f"\nActive Connections: {len(connections)}")
+        print(f"\nActive Connections: {stats['connections']}")
+        return stats
     
-    def monitor_bandwidth(self, duration=10):
-        """Monitor bandwidth usage"""
-        print(f"\n[*] Monitoring bandwidth for {duration} seconds...")
+    def monitor_bandwidth(self, duration=10, interval=0.1, interfaces=None):
+        """Monitor per-interface bandwidth at sub-second resolution"""
+        from bandwidth_sampler import InterfaceSampler
+        print(f"\n[*] Monitoring bandwidth for {duration} seconds ({interval * 1000:.0f} ms samples)...")
         print("-" * 60)
         
-        old_value = psutil.net_io_counters()
-        time.sleep(1)
+        sampler = InterfaceSampler(interfaces=interfaces, interval=interval,
+                                   window=int(duration / interval) + 1)
+        last_print = [0.0]
         
-        for i in range(duration):
-            new_value = psutil.net_io_counters()
-            
-            upload_speed = (new_value.bytes_sent - old_value.bytes_sent) / 1024 / 1024
-            download_speed = (new_value.bytes_recv - old_value.bytes_recv) / 1024 / 1024
-            
-            print(f"[{i+1}/{duration}] ↑ {upload_speed:.2f} MB/s | ↓ {download_speed:.2f} MB/s", end='\r')
-            
-            old_value = new_value
-            time.sleep(1)
+        def show_live(sampler):
+            # Redraw at most once per second; the ring keeps every tick
+            now = time.perf_counter()
+            if now - last_print[0] < 1.0:
+                return
+            last_print[0] = now
+            parts = []
+            for name in sorted(sampler.rings):
+                rates = sampler.latest(name)
+                parts.append(f"{name} ↑ {rates['tx_bps'] / 1e6:.2f} ↓ {rates['rx_bps'] / 1e6:.2f} Mbit/s")
+            print(' | '.join(parts), end='\r')
+        
+        try:
+            sampler.run(duration, show_live)
+        finally:
+            sampler.close()
+        
+        print()
+        for name, stats in sampler.summary().items():
+            print(f"\nInterface: {name}")
+            for metric, label, scale, unit in (('rx_bps', 'Download', 1e6, 'Mbit/s'),
+                                               ('tx_bps', 'Upload', 1e6, 'Mbit/s'),
+                                               ('rx_pps', 'RX packets', 1, 'pps'),
+                                               ('tx_pps', 'TX packets', 1, 'pps')):
+                m = stats[metric]
+                print(f"  {label:10}: avg {m['avg'] / scale:9.2f} | min {m['min'] / scale:9.2f} | "
+                      f"p50 {m['p50'] / scale:9.2f} | p99 {m['p99'] / scale:9.2f} | "
+                      f"max {m['max'] / scale:9.2f} {unit}")
         
         print("\n[+] Monitoring complete")
     
-    def test_latency(self, host='8.8.8.8'):
+    def test_latency(self, host='8.8.8.8', count=10, interval=0.2):
         """Test latency to a host"""
+        from latency_probe import LatencyProber
         print(f"\n[*] Testing latency to {host}...")
         
-        if self.os_type == 'Windows':
-            cmd = f'ping -n 10 {host}'
-        else:
-            cmd = f'ping -c 10 {host}'
+        def show_sample(target, seq, rtt):
+            if rtt is None:
+                print(f"    seq={seq:<3} timeout")
+            else:
+                print(f"    seq={seq:<3} {rtt:.2f} ms")
         
         try:
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            print(result.stdout)
+            result = LatencyProber(count=count, interval=interval).probe(host, on_sample=show_sample)
         except Exception as e:
             print(f"[-] Error: {e}")
+            return None
+        
+        if result['error']:
+            print(f"[-] Error: {result['error']}")
+        elif result['received']:
+            print(f"\n[+] {result['transport'].upper()} {result['received']}/{result['sent']} replies, "
+                  f"{result['loss'] * 100:.0f}% loss")
+            print(f"    min/avg/p50/p99 = {result['min']:.2f}/{result['avg']:.2f}/"
+                  f"{result['p50']:.2f}/{result['p99']:.2f} ms | jitter {result['jitter']:.2f} ms")
+        else:
+            print("[-] No replies received")
+        return result
+    
+    def count_connections_by_pid(self):
+        """Socket count per PID, using the /proc inode index where available"""
+        from conn_snapshot import ConnectionSnapshot
+        if ConnectionSnapshot.available():
+            if self.conn_snapshot is None:
+                self.conn_snapshot = ConnectionSnapshot()
+            counts = self.conn_snapshot.refresh().count_by_process()
+            return {pid: (self.conn_snapshot.processes[pid]['comm'], count)
+                    for pid, count in counts.items()}
+        
+        # Other platforms: look each PID up once instead of once per socket
+        import psutil
+        counts = {}
+        for conn in psutil.net_connections(kind='inet'):
+            if conn.pid:
+                counts[conn.pid] = counts.get(conn.pid, 0) + 1
+        result = {}
+        for pid, count in counts.items():
+            try:
+                result[pid] = (psutil.Process(pid).name(), count)
+            except Exception:
+                pass
+        return result
     
     def show_top_bandwidth_consumers(self):
         """Show processes using most bandwidth"""
         print("\n[*] Top Bandwidth Consumers:")
         print("-" * 60)
         
-        connections = psutil.net_connections(kind='inet')
         process_bandwidth = {}
-        
-        for conn in connections:
-            if conn.pid:
-                try:
-                    proc = psutil.Process(conn.pid)
-                    name = proc.name()
-                    if name not in process_bandwidth:
-                        process_bandwidth[name] = {'count': 0, 'pid': conn.pid}
-                    process_bandwidth[name]['count'] += 1
-                except:
-                    pass
+        for pid, (name, count) in self.count_connections_by_pid().items():
+            if name not in process_bandwidth:
+                process_bandwidth[name] = {'count': 0, 'pid': pid}
+            process_bandwidth[name]['count'] += count
         
         sorted_procs = sorted(process_bandwidth.items(), key=lambda x: x[1]['count'], reverse=True)[:10]
         
         for i, (name, info) in enumerate(sorted_procs, 1):
             print(f"{i}. {name} (PID: {info['pid']}) - {info['count']} connections")
     
-    def run_full_optimization(self):
+    def probe_history_stats(self, target, hours=24.0):
+        """Recorded loss and latency percentiles per probe kind for one target"""
+        since = time.time() - hours * 3600
+        return {kind: self.history.stats(kind, target, since=since) for kind in ('ping', 'dns', 'pmtu')}
+    
+    def show_probe_history(self, target, hours=24.0):
+        """Print recorded probe statistics for one target over the last hours"""
+        print(f"\n[*] Probe history for {target} (last {hours:g}h):")
+        print("-" * 60)
+        found = False
+        for kind, stats in self.probe_history_stats(target, hours).items():
+            if not stats['sent']:
+                continue
+            found = True
+            if not stats['received']:
+                print(f"    {kind:5}: {stats['sent']} samples, all lost")
+            elif kind == 'pmtu':
+                print(f"    {kind:5}: {stats['sent']} runs | MTU min {stats['min']:.0f} max {stats['max']:.0f}")
+            else:
+                print(f"    {kind:5}: {stats['sent']} samples | p50 {stats['p50']:.1f}ms | "
+                      f"p95 {stats['p95']:.1f}ms | p99 {stats['p99']:.1f}ms | loss {stats['loss'] * 100:.1f}%")
+        if not found:
+            print("    No samples recorded")
+    
+    def apply_dns(self, dns_servers):
+        """Apply DNS servers for the current OS and remember them"""
+        print("\n[*] Applying DNS settings...")
+        if self.os_type == 'Windows':
+            self.set_dns_windows(dns_servers)
+        elif self.os_type == 'Linux':
+            self.set_dns_linux(dns_servers)
+        
+        self.config['dns_servers'] = dns_servers
+    
+    def optimize_tcp(self):
+        """Optimize TCP/IP settings for the current OS"""
+        if self.os_type == 'Windows':
+            self.optimize_tcp_windows()
+        elif self.os_type == 'Linux':
+            self.optimize_tcp_linux()
+    
+    def build_optimization_graph(self):
+        """Optimization suite as a dependency graph of steps"""
+        from task_graph import TaskGraph
+        state = {}
+        graph = TaskGraph()
+        
+        def probe_dns():
+            state['dns'] = self.find_fastest_dns()
+        
+        graph.add('dns_probe', probe_dns)
+        if self.is_admin:
+            graph.add('dns_apply', lambda: self.apply_dns(state['dns']), deps=['dns_probe'])
+            graph.add('dns_flush', self.flush_dns_cache, deps=['dns_apply'])
+            graph.add('tcp_tune', self.optimize_tcp)
+            graph.add('latency', self.test_latency, deps=['tcp_tune'])
+        else:
+            graph.add('dns_flush', self.flush_dns_cache)
+            graph.add('latency', self.test_latency)
+        graph.add('stats', self.get_network_stats)
+        return graph
+    
+    def run_full_optimization(self, interactive=True, max_workers=4):
         """Run complete optimization suite"""
         if not self.is_admin:
             print("\n[!] WARNING: Running without admin privileges.")
             print("[!] Some optimizations require admin/root access.")
-            input("\nPress Enter to continue anyway...")
+            if interactive and sys.stdin.isatty():
+                input("\nPress Enter to continue anyway...")
         
         print("\n" + "=" * 60)
         print("  STARTING FULL NETWORK OPTIMIZATION")
         print("=" * 60)
         
-        # Step 1: Find and set fastest DNS
-        fastest_dns = self.find_fastest_dns()
-        
-        if self.is_admin:
-            print("\n[*] Applying DNS settings...")
-            if self.os_type == 'Windows':
-                self.set_dns_windows(fastest_dns)
-            elif self.os_type == 'Linux':
-                self.set_dns_linux(fastest_dns)
-            
-            self.config['dns_servers'] = fastest_dns
-        
-        # Step 2: Flush DNS cache
-        self.flush_dns_cache()
-        
-        # Step 3: Optimize TCP/IP
-        if self.is_admin:
-            if self.os_type == 'Windows':
-                self.optimize_tcp_windows()
-            elif self.os_type == 'Linux':
-                self.optimize_tcp_linux()
-        
-        # Step 4: Show network stats
-        self.get_network_stats()
-        
-        # Step 5: Test latency
-        self.test_latency()
+        # Independent steps run in parallel; output is printed per step
+        graph = self.build_optimization_graph()
+        reports = graph.run(max_workers=max_workers)
+        graph.print_report(reports)
         
         # Update config
-        self.config['optimized'] = True
+        from datetime import datetime
+        self.config['optimized'] = all(report['status'] == 'done' for report in reports.values())
         self.config['last_run'] = datetime.now().isoformat()
         self.save_config()
         
@@ -342,6 +549,14 @@ class NetworkOptimizer:
         print("=" * 60)
         print("\n[+] Your network has been optimized for gaming and low latency")
         print("[+] You may need to restart your applications for full effect")
+        return reports
+    
+    def run_daemon(self, interval=300, **kwargs):
+        """Stay resident and re-evaluate DNS on a schedule"""
+        from optimizer_daemon import OptimizerDaemon
+        daemon = OptimizerDaemon(self, interval=interval, **kwargs)
+        daemon.run()
+        return daemon
     
     def show_menu(self):
         """Show interactive menu"""
@@ -366,10 +581,7 @@ class NetworkOptimizer:
             elif choice == '2':
                 fastest_dns = self.find_fastest_dns()
                 if self.is_admin:
-                    if self.os_type == 'Windows':
-                        self.set_dns_windows(fastest_dns)
-                    elif self.os_type == 'Linux':
-                        self.set_dns_linux(fastest_dns)
+                    self.apply_dns(fastest_dns)
             elif choice == '3':
                 self.flush_dns_cache()
             elif choice == '4':
@@ -387,19 +599,66 @@ class NetworkOptimizer:
             else:
                 print("[-] Invalid option")
 
-def main():
+def build_parser():
+    """Command line interface; parsed before any heavy module is imported"""
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Network Optimizer Pro - Gaming & Latency Optimizer')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('-o', '--optimize', action='store_true', help='run the full optimization suite')
+    mode.add_argument('--dns', action='store_true', help='test DNS servers only')
+    mode.add_argument('--monitor', action='store_true', help='monitor bandwidth')
+    mode.add_argument('--stats', action='store_true', help='show network statistics')
+    mode.add_argument('--daemon', action='store_true', help='stay resident and re-evaluate DNS periodically')
+    mode.add_argument('--history', metavar='TARGET', help='show recorded probe statistics for a target')
+    parser.add_argument('--refresh', action='store_true', help='ignore cached probe results')
+    parser.add_argument('-y', '--yes', '--non-interactive', dest='yes', action='store_true',
+                        help='never prompt for input')
+    parser.add_argument('--interval', type=float, default=300, help='daemon re-evaluation interval (s)')
+    parser.add_argument('--hours', type=float, default=24, help='--history time window (hours)')
+    parser.add_argument('--json', action='store_true',
+                        help='machine-readable JSON output (--stats, --dns, --history)')
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.json and not (args.stats or args.dns or args.history):
+        parser.error('--json needs --stats, --dns or --history')
     optimizer = NetworkOptimizer()
+    optimizer.refresh = args.refresh
+    
+    if args.json:
+        import io
+        import json
+        # Keep human-readable progress off stdout so it carries only JSON
+        real_stdout, sys.stdout = sys.stdout, io.StringIO()
+        try:
+            if args.dns:
+                payload = {'dns_servers': optimizer.find_fastest_dns()}
+            elif args.history:
+                payload = optimizer.probe_history_stats(args.history, args.hours)
+            else:
+                payload = optimizer.collect_network_stats()
+        finally:
+            sys.stdout = real_stdout
+        print(json.dumps(payload))
+        return
+    
     optimizer.print_banner()
     
-    if len(sys.argv) > 1:
-        if sys.argv[1] == '--optimize' or sys.argv[1] == '-o':
-            optimizer.run_full_optimization()
-        elif sys.argv[1] == '--dns':
-            optimizer.find_fastest_dns()
-        elif sys.argv[1] == '--monitor':
-            optimizer.monitor_bandwidth()
-        elif sys.argv[1] == '--stats':
-            optimizer.get_network_stats()
+    if args.optimize:
+        optimizer.run_full_optimization(interactive=not args.yes)
+    elif args.dns:
+        optimizer.find_fastest_dns()
+    elif args.monitor:
+        optimizer.monitor_bandwidth()
+    elif args.stats:
+        optimizer.get_network_stats()
+    elif args.daemon:
+        optimizer.run_daemon(interval=args.interval)
+    elif args.history:
+        optimizer.show_probe_history(args.history, args.hours)
     else:
         optimizer.show_menu()
 
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Optimizer Daemon - Long-running periodic re-evaluation with hysteresis
+Keeps probe state in memory and only switches DNS when a better provider
+stays ahead by a clear margin for several consecutive intervals
+"""
+
+import math
+import signal
+import threading
+import time
+
+from dns_probe import DNSProbeEngine, DNS_PROVIDERS
+
+
+class Hysteresis:
+    """Switch only after a challenger beats the incumbent for N evaluations in a row"""
+
+    def __init__(self, margin_ms=5.0, margin_ratio=0.1, intervals=3):
+        self.margin_ms = margin_ms
+        self.margin_ratio = margin_ratio
+        self.intervals = intervals
+        self.challenger = None
+        self.streak = 0
+
+    def update(self, incumbent, scores):
+        """Feed one round of scores (lower is better); returns the option to switch to or None"""
+        best = min(scores, key=scores.get)
+        current = scores.get(incumbent, math.inf)
+
+        # A failing challenger is never an improvement, even over a failing incumbent
+        # (inf - inf is nan, which would slip past the margin check)
+        if best == incumbent or math.isinf(scores[best]):
+            self.challenger, self.streak = None, 0
+            return None
+        # Any working challenger beats a failing incumbent; otherwise it must clear the margin
+        if not math.isinf(current) and current - scores[best] <= max(self.margin_ms, self.margin_ratio * current):
+            self.challenger, self.streak = None, 0
+            return None
+
+        if best == self.challenger:
+            self.streak += 1
+        else:
+            self.challenger, self.streak = best, 1
+
+        if self.streak >= self.intervals:
+            self.challenger, self.streak = None, 0
+            return best
+        return None
+
+
+class OptimizerDaemon:
+    """Re-probe DNS providers on a schedule and apply persistent improvements"""
+
+    def __init__(self, optimizer, interval=300, samples=5, timeout=2.0,
+                 margin_ms=5.0, margin_ratio=0.1, intervals=3, smoothing=0.3):
+        self.optimizer = optimizer
+        self.interval = interval
+        self.engine = DNSProbeEngine(samples=samples, timeout=timeout)
+        self.hysteresis = Hysteresis(margin_ms, margin_ratio, intervals)
+        self.smoothing = smoothing
+        # In-memory EWMA of each provider's score, carried across cycles
+        self.scores = {}
+        self.stop_event = threading.Event()
+        self.stats = {'cycles': 0, 'wakeups': 0, 'switches': 0,
+                      'cpu_seconds': 0.0, 'busy_seconds': 0.0, 'started': time.time()}
+
+    def current_provider(self):
+        servers = set(self.optimizer.config.get('dns_servers', []))
+        for name, provider_servers in DNS_PROVIDERS.items():
+            if servers == set(provider_servers):
+                return name
+        return None
+
+    def evaluate(self):
+        """One probing cycle; returns the provider switched to, if any"""
+        ranking = self.engine.rank_providers(DNS_PROVIDERS)
+        servers = {}
+        for entry in ranking:
+            servers[entry['name']] = entry['servers']
+            previous = self.scores.get(entry['name'])
+            if previous is None or previous == float('inf') or entry['score'] == float('inf'):
+                self.scores[entry['name']] = entry['score']
+            else:
+                self.scores[entry['name']] = previous + self.smoothing * (entry['score'] - previous)
+
+        incumbent = self.current_provider()
+        switch_to = self.hysteresis.update(incumbent, self.scores)
+        if switch_to is None:
+            return None
+
+        print(f"[+] {switch_to} has beaten {incumbent or 'current DNS'} for "
+              f"{self.hysteresis.intervals} intervals, switching")
+        if self.optimizer.is_admin:
+            self.optimizer.apply_dns(servers[switch_to])
+            self.optimizer.save_config()
+        else:
+            print("[-] Admin privileges required to apply DNS, recommendation only")
+        self.stats['switches'] += 1
+        return switch_to
+
+    def stop(self, *_):
+        self.stop_event.set()
+
+    def report(self):
+        """Own overhead since start: CPU time, wakeups, time spent probing"""
+        stats = self.stats
+        uptime = max(time.time() - stats['started'], 1e-9)
+        return (f"cycles {stats['cycles']} | wakeups {stats['wakeups']} | "
+                f"switches {stats['switches']} | cpu {stats['cpu_seconds'] * 1000:.0f} ms "
+                f"({stats['cpu_seconds'] / uptime * 100:.3f}% of uptime) | "
+                f"busy {stats['busy_seconds']:.1f}s")
+
+    def run(self, cycles=None):
+        """Loop until stopped (SIGINT/SIGTERM) or after the given number of cycles"""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+        print(f"[*] Daemon started: re-evaluating every {self.interval}s "
+              f"(switch after {self.hysteresis.intervals} intervals beyond "
+              f"{self.hysteresis.margin_ms:.0f}ms / {self.hysteresis.margin_ratio * 100:.0f}%)")
+
+        next_run = time.monotonic()
+        while not self.stop_event.is_set():
+            cpu_start, wall_start = time.process_time(), time.monotonic()
+            try:
+                self.evaluate()
+            except Exception as e:
+                print(f"[-] Evaluation failed: {e}")
+            self.stats['cycles'] += 1
+            self.stats['cpu_seconds'] += time.process_time() - cpu_start
+            self.stats['busy_seconds'] += time.monotonic() - wall_start
+
+            best = min(self.scores, key=self.scores.get) if self.scores else None
+            print(f"[*] {time.strftime('%H:%M:%S')} best {best} | {self.report()}", flush=True)
+
+            if cycles is not None and self.stats['cycles'] >= cycles:
+                break
+
+            # One timed wait per cycle keeps wakeups at exactly one per interval
+            next_run += self.interval
+            self.stop_event.wait(max(0.0, next_run - time.monotonic()))
+            self.stats['wakeups'] += 1
+
+        print(f"[+] Daemon stopped: {self.report()}")
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+OS Detect - Operating system name shared by the optimizer tools
+Same names as platform.system() without importing the platform module
+"""
+
+import sys
+
+OS_NAMES = {'win32': 'Windows', 'cygwin': 'Windows', 'darwin': 'Darwin'}
+
+
+def os_type():
+    """'Windows', 'Linux', 'Darwin', or sys.platform for anything else"""
+    return OS_NAMES.get(sys.platform, 'Linux' if sys.platform.startswith('linux') else sys.platform)
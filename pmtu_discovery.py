@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+PMTU Discovery - In-process path-MTU search with DF-flagged sockets
+Starts from the kernel's learned path MTU, follows ICMP fragmentation-needed
+reports and binary-searches the rest, many destinations at once
+"""
+
+import asyncio
+import errno
+import socket
+import struct
+
+from latency_probe import (PROBE_MAGIC, DEFAULT_UDP_PORT, build_payload, parse_payload,
+                           build_echo_request, parse_echo_reply, icmp_available)
+from traceroute_engine import IP_RECVERR, IPV6_RECVERR, SO_EE_ORIGIN_ICMP, SO_EE_ORIGIN_ICMP6
+
+# linux/in.h and linux/in6.h; not exported by the socket module
+IP_MTU_DISCOVER = 10
+IP_MTU = 14
+IPV6_MTU_DISCOVER = 23
+IPV6_MTU = 24
+PMTUDISC_DO = 2
+
+# Smallest MTU each protocol guarantees, and IP + ICMP/UDP header bytes
+MIN_MTU = {socket.AF_INET: 68, socket.AF_INET6: 1280}
+HEADER_BYTES = {socket.AF_INET: 28, socket.AF_INET6: 48}
+
+
+class _PMTUSocket:
+    """One connected DF socket; probes are matched to replies by sequence number"""
+
+    def __init__(self, kind, family, address, port):
+        self.kind = kind
+        self.family = family
+        self.ipv6 = family == socket.AF_INET6
+        self.pending = {}
+        self.seq = 0
+        proto = 0
+        if kind == 'icmp':
+            proto = socket.IPPROTO_ICMPV6 if self.ipv6 else socket.IPPROTO_ICMP
+        self.sock = socket.socket(family, socket.SOCK_DGRAM, proto)
+        try:
+            self.sock.setblocking(False)
+            if self.ipv6:
+                self.sock.setsockopt(socket.IPPROTO_IPV6, IPV6_MTU_DISCOVER, PMTUDISC_DO)
+                self.sock.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVERR, 1)
+            else:
+                self.sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, PMTUDISC_DO)
+                self.sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+            self.sock.connect((address, port))
+        except OSError:
+            self.sock.close()
+            raise
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.sock.fileno(), self._on_readable)
+
+    def kernel_mtu(self):
+        """Path MTU the kernel currently holds for this destination"""
+        try:
+            if self.ipv6:
+                return self.sock.getsockopt(socket.IPPROTO_IPV6, IPV6_MTU)
+            return self.sock.getsockopt(socket.IPPROTO_IP, IP_MTU)
+        except OSError:
+            return None
+
+    def _packet(self, seq, mtu):
+        size = max(0, mtu - HEADER_BYTES[self.family])
+        if self.kind == 'icmp':
+            return build_echo_request(seq, self.ipv6, size)
+        return build_payload(seq, size)
+
+    @staticmethod
+    def _sequence(data):
+        # Error-queue payloads may or may not keep the ICMP header; find the probe marker
+        index = data.find(PROBE_MAGIC)
+        return parse_payload(data[index:]) if index >= 0 else None
+
+    def _resolve(self, seq, outcome):
+        future = self.pending.pop(seq, None)
+        if future and not future.done():
+            future.set_result(outcome)
+
+    def _on_readable(self):
+        while True:
+            try:
+                data, ancdata, _, _ = self.sock.recvmsg(2048, 512, socket.MSG_ERRQUEUE)
+            except OSError:
+                break
+            for level, kind, cmsg in ancdata:
+                if (level, kind) not in ((socket.IPPROTO_IP, IP_RECVERR),
+                                         (socket.IPPROTO_IPV6, IPV6_RECVERR)) or len(cmsg) < 16:
+                    continue
+                err, origin, icmp_type, code, _, info, _ = struct.unpack_from('=IBBBBII', cmsg)
+                seq = self._sequence(data)
+                if err == errno.EMSGSIZE:
+                    # Fragmentation needed / packet too big; info is the next-hop MTU
+                    self._resolve(seq, info or 0)
+                elif (origin, icmp_type, code) in ((SO_EE_ORIGIN_ICMP, 3, 3), (SO_EE_ORIGIN_ICMP6, 1, 4)):
+                    # Port unreachable from the destination: the probe arrived whole
+                    self._resolve(seq, 'ok')
+        while True:
+            try:
+                data = self.sock.recv(65535)
+            except OSError:
+                break
+            seq = parse_echo_reply(data, self.ipv6) if self.kind == 'icmp' else parse_payload(data)
+            self._resolve(seq, 'ok')
+
+    async def probe(self, mtu, timeout):
+        """'ok' if a DF packet of mtu bytes got through, an int MTU if too big, None if lost"""
+        self.seq = (self.seq + 1) & 0xffff
+        seq = self.seq
+        future = self.loop.create_future()
+        self.pending[seq] = future
+        packet = self._packet(seq, mtu)
+        try:
+            for _ in range(2):
+                try:
+                    self.sock.send(packet)
+                    break
+                except OSError as e:
+                    if e.errno == errno.EMSGSIZE:
+                        # Larger than the MTU the kernel has already learned
+                        return self.kernel_mtu() or 0
+                    # A queued error from an earlier probe is reported once; send again
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.pending.pop(seq, None)
+
+    def close(self):
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+
+
+class PMTUDiscovery:
+    """Find the largest unfragmented packet size to many destinations at once"""
+
+    def __init__(self, timeout=1.0, attempts=3, backoff=1.0, transport='auto',
+                 udp_port=DEFAULT_UDP_PORT, max_in_flight=64):
+        self.timeout = timeout
+        self.attempts = attempts
+        # Hosts rate-limit ICMP errors (1/s after a burst on Linux), which starves UDP probes
+        self.backoff = backoff
+        self.transport = transport
+        self.udp_port = udp_port
+        self.max_in_flight = max_in_flight
+
+    def _pick_transport(self, family):
+        if self.transport != 'auto':
+            return self.transport
+        return 'icmp' if icmp_available(family) else 'udp'
+
+    async def _resolve(self, target):
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                socket.inet_pton(family, target)
+                return family, target
+            except (OSError, ValueError):
+                pass
+        loop = asyncio.get_running_loop()
+        infos = await asyncio.wait_for(
+            loop.getaddrinfo(target, None, type=socket.SOCK_DGRAM), self.timeout)
+        family, _, _, _, sockaddr = infos[0]
+        return family, sockaddr[0]
+
+    async def _probe(self, conn, mtu, counter, floor=None):
+        """Probe one size; with a floor, silence must be confirmed by the floor answering"""
+        for attempt in range(self.attempts):
+            if attempt:
+                await asyncio.sleep(self.backoff)
+            counter['probes'] += 1
+            outcome = await conn.probe(mtu, self.timeout)
+            if outcome is not None:
+                return outcome
+            # Only a lost large probe next to an answered small one means "too big";
+            # if both go unanswered, replies are being dropped or rate-limited
+            if floor is not None:
+                counter['probes'] += 1
+                if await conn.probe(floor, self.timeout) is not None:
+                    return None
+        return None
+
+    def _upper_bound(self, conn, size, outcome):
+        """Largest size still worth trying after size failed"""
+        high = size - 1
+        if outcome:
+            high = min(high, outcome)
+        learned = conn.kernel_mtu()
+        return min(high, learned) if learned else high
+
+    async def discover_async(self, target, semaphore=None):
+        """Path MTU to one destination"""
+        semaphore = semaphore or asyncio.Semaphore(self.max_in_flight)
+        result = {'target': target, 'address': None, 'mtu': None, 'kernel_mtu': None,
+                  'probes': 0, 'transport': None, 'error': None}
+        try:
+            family, address = await self._resolve(target)
+        except (OSError, UnicodeError, asyncio.TimeoutError):
+            result['error'] = 'could not resolve'
+            return result
+        kind = self._pick_transport(family)
+        result.update({'address': address, 'transport': kind})
+
+        async with semaphore:
+            try:
+                conn = _PMTUSocket(kind, family, address,
+                                   0 if kind == 'icmp' else self.udp_port)
+            except OSError as e:
+                result['error'] = str(e)
+                return result
+            counter = {'probes': 0}
+            try:
+                low = MIN_MTU[family]
+                high = result['kernel_mtu'] = conn.kernel_mtu() or 1500
+                # The floor proves the destination answers; the top is usually the answer
+                floor, top = await asyncio.gather(self._probe(conn, low, counter),
+                                                  self._probe(conn, high, counter))
+                if floor != 'ok':
+                    result['error'] = 'no reply'
+                elif top == 'ok':
+                    low = high
+                else:
+                    high = self._upper_bound(conn, high, top)
+                    # A reported next-hop MTU is the likeliest answer, so try it first
+                    guess = high if top else None
+                    while low < high:
+                        if kind == 'udp':
+                            # UDP answers are ICMP errors, one per second once the burst is spent
+                            await asyncio.sleep(self.backoff)
+                        size = guess if guess and guess > low else (low + high + 1) // 2
+                        outcome = await self._probe(conn, size, counter, MIN_MTU[family])
+                        if outcome == 'ok':
+                            low, guess = size, None
+                        else:
+                            high = self._upper_bound(conn, size, outcome)
+                            guess = high if outcome else None
+                if result['error'] is None:
+                    result['mtu'] = low
+            finally:
+                result['probes'] = counter['probes']
+                conn.close()
+        return result
+
+    async def discover_many_async(self, targets):
+        targets = list(dict.fromkeys(targets))
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        results = await asyncio.gather(*(self.discover_async(target, semaphore)
+                                         for target in targets))
+        return dict(zip(targets, results))
+
+    def discover_many(self, targets):
+        """Blocking wrapper around discover_many_async"""
+        return asyncio.run(self.discover_many_async(targets))
+
+    def discover(self, target):
+        return self.discover_many([target])[target]
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Probe Cache - Persistent probe results with per-entry TTL
+Lets repeated runs reuse fresh DNS/latency measurements instead of re-probing
+"""
+
+import json
+import os
+import socket
+import tempfile
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+DEFAULT_CACHE_FILE = Path.home() / '.network_optimizer_probe_cache.json'
+# Bumped whenever a cached value's shape changes; files written by another version are ignored
+# (2: 'ping' entries hold per-sample results instead of a bare RTT)
+CACHE_FORMAT_VERSION = 2
+
+
+def source_address(target, port=53):
+    """Local address the kernel would use to reach target (no packets are sent)"""
+    try:
+        family = socket.AF_INET6 if ':' in target else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            sock.connect((target, port))
+            return sock.getsockname()[0]
+        finally:
+            sock.close()
+    except OSError:
+        return ''
+
+
+class ProbeCache:
+    """Size-bounded LRU of probe results keyed by (target, probe type, interface)"""
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, max_entries=50000, default_ttl=300, failure_ttl=15):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        # Results with nothing received are kept briefly: an outage should not outlive itself
+        self.failure_ttl = failure_ttl
+        self.entries = OrderedDict()
+        self.loaded = False
+        self.dirty = False
+
+    def load(self):
+        """Load the cache file, dropping expired rows"""
+        self.loaded = True
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != CACHE_FORMAT_VERSION:
+            return
+
+        now = time.time()
+        # Rows are stored oldest-first so insertion order rebuilds the LRU order
+        for target, probe_type, interface, stored_at, ttl, value in data.get('entries', []):
+            if stored_at + ttl > now:
+                self.entries[(target, probe_type, interface)] = (stored_at, ttl, value)
+
+    def save(self):
+        """Atomically rewrite the cache file if anything changed"""
+        if not self.dirty:
+            return True
+        rows = [[target, probe_type, interface, stored_at, ttl, value]
+                for (target, probe_type, interface), (stored_at, ttl, value) in self.entries.items()]
+        payload = json.dumps({'version': CACHE_FORMAT_VERSION, 'entries': rows},
+                             separators=(',', ':'))
+
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=str(self.path.parent), prefix='.probe_cache.')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(payload)
+                os.replace(tmp_path, str(self.path))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            print(f"[-] Could not save probe cache: {e}")
+            return False
+
+        self.dirty = False
+        return True
+
+    def get(self, target, probe_type, interface=''):
+        """Return the stored result if it is still fresh, else None"""
+        if not self.loaded:
+            self.load()
+        key = (target, probe_type, interface)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stored_at, ttl, value = entry
+        if stored_at + ttl <= time.time():
+            del self.entries[key]
+            self.dirty = True
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, target, probe_type, value, interface='', ttl=None):
+        """Store a result, evicting the least recently used entries past max_entries"""
+        if not self.loaded:
+            self.load()
+        ttl = self.default_ttl if ttl is None else ttl
+        if isinstance(value, dict) and value.get('received') == 0:
+            ttl = min(ttl, self.failure_ttl)
+        key = (target, probe_type, interface)
+        self.entries[key] = (time.time(), ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.dirty = True
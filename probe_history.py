@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Probe History - Append-only columnar store of probe samples
+Samples go into fixed-width columns (timestamp, series id, value, lost flag)
+inside memory-mapped segment files; segments rotate by size and age, expire
+by retention limits, and queries read only the segments overlapping the
+requested time range, vectorized with NumPy when it is installed
+"""
+
+import mmap
+import os
+import struct
+import time
+from array import array
+from pathlib import Path
+
+from probe_stats import percentile
+
+DEFAULT_HISTORY_DIR = Path.home() / '.network_optimizer_history'
+
+MAGIC = b'NOPH'
+FORMAT_VERSION = 1
+# magic, version, sealed flag, capacity, rows, first timestamp, last timestamp
+HEADER = struct.Struct('<4sHHIIdd')
+HEADER_SIZE = 64
+# Column typecodes in file order; a row is 17 bytes
+COLUMNS = (('timestamp', 'd'), ('series', 'I'), ('value', 'f'), ('lost', 'B'))
+ROW_SIZE = sum(array(code).itemsize for _, code in COLUMNS)
+SEGMENT_SUFFIX = '.seg'
+
+
+def column_offsets(capacity):
+    """Byte offset of each column in a segment of the given capacity"""
+    offsets, offset = [], HEADER_SIZE
+    for _, code in COLUMNS:
+        offsets.append(offset)
+        offset += array(code).itemsize * capacity
+    return offsets
+
+
+def read_header(path):
+    """(sealed, capacity, rows, first_ts, last_ts) of a segment file, or None if unreadable"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except OSError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    magic, version, sealed, capacity, rows, first_ts, last_ts = HEADER.unpack(header)
+    if magic != MAGIC or version != FORMAT_VERSION or rows > capacity:
+        return None
+    return bool(sealed), capacity, rows, first_ts, last_ts
+
+
+def _lock(f):
+    """Exclusive non-blocking lock so only one process appends to a segment"""
+    try:
+        import fcntl
+    except ImportError:
+        return None
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _in_use(path):
+    """True if another process holds the append lock of a segment"""
+    try:
+        with open(path, 'rb') as f:
+            return _lock(f) is False
+    except OSError:
+        return False
+
+
+class Segment:
+    """Writable mapping of one segment file"""
+
+    def __init__(self, path, capacity, create=False):
+        self.path = Path(path)
+        self.capacity = capacity
+        if create:
+            # O_EXCL: never truncate a segment another writer or an earlier rotation made
+            self.file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644), 'r+b')
+        else:
+            self.file = open(self.path, 'r+b')
+        self.locked = _lock(self.file)
+        if self.locked is False:
+            self.file.close()
+            raise BlockingIOError(f"segment {self.path.name} is in use")
+        if create:
+            # Preallocated (sparse where supported) so the mapping never has to grow
+            self.file.truncate(HEADER_SIZE + ROW_SIZE * capacity)
+            self.file.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, capacity, 0, 0.0, 0.0))
+            self.file.flush()
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        _, _, _, _, self.rows, self.first_ts, self.last_ts = HEADER.unpack_from(self.map)
+        view = memoryview(self.map)
+        self.columns = [view[offset:offset + array(code).itemsize * capacity].cast(code)
+                        for offset, (_, code) in zip(column_offsets(capacity), COLUMNS)]
+        view.release()
+
+    def append(self, timestamps, series, values, lost):
+        """Write rows from parallel sequences; returns how many fit"""
+        start = self.rows
+        count = min(len(timestamps), self.capacity - start)
+        if count <= 0:
+            return 0
+        ts_column, series_column, value_column, lost_column = self.columns
+        ts_column[start:start + count] = array('d', timestamps[:count])
+        series_column[start:start + count] = array('I', series[:count])
+        value_column[start:start + count] = array('f', values[:count])
+        lost_column[start:start + count] = array('B', lost[:count])
+        if not start:
+            self.first_ts = min(timestamps[:count])
+        self.last_ts = max(self.last_ts, max(timestamps[:count]))
+        self.rows = start + count
+        # The row count is written last, so readers never see half-written rows
+        HEADER.pack_into(self.map, 0, MAGIC, FORMAT_VERSION, 0, self.capacity,
+                         self.rows, self.first_ts, self.last_ts)
+        return count
+
+    def close(self, seal=False):
+        """Unmap; a sealed segment is rewritten at its used size and never appended to again"""
+        for column in self.columns:
+            column.release()
+        self.columns = []
+        if seal:
+            HEADER.pack_into(self.map, 0, MAGIC, FORMAT_VERSION, 1, self.capacity,
+                             self.rows, self.first_ts, self.last_ts)
+            payload = [bytes(self.map[offset:offset + array(code).itemsize * self.rows])
+                       for offset, (_, code) in zip(column_offsets(self.capacity), COLUMNS)]
+        self.map.close()
+        self.file.close()
+        if seal:
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 1, self.rows, self.rows,
+                                    self.first_ts, self.last_ts))
+                f.write(bytes(HEADER_SIZE - HEADER.size))
+                for column in payload:
+                    f.write(column)
+            os.replace(tmp_path, self.path)
+
+
+class ProbeHistory:
+    """Append-only probe sample history with time-range queries"""
+
+    def __init__(self, path=DEFAULT_HISTORY_DIR, segment_rows=1 << 18, segment_seconds=86400,
+                 max_age=30 * 86400, max_bytes=256 << 20):
+        self.path = Path(path)
+        # Rotation limits for the segment being appended to
+        self.segment_rows = segment_rows
+        self.segment_seconds = segment_seconds
+        # Retention: whole segments are dropped once too old or over the size budget
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.series_file = self.path / 'series.tsv'
+        self.series = {}
+        self.series_names = []
+        self.active = None
+        self.disabled = False
+        # Distinguishes segments this process starts within the same second
+        self.sequence = 0
+
+    def _load_series(self):
+        try:
+            with open(self.series_file, 'r') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            lines = []
+        # Ids are line numbers; a series appended twice by racing writers keeps its first id
+        self.series_names = [tuple(line.split('\t', 1)) for line in lines]
+        self.series = {}
+        for series_id, key in enumerate(self.series_names):
+            self.series.setdefault(key, series_id)
+
+    def series_id(self, kind, target, create=True):
+        """Numeric id of a (probe kind, target) series, registering it if new"""
+        key = (kind, str(target).replace('\t', ' ').replace('\n', ' '))
+        if key not in self.series:
+            self._load_series()
+        if key not in self.series and create:
+            self.path.mkdir(parents=True, exist_ok=True)
+            # One O_APPEND write per line, so concurrent writers never interleave
+            fd = os.open(self.series_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, f"{key[0]}\t{key[1]}\n".encode())
+            finally:
+                os.close(fd)
+            self._load_series()
+        return self.series.get(key)
+
+    def segments(self):
+        """[(path, header)] of every readable segment, oldest first"""
+        try:
+            paths = sorted(self.path.glob('*' + SEGMENT_SUFFIX))
+        except OSError:
+            return []
+        found = []
+        for path in paths:
+            header = read_header(path)
+            if header is not None:
+                found.append((path, header))
+        return found
+
+    def _open_active(self, now):
+        """Continue the newest unsealed segment if it is free and young enough, else start one"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.expire(now)
+        for path, (sealed, capacity, rows, first_ts, _) in reversed(self.segments()):
+            if sealed or rows >= capacity or (rows and now - first_ts >= self.segment_seconds):
+                continue
+            try:
+                segment = Segment(path, capacity)
+            except OSError:
+                continue
+            if segment.locked:
+                return segment
+            # Without file locks another process may hold it; never share a segment
+            segment.close()
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime(now))
+        while True:
+            self.sequence += 1
+            name = f"{stamp}-{self.sequence:06d}-{os.getpid()}{SEGMENT_SUFFIX}"
+            try:
+                return Segment(self.path / name, self.segment_rows, create=True)
+            except FileExistsError:
+                # Left by an earlier process with the same PID
+                continue
+
+    def append_many(self, timestamps, series, values, lost):
+        """Append rows given as parallel sequences of equal length"""
+        if self.disabled:
+            return 0
+        written = 0
+        try:
+            while written < len(timestamps):
+                now = timestamps[written]
+                if self.active is not None and self.active.rows and (
+                        self.active.rows >= self.active.capacity
+                        or now - self.active.first_ts >= self.segment_seconds):
+                    self.active.close(seal=True)
+                    self.active = None
+                if self.active is None:
+                    self.active = self._open_active(now)
+                written += self.active.append(timestamps[written:], series[written:],
+                                              values[written:], lost[written:])
+        except OSError as e:
+            # History is best effort; probing must keep working on a full or read-only disk
+            print(f"[-] Probe history disabled: {e}")
+            self.disabled = True
+        return written
+
+    def record(self, kind, target, values, timestamp=None):
+        """Append one probe run; None values are recorded as lost samples"""
+        if self.disabled or not values:
+            return 0
+        try:
+            series_id = self.series_id(kind, target)
+        except OSError as e:
+            print(f"[-] Probe history disabled: {e}")
+            self.disabled = True
+            return 0
+        timestamp = time.time() if timestamp is None else timestamp
+        count = len(values)
+        return self.append_many([timestamp] * count, [series_id] * count,
+                                [0.0 if value is None else value for value in values],
+                                [value is None for value in values])
+
+    def expire(self, now=None):
+        """Drop segments past max_age, then the oldest ones beyond max_bytes that no writer holds"""
+        now = time.time() if now is None else now
+        segments = []
+        # The segment being appended to is never dropped but counts toward the budget
+        active_size = 0
+        for path, header in self.segments():
+            if self.active is not None and path == self.active.path:
+                active_size = HEADER_SIZE + ROW_SIZE * self.active.capacity
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            # A segment without rows has no timestamps yet; its file time stands in
+            segments.append((path, header, stat.st_size, header[4] if header[2] else stat.st_mtime))
+        total = active_size + sum(size for _, _, size, _ in segments)
+        removed = 0
+        for path, (sealed, _, _, _, _), size, last_write in segments:
+            if now - last_write <= self.max_age and total <= self.max_bytes:
+                continue
+            # Short-lived processes leave segments unsealed; only one still being appended to is kept
+            if now - last_write <= self.max_age and not sealed and _in_use(path):
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    @staticmethod
+    def _scan(path, capacity, rows, series_id, since, until, np):
+        """(timestamps, values, lost) of one series in one segment, copied out of the mapping"""
+        offsets = column_offsets(capacity)
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if np is not None:
+                timestamps = np.frombuffer(mapped, np.float64, rows, offsets[0])
+                series = np.frombuffer(mapped, np.uint32, rows, offsets[1])
+                values = np.frombuffer(mapped, np.float32, rows, offsets[2])
+                lost = np.frombuffer(mapped, np.uint8, rows, offsets[3])
+                mask = (series == series_id) & (timestamps >= since) & (timestamps <= until)
+                found = timestamps[mask], values[mask], lost[mask].astype(bool)
+                # Views into the mapping must go before it can be closed
+                del timestamps, series, values, lost
+                return found
+            view = memoryview(mapped)
+            columns = [view[offset:offset + array(code).itemsize * rows].cast(code)
+                       for offset, (_, code) in zip(offsets, COLUMNS)]
+            try:
+                timestamps, series, values, lost = columns
+                matches = [i for i, (sid, ts) in enumerate(zip(series, timestamps))
+                           if sid == series_id and since <= ts <= until]
+                return ([timestamps[i] for i in matches], [values[i] for i in matches],
+                        [bool(lost[i]) for i in matches])
+            finally:
+                for column in columns:
+                    column.release()
+                view.release()
+
+    def query(self, kind, target, since=None, until=None):
+        """(timestamps, values, lost) of a series in [since, until]; NumPy arrays when available
+
+        Only segments whose time span overlaps the range are mapped.
+        """
+        since = 0.0 if since is None else since
+        until = float('inf') if until is None else until
+        series_id = self.series_id(kind, target, create=False)
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+
+        parts = []
+        if series_id is not None:
+            for path, (_, capacity, rows, first_ts, last_ts) in self.segments():
+                if not rows or last_ts < since or first_ts > until:
+                    continue
+                try:
+                    parts.append(self._scan(path, capacity, rows, series_id, since, until, np))
+                except (OSError, ValueError):
+                    continue
+
+        if np is not None:
+            if not parts:
+                return np.empty(0), np.empty(0, dtype=np.float32), np.empty(0, dtype=bool)
+            return tuple(np.concatenate(column) for column in zip(*parts))
+        if not parts:
+            return [], [], []
+        return tuple([value for part in column for value in part] for column in zip(*parts))
+
+    def stats(self, kind, target, since=None, until=None):
+        """Loss and latency percentiles of a series over a time range"""
+        _, values, lost = self.query(kind, target, since, until)
+        sent = len(values)
+        try:
+            import numpy as np
+        except ImportError:
+            received = sorted(value for value, dropped in zip(values, lost) if not dropped)
+            summary = {'sent': sent, 'received': len(received),
+                       'loss': (1.0 - len(received) / sent) if sent else 1.0,
+                       'min': None, 'avg': None, 'max': None, 'p50': None, 'p95': None, 'p99': None}
+            if received:
+                summary.update({'min': received[0], 'avg': sum(received) / len(received),
+                                'max': received[-1], 'p50': percentile(received, 50),
+                                'p95': percentile(received, 95), 'p99': percentile(received, 99)})
+            return summary
+
+        received = values[~lost].astype(np.float64)
+        summary = {'sent': sent, 'received': int(received.size),
+                   'loss': (1.0 - received.size / sent) if sent else 1.0,
+                   'min': None, 'avg': None, 'max': None, 'p50': None, 'p95': None, 'p99': None}
+        if received.size:
+            p50, p95, p99 = np.percentile(received, [50, 95, 99])
+            summary.update({'min': float(received.min()), 'avg': float(received.mean()),
+                            'max': float(received.max()),
+                            'p50': float(p50), 'p95': float(p95), 'p99': float(p99)})
+        return summary
+
+    def close(self):
+        if self.active is not None:
+            self.active.close()
+            self.active = None
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Probe Statistics - Shared latency summaries for the probe engines
+Turns raw RTT samples into median/tail/loss figures used for ranking;
+per-sequence summaries are vectorized with NumPy when it is installed
+"""
+
+import math
+
+
+def percentile(sorted_values, pct):
+    """Linear-interpolated percentile (0-100) of an already sorted list"""
+    if not sorted_values:
+        return None
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100.0
+    low = int(math.floor(rank))
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def summarize(samples, sent):
+    """Summarise RTT samples (ms) against the number of probes sent"""
+    ordered = sorted(samples)
+    received = len(ordered)
+    summary = {
+        'sent': sent,
+        'received': received,
+        'loss': (1.0 - received / sent) if sent else 1.0,
+        'samples': list(samples),
+        'min': None,
+        'avg': None,
+        'max': None,
+        'p50': None,
+        'p95': None,
+        'p99': None,
+    }
+    if ordered:
+        summary.update({
+            'min': ordered[0],
+            'avg': sum(ordered) / received,
+            'max': ordered[-1],
+            'p50': percentile(ordered, 50),
+            'p95': percentile(ordered, 95),
+            'p99': percentile(ordered, 99),
+        })
+    return summary
+
+
+def score(summary, loss_penalty=1000.0, jitter_weight=0.0):
+    """Rank key: blend of median and p95 plus loss and jitter penalties (lower is better)"""
+    if not summary or not summary['received']:
+        return float('inf')
+    value = (summary['p50'] + summary['p95']) / 2 + summary['loss'] * loss_penalty
+    if jitter_weight:
+        value += jitter_weight * summary.get('jitter', 0.0)
+    return value
+
+
+def jitter(samples):
+    """RFC 3550 interarrival jitter estimate over consecutive RTT samples (ms)"""
+    estimate = 0.0
+    previous = None
+    for rtt in samples:
+        if rtt is None:
+            continue
+        if previous is not None:
+            estimate += (abs(rtt - previous) - estimate) / 16.0
+        previous = rtt
+    return estimate
+
+
+def summarize_sequence(rtts):
+    """Summary of a per-probe RTT sequence where None marks a lost probe
+
+    Adds 'sequence', 'jitter' and 'stdev' to the summarize() fields. Uses
+    NumPy for the percentile and jitter math when available.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        received = [rtt for rtt in rtts if rtt is not None]
+        summary = summarize(received, len(rtts))
+        mean = summary['avg']
+        summary['stdev'] = (math.sqrt(sum((rtt - mean) ** 2 for rtt in received) / len(received))
+                            if received else None)
+        summary['jitter'] = jitter(rtts)
+        summary['sequence'] = list(rtts)
+        return summary
+
+    values = np.array([np.nan if rtt is None else rtt for rtt in rtts], dtype=float)
+    received = values[~np.isnan(values)]
+    summary = {
+        'sent': len(values),
+        'received': int(received.size),
+        'loss': (1.0 - received.size / values.size) if values.size else 1.0,
+        'samples': received.tolist(),
+        'sequence': list(rtts),
+        'min': None, 'avg': None, 'max': None,
+        'p50': None, 'p95': None, 'p99': None,
+        'stdev': None, 'jitter': 0.0,
+    }
+    if received.size:
+        p50, p95, p99 = np.percentile(received, [50, 95, 99])
+        summary.update({
+            'min': float(received.min()),
+            'avg': float(received.mean()),
+            'max': float(received.max()),
+            'p50': float(p50), 'p95': float(p95), 'p99': float(p99),
+            'stdev': float(received.std()),
+        })
+    if received.size > 1:
+        # Closed form of the RFC 3550 recursion J += (|D| - J) / 16 starting at 0
+        deltas = np.abs(np.diff(received))
+        weights = (15.0 / 16.0) ** np.arange(deltas.size - 1, -1, -1) / 16.0
+        summary['jitter'] = float(np.dot(weights, deltas))
+    return summary
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Route Monitor - Continuous latency tracking with change-point detection
+Keeps EWMA, variance and two-sided CUSUM state for thousands of destinations
+in flat arrays and raises an event when a latency or loss shift persists
+"""
+
+import asyncio
+import math
+import signal
+import threading
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from latency_probe import LatencyProber
+from target_catalog import fd_batch_size
+
+# Per-target state slots; one array('d') per slot keeps memory at ~80 bytes per target
+MEAN, VAR, CUSUM_UP, CUSUM_DOWN, LOSS, BASELINE = range(6)
+
+
+class RouteHealthMonitor:
+    """Probe destinations on a schedule and report persistent latency shifts"""
+
+    def __init__(self, targets, interval=5.0, timeout=1.0, alpha=0.1, loss_alpha=0.05,
+                 drift=0.5, threshold=6.0, clip=3.0, warmup=10, min_std_ms=0.5, loss_threshold=0.2,
+                 on_event=None, on_shift=None, max_in_flight=1024, max_events=1000, **probe_options):
+        self.targets = list(dict.fromkeys(targets))
+        self.index = {target: i for i, target in enumerate(self.targets)}
+        self.interval = interval
+        self.timeout = timeout
+        self.alpha = alpha
+        self.loss_alpha = loss_alpha
+        # CUSUM allowance and decision threshold, in standard deviations
+        self.drift = drift
+        self.threshold = threshold
+        # Each sample moves the sums by at most clip - drift, so a lone spike never alarms
+        self.clip = clip
+        self.warmup = warmup
+        # Floor for the deviation so very stable links do not alarm on sub-ms wobble
+        self.min_std_ms = min_std_ms
+        self.loss_threshold = loss_threshold
+        self.on_event = on_event
+        # Called for sustained increases, e.g. to re-run path selection. Runs go through one
+        # worker thread, since they share routing state, with at most one queued per target
+        self.on_shift = on_shift
+        self._shift_executor = None
+        self._shifting = {}
+        # ICMP and UDP probes share one socket per family across all targets and cycles;
+        # TCP needs a socket per probe, so the in-flight limit must fit the descriptor limit.
+        # Staggering the targets over up to a second keeps a cycle's replies from
+        # overflowing the shared receive buffer
+        self.prober = LatencyProber(count=1, interval=min(1.0, interval / 2), timeout=timeout,
+                                    max_in_flight=min(max_in_flight, fd_batch_size()),
+                                    shared_sockets=True, **probe_options)
+
+        count = len(self.targets)
+        self.state = [array('d', bytes(8 * count)) for _ in range(BASELINE + 1)]
+        self.samples = array('L', bytes(array('L').itemsize * count))
+        self.lossy = bytearray(count)
+        # Most recent events only; stats['events'] keeps the running total
+        self.events = deque(maxlen=max_events)
+        self.stop_event = threading.Event()
+        self._wake = None
+        self._loop = None
+        self.stats = {'cycles': 0, 'events': 0, 'cpu_seconds': 0.0, 'started': time.time()}
+
+    def update(self, i, rtt, now=None):
+        """Fold one sample for target i into its state; returns an event dict or None"""
+        mean, var, up, down, loss, baseline = self.state
+        if rtt is None:
+            loss[i] += self.loss_alpha * (1.0 - loss[i])
+            if not self.lossy[i] and loss[i] >= self.loss_threshold:
+                self.lossy[i] = 1
+                return self._event(i, 'loss', baseline[i], mean[i], now)
+            return None
+
+        loss[i] -= self.loss_alpha * loss[i]
+        if self.lossy[i] and loss[i] < self.loss_threshold / 2:
+            self.lossy[i] = 0
+            self._event(i, 'recovered', baseline[i], mean[i], now)
+
+        n = self.samples[i] = self.samples[i] + 1
+        if n == 1:
+            mean[i] = baseline[i] = rtt
+            return None
+
+        # Detector runs against the state before this sample is folded in
+        diff = rtt - mean[i]
+        if n > self.warmup:
+            std = max(math.sqrt(var[i]), self.min_std_ms)
+            # Winsorize so outliers neither dominate the sums nor drag the mean
+            diff = max(-self.clip * std, min(self.clip * std, diff))
+            z = diff / std
+            up[i] = max(0.0, up[i] + z - self.drift)
+            down[i] = max(0.0, down[i] - z - self.drift)
+            if up[i] > self.threshold or down[i] > self.threshold:
+                kind = 'increase' if up[i] > self.threshold else 'decrease'
+                up[i] = down[i] = 0.0
+                # Jump to the new level instead of letting the EWMA crawl toward it
+                event = self._event(i, kind, baseline[i], rtt, now)
+                mean[i] = baseline[i] = rtt
+                return event
+
+        increment = self.alpha * diff
+        mean[i] += increment
+        var[i] = (1.0 - self.alpha) * (var[i] + diff * increment)
+        if n == self.warmup:
+            baseline[i] = mean[i]
+        return None
+
+    def _event(self, i, kind, before, after, now=None):
+        event = {'time': now or time.time(), 'target': self.targets[i], 'kind': kind,
+                 'before': before, 'after': after, 'loss': self.state[LOSS][i]}
+        self.events.append(event)
+        self.stats['events'] += 1
+        if self.on_event:
+            self.on_event(event)
+        return event
+
+    def snapshot(self, target):
+        """Current smoothed view of one target"""
+        i = self.index[target]
+        mean, var, _, _, loss, baseline = self.state
+        return {'target': target, 'mean': mean[i], 'std': math.sqrt(var[i]), 'loss': loss[i],
+                'baseline': baseline[i], 'samples': self.samples[i]}
+
+    def stop(self, *_):
+        self.stop_event.set()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def report(self):
+        """Own overhead since start: cycles, events and CPU time"""
+        stats = self.stats
+        uptime = max(time.time() - stats['started'], 1e-9)
+        return (f"cycles {stats['cycles']} | targets {len(self.targets)} | events {stats['events']} | "
+                f"cpu {stats['cpu_seconds'] * 1000:.0f} ms "
+                f"({stats['cpu_seconds'] / uptime * 100:.2f}% of uptime)")
+
+    async def cycle(self):
+        """Probe every target once and update state; returns this cycle's events"""
+        events = []
+        results = await self.prober.probe_many_async(self.targets)
+        now = time.time()
+        for target, result in results.items():
+            event = self.update(self.index[target], result['sequence'][0], now)
+            if event is not None:
+                events.append(event)
+                if self.on_shift and event['kind'] in ('increase', 'loss'):
+                    self._submit_shift(event)
+        return events
+
+    def _submit_shift(self, event):
+        target = event['target']
+        if target in self._shifting:
+            return
+        if self._shift_executor is None:
+            self._shift_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reselect')
+        future = self._shifting[target] = self._shift_executor.submit(self.on_shift, event)
+        future.add_done_callback(lambda done: self._shift_done(target, done))
+
+    def _shift_done(self, target, future):
+        self._shifting.pop(target, None)
+        if not future.cancelled() and future.exception() is not None:
+            print(f"[-] Re-selection for {target} failed: {future.exception()}")
+
+    async def run_async(self, cycles=None):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        next_run = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                cpu_start = time.process_time()
+                try:
+                    await self.cycle()
+                except Exception as e:
+                    print(f"[-] Monitor cycle failed: {e}")
+                self.stats['cycles'] += 1
+                self.stats['cpu_seconds'] += time.process_time() - cpu_start
+                if cycles is not None and self.stats['cycles'] >= cycles:
+                    break
+                next_run += self.interval
+                # One timed wait per cycle; stop() wakes it early
+                try:
+                    await asyncio.wait_for(self._wake.wait(), max(0.0, next_run - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.prober.close()
+            if self._shift_executor is not None:
+                # Drop queued runs but let one already changing routes finish
+                for future in list(self._shifting.values()):
+                    future.cancel()
+                self._shift_executor.shutdown(wait=True)
+                self._shift_executor = None
+            self._loop = None
+
+    def run(self, cycles=None):
+        """Loop until stopped (SIGINT/SIGTERM) or after the given number of cycles"""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        asyncio.run(self.run_async(cycles))
@@ -5,18 +5,23 @@ Tests and switches to fastest network gateway
 """
 
 import os
-import sys
-import platform
 import subprocess
 import socket
 import time
-import json
-from datetime import datetime
+
+from probe_stats import score
+from os_detect import os_type
 
 class RouteOptimizer:
     def __init__(self):
-        self.os_type = platform.system()
+        self.os_type = os_type()
         self.is_admin = self.check_admin()
+        self._probe_cache = None
+        self._history = None
+        self._routing_table = None
+        self.refresh = False
+        # Extra LatencyProber options, e.g. {'transport': 'udp', 'udp_port': 7}
+        self.probe_options = {}
         
         # Common game servers to test
         self.test_servers = {
@@ -41,6 +46,31 @@ class RouteOptimizer:
         except:
             return False
     
+    @property
+    def probe_cache(self):
+        """Shared probe-result cache, opened on first use"""
+        if self._probe_cache is None:
+            from probe_cache import ProbeCache
+            self._probe_cache = ProbeCache()
+        return self._probe_cache
+    
+    @property
+    def history(self):
+        """Append-only probe sample history, opened on first use"""
+        if self._history is None:
+            from probe_history import ProbeHistory
+            self._history = ProbeHistory()
+        return self._history
+    
+    @property
+    def routing_table(self):
+        """Kernel routing table index, loaded on first use and refreshed on change"""
+        if self._routing_table is None:
+            from routing_table import RoutingTable
+            self._routing_table = RoutingTable()
+        self._routing_table.refresh()
+        return self._routing_table
+    
     def print_banner(self):
         print("=" * 70)
         print("   ROUTE OPTIMIZER - Multi-Path Routing & Gateway Optimization")
@@ -49,47 +79,54 @@ class RouteOptimizer:
         print("=" * 70)
         print()
     
+    def probe_host(self, host, count=5, interval=0.2, timeout=1.0):
+        """Probe a host in-process; per-sample RTTs, loss and summary statistics"""
+        from latency_probe import LatencyProber
+        prober = LatencyProber(count=count, interval=interval, timeout=timeout, **self.probe_options)
+        result = prober.probe(host)
+        self.history.record('ping', host, result['sequence'])
+        return result
+    
     def ping_host(self, host, count=5):
         """Ping a host and return average latency"""
-        try:
-            if self.os_type == 'Windows':
-                cmd = f'ping -n {count} {host}'
-            else:
-                cmd = f'ping -c {count} {host}'
-            
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=10)
-            
-            # Parse average latency
-            if self.os_type == 'Windows':
-                for line in result.stdout.split('\n'):
-                    if 'Average' in line:
-                        avg = line.split('=')[-1].strip().replace('ms', '')
-                        return float(avg)
-            else:
-                for line in result.stdout.split('\n'):
-                    if 'avg' in line or 'min/avg/max' in line:
-                        parts = line.split('=')[-1].split('/')
-                        return float(parts[1])
-            
-            return None
-        except Exception as e:
-            return None
+        return self.probe_host(host, count=count)['avg']
     
-    def traceroute(self, host):
-        """Perform traceroute to show network path"""
+    def traceroute(self, host, max_hops=15, probes_per_hop=3):
+        """Trace the network path in-process; returns the structured hop list"""
         print(f"\n[*] Tracing route to {host}...")
         print("-" * 70)
         
-        try:
-            if self.os_type == 'Windows':
-                cmd = f'tracert -h 15 {host}'
-            else:
-                cmd = f'traceroute -m 15 {host}'
-            
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=30)
-            print(result.stdout)
-        except Exception as e:
-            print(f"[-] Error: {e}")
+        from traceroute_engine import TracerouteEngine, UDPTraceTransport
+        if self.os_type == 'Windows' or not UDPTraceTransport.available():
+            # No socket error queue (Windows, macOS): fall back to the system tool
+            command = (f'tracert -h {max_hops} {host}' if self.os_type == 'Windows'
+                       else f'traceroute -m {max_hops} {host}')
+            try:
+                result = subprocess.run(command, shell=True,
+                                        capture_output=True, text=True, timeout=30)
+                print(result.stdout)
+            except Exception as e:
+                print(f"[-] Error: {e}")
+            return None
+        
+        trace = TracerouteEngine(max_hops=max_hops, probes_per_hop=probes_per_hop).trace(host)
+        if trace['error'] and not trace['hops']:
+            print(f"[-] Error: {trace['error']}")
+            return trace
+        
+        for hop in trace['hops']:
+            if not hop['received']:
+                print(f"{hop['ttl']:3}  *")
+                continue
+            rtts = '  '.join(f"{rtt:6.1f} ms" if rtt is not None else '     *   ' for rtt in hop['sequence'])
+            print(f"{hop['ttl']:3}  {hop['address']:39} {rtts}")
+            for other in hop['addresses'][1:]:
+                print(f"     {other}")
+        if trace['error']:
+            print(f"[-] {host} not reached: {trace['error']}")
+        elif not trace['reached']:
+            print(f"[-] {host} not reached within {max_hops} hops")
+        return trace
     
     def get_current_gateway(self):
         """Get current default gateway"""
@@ -101,6 +138,9 @@ class RouteOptimizer:
                         gateway = line.split(':')[-1].strip()
                         if gateway and gateway != '0.0.0.0':
                             return gateway
+            elif self.os_type == 'Linux':
+                route = self.routing_table.default_route()
+                return route.gateway if route else None
             else:
                 result = subprocess.run('ip route show default', shell=True, capture_output=True, text=True)
                 if result.stdout:
@@ -112,50 +152,192 @@ class RouteOptimizer:
         except:
             return None
     
-    def test_all_game_servers(self):
+    def cached_probes(self, hosts, count=5, ttl=120, max_in_flight=64):
+        """Probe result per host, probing uncached hosts concurrently"""
+        from probe_cache import source_address
+        from latency_probe import LatencyProber
+        
+        interfaces = {host: source_address(host) for host in hosts}
+        results = {}
+        if not self.refresh:
+            for host in hosts:
+                cached = self.probe_cache.get(host, 'ping', interfaces[host])
+                if cached is not None:
+                    results[host] = cached
+        
+        missing = [host for host in hosts if host not in results]
+        if missing:
+            prober = LatencyProber(count=count, max_in_flight=max_in_flight, **self.probe_options)
+            for host, result in prober.probe_many(missing).items():
+                results[host] = result
+                self.probe_cache.put(host, 'ping', result, interfaces[host], ttl)
+            self.probe_cache.save()
+        
+        return results
+    
+    def test_all_game_servers(self, max_in_flight=64):
         """Test latency to all game servers"""
         print("\n[*] Testing latency to game servers...")
         print("-" * 70)
         
+        # All servers are probed at once, so the run takes one probe window
+        probes = self.cached_probes(list(self.test_servers.values()), count=5,
+                                    max_in_flight=max_in_flight)
+        
         results = {}
         for name, ip in self.test_servers.items():
-            print(f"Testing {name:20} ({ip:15})... ", end='', flush=True)
-            latency = self.ping_host(ip, count=5)
+            print(f"Testing {name:20} ({ip:15})... ", end='')
+            probe = probes.get(ip)
             
-            if latency:
-                results[name] = {'ip': ip, 'latency': latency}
-                print(f"{latency:.1f} ms")
+            if probe and probe['received']:
+                results[name] = {'ip': ip, 'latency': probe['avg'], 'p99': probe['p99'],
+                                 'jitter': probe['jitter'], 'loss': probe['loss'],
+                                 'score': score(probe, jitter_weight=1.0)}
+                print(f"{probe['avg']:.1f} ms (p99 {probe['p99']:.1f}, jitter {probe['jitter']:.1f}, "
+                      f"loss {probe['loss'] * 100:.0f}%)")
             else:
-                results[name] = {'ip': ip, 'latency': 9999}
+                results[name] = {'ip': ip, 'latency': 9999, 'score': float('inf')}
                 print("TIMEOUT")
         
         print("\n[*] Results Summary:")
         print("-" * 70)
-        sorted_results = sorted(results.items(), key=lambda x: x[1]['latency'])
+        # Rank on tail latency, jitter and loss rather than the mean alone
+        sorted_results = sorted(results.items(), key=lambda x: x[1]['score'])
         
         for i, (name, data) in enumerate(sorted_results, 1):
             if data['latency'] < 9999:
-                print(f"{i:2}. {name:20} : {data['latency']:6.1f} ms")
+                print(f"{i:2}. {name:20} : {data['latency']:6.1f} ms | p99 {data['p99']:6.1f} ms | "
+                      f"jitter {data['jitter']:5.1f} ms | loss {data['loss'] * 100:3.0f}%")
         
         return results
     
-    def find_best_route(self, destination):
-        """Find the best route to a destination"""
+    def select_servers(self, catalog_path, k=3, budget=None):
+        """Best k servers per region from a catalog file, found with a fixed probe budget"""
+        from target_catalog import AdaptiveSelector, load_catalog, group_by_region
+        
+        try:
+            targets = load_catalog(catalog_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[-] Could not load catalog: {e}")
+            return None
+        
+        regions = group_by_region(targets)
+        print(f"\n[*] Selecting the best {k} of {len(targets)} servers in {len(regions)} regions...")
+        print("-" * 70)
+        
+        selector = AdaptiveSelector(k=k, budget=budget, **self.probe_options)
+        report = selector.select(targets, on_round=lambda index, samples, alive, spent: print(
+            f"[*] Round {index + 1}: {samples} probes per target, {alive} left, {spent} probes spent"))
+        if not report['probes']:
+            print(f"[-] A budget of {report['budget']} probes cannot cover one probe per server")
+            return report
+        
+        for region, results in report['selection'].items():
+            print(f"\n  {region}:")
+            if not results:
+                print("    no server answered")
+            for i, result in enumerate(results, 1):
+                print(f"    {i}. {result['name']:24} ({result['target']:15}) : {result['avg']:6.1f} ms | "
+                      f"p99 {result['p99']:6.1f} ms | jitter {result['jitter']:5.1f} ms | "
+                      f"loss {result['loss'] * 100:3.0f}%")
+        
+        print(f"\n[+] {report['probes']} probes used ({report['probes'] / max(len(targets), 1):.1f} "
+              f"per server, budget {report['budget']})")
+        return report
+    
+    def monitor_routes(self, targets=None, interval=5.0, reselect=False, cycles=None):
+        """Track latency to many destinations and report persistent shifts until stopped"""
+        from route_monitor import RouteHealthMonitor
+        
+        targets = list(targets or self.test_servers.values())
+        names = {ip: name for name, ip in self.test_servers.items()}
+        
+        def on_event(event):
+            target = event['target']
+            label = f"{names[target]} ({target})" if target in names else target
+            if event['kind'] == 'loss':
+                print(f"[!] {time.strftime('%H:%M:%S')} {label}: loss rose to {event['loss'] * 100:.0f}%")
+            elif event['kind'] == 'recovered':
+                print(f"[+] {time.strftime('%H:%M:%S')} {label}: loss recovered")
+            else:
+                print(f"[!] {time.strftime('%H:%M:%S')} {label}: latency {event['kind']} "
+                      f"{event['before']:.1f} -> {event['after']:.1f} ms", flush=True)
+        
+        def on_shift(event):
+            # Only a worsening path is worth re-running path selection for
+            if self.os_type == 'Linux':
+                self.find_best_route(event['target'], install=reselect and self.is_admin)
+        
+        monitor = RouteHealthMonitor(targets, interval=interval, on_event=on_event,
+                                     on_shift=on_shift if reselect else None, **self.probe_options)
+        print(f"\n[*] Monitoring {len(monitor.targets)} destinations every {interval:g}s (Ctrl+C to stop)...")
+        monitor.run(cycles)
+        print(f"[+] Monitor stopped: {monitor.report()}")
+        return monitor
+    
+    def find_best_route(self, destination, install=False, count=10, margin_ms=2.0):
+        """Compare every uplink to a destination and recommend (or pin) the best path"""
         print(f"\n[*] Finding best route to {destination}...")
         
-        # Test current route
-        print("[*] Testing current route...")
-        current_latency = self.ping_host(destination, count=10)
+        if self.os_type != 'Linux':
+            # Test current route
+            print("[*] Testing current route...")
+            probe = self.probe_host(destination, count=count)
+            
+            if probe['received']:
+                print(f"[+] Current route latency: {probe['avg']:.1f} ms "
+                      f"(p50 {probe['p50']:.1f} / p99 {probe['p99']:.1f} ms, "
+                      f"jitter {probe['jitter']:.1f} ms, loss {probe['loss'] * 100:.0f}%)")
+            else:
+                print("[-] Could not test current route")
+            
+            self.traceroute(destination)
+            return [probe]
+        
+        from multipath import MultipathProber
+        prober = MultipathProber(count=count, table=self.routing_table, **self.probe_options)
+        print("[*] Probing every uplink at once...")
+        ranking = prober.compare(destination)
+        if not ranking:
+            print("[-] No usable path (could not resolve or no route)")
+            return ranking
         
-        if current_latency:
-            print(f"[+] Current route latency: {current_latency:.1f} ms")
+        for i, result in enumerate(ranking, 1):
+            path = result['path']
+            via = f"via {path.gateway}" if path.gateway else 'on-link'
+            marker = ' (current)' if result['current'] else ''
+            if result['received']:
+                print(f"{i:2}. {path.interface:12} {via:22} : {result['avg']:6.1f} ms | "
+                      f"p99 {result['p99']:6.1f} ms | jitter {result['jitter']:5.1f} ms | "
+                      f"loss {result['loss'] * 100:3.0f}%{marker}")
+            else:
+                print(f"{i:2}. {path.interface:12} {via:22} : TIMEOUT{marker}")
+        
+        best = ranking[0]
+        current = next((result for result in ranking if result['current']), None)
+        if not best['received']:
+            print("[-] No path answered")
+        elif best['current']:
+            print(f"[+] Current path via {best['path'].interface} is already the best")
+        elif current is not None and current['score'] - best['score'] < margin_ms:
+            # Not worth pinning a route over noise-level differences
+            print(f"[+] Current path via {current['path'].interface} is within "
+                  f"{margin_ms:.0f} ms of the best, keeping it")
         else:
-            print("[-] Could not test current route")
+            best['recommended'] = True
+            print(f"[+] Recommended: route {destination} via {best['path'].gateway or 'on-link'} "
+                  f"dev {best['path'].interface}")
+            if install:
+                if self.is_admin:
+                    self.sync_static_routes([ranking[0]['target']], best['path'].gateway,
+                                            best['path'].interface, prune=False)
+                else:
+                    print("[-] Admin privileges required to install the route")
         
         # Show traceroute
         self.traceroute(destination)
         
-        return current_latency
+        return ranking
     
     def optimize_routing_table(self):
         """Optimize routing table for gaming"""
@@ -194,6 +376,10 @@ class RouteOptimizer:
         
         print(f"\n[*] Adding static route: {destination} via {gateway}")
         
+        if self.os_type == 'Linux':
+            report = self.sync_static_routes([destination], gateway, prune=False)
+            return bool(report) and not report['failed']
+        
         try:
             if self.os_type == 'Windows':
                 cmd = f'route add {destination} mask 255.255.255.255 {gateway} metric 1'
@@ -207,12 +393,44 @@ class RouteOptimizer:
             print(f"[-] Error: {e}")
             return False
     
+    def sync_static_routes(self, destinations, gateway, interface=None, metric=1, prune=True):
+        """Pin destinations to a gateway, applying only the difference to the live table
+        
+        With prune, routes installed by an earlier sync that are no longer
+        wanted are removed in the same batch.
+        """
+        from static_routes import StaticRouteManager, make_route
+        
+        try:
+            desired = [make_route(destination, gateway, interface, metric) for destination in destinations]
+        except ValueError as e:
+            print(f"[-] Error: {e}")
+            return None
+        
+        manager = StaticRouteManager(self.routing_table)
+        report = manager.apply(desired, prune=prune)
+        print(f"[+] Static routes: {len(report['added'])} added, {len(report['removed'])} removed, "
+              f"{report['unchanged']} unchanged, {len(report['failed'])} failed")
+        for failure in report['failed']:
+            print(f"[-] {failure['action']} {failure['route'].destination} via "
+                  f"{failure['route'].gateway}: {failure['error']}")
+        return report
+    
     def show_routing_table(self):
         """Display current routing table"""
         print("\n[*] Current Routing Table:")
         print("-" * 70)
         
         try:
+            if self.os_type == 'Linux':
+                routes = self.routing_table.routes()
+                print(f"{'Destination':43} {'Gateway':39} {'Interface':12} Metric")
+                for route in routes:
+                    print(f"{route.destination + '/' + str(route.prefix_len):43} "
+                          f"{route.gateway or '-':39} {route.interface:12} {route.metric}")
+                print(f"\n[+] {len(routes)} routes")
+                return routes
+            
             if self.os_type == 'Windows':
                 result = subprocess.run('route print', shell=True, capture_output=True, text=True)
             else:
@@ -222,37 +440,76 @@ class RouteOptimizer:
         except Exception as e:
             print(f"[-] Error: {e}")
     
+    def discover_mtu(self, hosts, ttl=600, max_in_flight=64):
+        """Path MTU result per host, discovering uncached hosts concurrently"""
+        from probe_cache import source_address
+        from pmtu_discovery import PMTUDiscovery
+        
+        interfaces = {host: source_address(host) for host in hosts}
+        results = {}
+        if not self.refresh:
+            for host in hosts:
+                cached = self.probe_cache.get(host, 'pmtu', interfaces[host])
+                if cached is not None:
+                    results[host] = cached
+        
+        missing = [host for host in hosts if host not in results]
+        if missing:
+            discovery = PMTUDiscovery(max_in_flight=max_in_flight)
+            for host, result in discovery.discover_many(missing).items():
+                results[host] = result
+                # Failures are not cached so the next run tries again
+                if result['mtu'] is not None:
+                    self.probe_cache.put(host, 'pmtu', result, interfaces[host], ttl)
+            self.probe_cache.save()
+        
+        return results
+    
+    def _windows_mtu(self, host):
+        """Binary search with DF-flagged pings where DF sockets are unavailable; None if
+        even the 576-byte floor gets no reply (host down or ICMP blocked)"""
+        def fits(mtu):
+            result = subprocess.run(f'ping -n 1 -w 1000 -l {mtu - 28} -f {host}', shell=True,
+                                    capture_output=True, text=True)
+            return result.returncode == 0 and 'fragmented' not in result.stdout
+        
+        low, high = 576, 1500
+        if not fits(low):
+            return None
+        while low < high:
+            mtu = (low + high + 1) // 2
+            if fits(mtu):
+                low = mtu
+            else:
+                high = mtu - 1
+        return low
+    
     def test_mtu_sizes(self, host='8.8.8.8'):
-        """Test optimal MTU size"""
-        print(f"\n[*] Testing MTU sizes to {host}...")
+        """Discover the path MTU to a host"""
+        print(f"\n[*] Discovering path MTU to {host}...")
         print("-" * 70)
         
-        mtu_sizes = [1500, 1492, 1472, 1450, 1400, 1350, 1300]
+        if self.os_type == 'Windows':
+            mtu = self._windows_mtu(host)
+            if mtu is None:
+                print(f"[-] Could not discover path MTU: no reply from {host}")
+                print("\n[+] Default MTU (1500) recommended")
+                return 1500
+            self.history.record('pmtu', host, [mtu])
+            print(f"\n[+] Recommended MTU: {mtu}")
+            return mtu
         
-        for mtu in mtu_sizes:
-            print(f"Testing MTU {mtu:4}... ", end='', flush=True)
-            
-            try:
-                if self.os_type == 'Windows':
-                    cmd = f'ping -n 3 -l {mtu - 28} -f {host}'
-                else:
-                    cmd = f'ping -c 3 -M do -s {mtu - 28} {host}'
-                
-                result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=5)
-                
-                if 'Packet needs to be fragmented' in result.stdout or 'Message too long' in result.stderr:
-                    print("❌ Too large")
-                elif result.returncode == 0:
-                    print("✅ Works")
-                    print(f"\n[+] Recommended MTU: {mtu}")
-                    return mtu
-                else:
-                    print("⚠️  Failed")
-            except:
-                print("⚠️  Timeout")
+        result = self.discover_mtu([host])[host]
+        self.history.record('pmtu', host, [result['mtu']])
+        if result['mtu'] is None:
+            print(f"[-] Could not discover path MTU: {result['error']}")
+            print("\n[+] Default MTU (1500) recommended")
+            return 1500
         
-        print("\n[+] Default MTU (1500) recommended")
-        return 1500
+        print(f"[+] Path MTU {result['mtu']} via {result['transport']} "
+              f"({result['probes']} probes, kernel had {result['kernel_mtu']})")
+        print(f"\n[+] Recommended MTU: {result['mtu']}")
+        return result['mtu']
     
     def set_mtu(self, interface, mtu):
         """Set MTU for network interface"""
@@ -288,16 +545,22 @@ class RouteOptimizer:
             print("5. Test Optimal MTU Size")
             print("6. Traceroute to Server")
             print("7. Add Static Route")
-            print("8. Exit")
+            print("8. Select Best Servers from Catalog")
+            print("9. Exit")
             print("=" * 70)
             
-            choice = input("\nSelect option (1-8): ").strip()
+            choice = input("\nSelect option (1-9): ").strip()
             
             if choice == '1':
                 self.test_all_game_servers()
             elif choice == '2':
                 server = input("Enter server IP or hostname: ").strip()
-                self.find_best_route(server)
+                ranking = self.find_best_route(server)
+                if ranking and ranking[0].get('recommended') and self.is_admin:
+                    if input("Pin this destination to the recommended path? (y/n): ").strip().lower() == 'y':
+                        best = ranking[0]['path']
+                        self.sync_static_routes([ranking[0]['target']], best.gateway, best.interface,
+                                                prune=False)
             elif choice == '3':
                 self.show_routing_table()
             elif choice == '4':
@@ -313,15 +576,42 @@ class RouteOptimizer:
                 gateway = input("Enter gateway IP: ").strip()
                 self.add_static_route(dest, gateway)
             elif choice == '8':
+                path = input("Enter catalog file (JSON or address,region,name lines): ").strip()
+                k = input("Servers per region (default: 3): ").strip()
+                self.select_servers(path, k=int(k) if k.isdigit() else 3)
+            elif choice == '9':
                 print("\n[+] Thanks for using Route Optimizer!")
                 break
             else:
                 print("[-] Invalid option")
 
-def main():
+def build_parser():
+    import argparse
+    parser = argparse.ArgumentParser(description='Route Optimizer - Multi-path routing and gateway optimization')
+    parser.add_argument('--refresh', action='store_true', help='ignore cached probe results')
+    parser.add_argument('--monitor', action='store_true',
+                        help='track latency continuously and report persistent shifts')
+    parser.add_argument('--catalog', help='catalog file of destinations to monitor (default: game servers)')
+    parser.add_argument('--targets', nargs='+', help='destinations to monitor')
+    parser.add_argument('--interval', type=float, default=5.0, help='monitor probe interval (s)')
+    parser.add_argument('--reselect', action='store_true',
+                        help='re-run path selection (and pin the best path as admin) after a shift')
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
     optimizer = RouteOptimizer()
+    optimizer.refresh = args.refresh
     optimizer.print_banner()
     
+    if args.monitor:
+        targets = args.targets
+        if args.catalog:
+            from target_catalog import load_catalog
+            targets = [target.address for target in load_catalog(args.catalog)]
+        optimizer.monitor_routes(targets, interval=args.interval, reselect=args.reselect)
+        return
+    
     if not optimizer.is_admin:
         print("[!] WARNING: Not running with admin/root privileges")
         print("[!] Many features require elevated access")
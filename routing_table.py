@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Routing Table - Kernel routes in a longest-prefix-match radix trie
+Loads /proc/net/route and /proc/net/ipv6_route, answers which route serves
+a destination and re-reads only when rtnetlink reports a route change
+"""
+
+import os
+import socket
+import struct
+from collections import namedtuple
+
+Route = namedtuple('Route', 'family destination prefix_len gateway interface metric flags')
+
+RTF_UP = 0x0001
+RTF_GATEWAY = 0x0002
+RTF_REJECT = 0x0200
+
+# rtnetlink multicast groups for route changes (linux/rtnetlink.h)
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_ROUTE = 0x400
+
+WIDTH = {socket.AF_INET: 32, socket.AF_INET6: 128}
+
+
+def parse_ipv4_line(line):
+    """Route from one /proc/net/route row (addresses are in host byte order)"""
+    fields = line.split()
+    if len(fields) < 8 or fields[0] == 'Iface':
+        return None
+    flags = int(fields[3], 16)
+    if not flags & RTF_UP:
+        return None
+    destination, gateway, mask = (struct.pack('=I', int(value, 16))
+                                  for value in (fields[1], fields[2], fields[7]))
+    return Route(socket.AF_INET, socket.inet_ntop(socket.AF_INET, destination),
+                 bin(int.from_bytes(mask, 'big')).count('1'),
+                 socket.inet_ntop(socket.AF_INET, gateway) if flags & RTF_GATEWAY else None,
+                 fields[0], int(fields[6]), flags)
+
+
+def parse_ipv6_line(line):
+    """Route from one /proc/net/ipv6_route row"""
+    fields = line.split()
+    if len(fields) < 10:
+        return None
+    flags = int(fields[8], 16)
+    if not flags & RTF_UP:
+        return None
+    destination = socket.inet_ntop(socket.AF_INET6, bytes.fromhex(fields[0]))
+    gateway = socket.inet_ntop(socket.AF_INET6, bytes.fromhex(fields[4]))
+    return Route(socket.AF_INET6, destination, int(fields[1], 16),
+                 gateway if flags & RTF_GATEWAY else None,
+                 fields[9], int(fields[5], 16), flags)
+
+
+class _Node:
+    __slots__ = ('key', 'length', 'children', 'routes')
+
+    def __init__(self, key, length):
+        self.key = key
+        self.length = length
+        self.children = [None, None]
+        self.routes = []
+
+
+class RadixTrie:
+    """Path-compressed binary trie over fixed-width integer prefixes"""
+
+    def __init__(self, width):
+        self.width = width
+        self.root = _Node(0, 0)
+        self.size = 0
+
+    def _bit(self, key, position):
+        return (key >> (self.width - 1 - position)) & 1
+
+    def insert(self, key, length, value):
+        width = self.width
+        node = self.root
+        while length != node.length:
+            bit = (key >> (width - 1 - node.length)) & 1
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = node = _Node(key, length)
+                break
+            if child.length <= length and not (key ^ child.key) >> (width - child.length):
+                node = child
+                continue
+            # Split the edge with a branch node at the first differing bit
+            common = min(length, width - (key ^ child.key).bit_length())
+            branch = node.children[bit] = _Node(key >> (width - common) << (width - common), common)
+            branch.children[self._bit(child.key, common)] = child
+            node = branch
+            if common != length:
+                branch.children[self._bit(key, common)] = node = _Node(key, length)
+            break
+        node.routes.append(value)
+        self.size += 1
+
+    def remove(self, key, length, value):
+        """Drop one value stored at exactly key/length; False if absent"""
+        parent, node = None, self.root
+        while node is not None and node.length < length:
+            parent, node = node, node.children[self._bit(key, node.length)]
+        if node is None or node.length != length or node.key != key or value not in node.routes:
+            return False
+        node.routes.remove(value)
+        self.size -= 1
+        # Collapse nodes that no longer carry routes or branch
+        if node is not self.root and not node.routes:
+            remaining = [child for child in node.children if child is not None]
+            if len(remaining) < 2:
+                parent.children[self._bit(node.key, parent.length)] = remaining[0] if remaining else None
+        return True
+
+    def get(self, key, length):
+        """Values stored at exactly key/length, or an empty list"""
+        node = self.root
+        while node is not None and node.length < length:
+            node = node.children[self._bit(key, node.length)]
+        if node is None or node.length != length or node.key != key:
+            return []
+        return node.routes
+
+    def covering(self, key):
+        """Values of every prefix covering key, longest first"""
+        node, found = self.root, []
+        shift = self.width
+        while node is not None:
+            if node.length and (key ^ node.key) >> (shift - node.length):
+                break
+            if node.routes:
+                found.append(node.routes)
+            if node.length == shift:
+                break
+            node = node.children[(key >> (shift - 1 - node.length)) & 1]
+        return [value for values in reversed(found) for value in values]
+
+    def lookup(self, key):
+        """Values of the longest prefix covering key, or an empty list"""
+        node, best = self.root, self.root.routes
+        shift = self.width
+        while node is not None:
+            if node.length and (key ^ node.key) >> (shift - node.length):
+                break
+            if node.routes:
+                best = node.routes
+            if node.length == shift:
+                break
+            node = node.children[(key >> (shift - 1 - node.length)) & 1]
+        return best
+
+
+class RoutingTable:
+    """Main-table IPv4/IPv6 routes with longest-prefix-match lookups"""
+
+    def __init__(self, proc_net='/proc/net', watch=True):
+        self.paths = {socket.AF_INET: os.path.join(proc_net, 'route'),
+                      socket.AF_INET6: os.path.join(proc_net, 'ipv6_route')}
+        self.parsers = {socket.AF_INET: parse_ipv4_line, socket.AF_INET6: parse_ipv6_line}
+        self.tries = {family: RadixTrie(width) for family, width in WIDTH.items()}
+        self.lines = {family: {} for family in WIDTH}
+        self.loaded = False
+        self.monitor = self._open_monitor() if watch else None
+
+    @staticmethod
+    def _open_monitor():
+        """Non-blocking rtnetlink socket subscribed to route changes, or None"""
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        except (OSError, AttributeError):
+            return None
+        try:
+            sock.bind((0, RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_ROUTE))
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            return None
+        return sock
+
+    def _changed(self):
+        """Drain pending rtnetlink notifications; True if there were any"""
+        changed = False
+        while True:
+            try:
+                self.monitor.recv(65536)
+            except BlockingIOError:
+                return changed
+            except OSError:
+                # Overrun (ENOBUFS): notifications were lost, so assume a change
+                return True
+            changed = True
+
+    def _key(self, family, address):
+        return int.from_bytes(socket.inet_pton(family, address), 'big')
+
+    def refresh(self, force=False):
+        """Apply route changes since the last load; returns (added, removed)"""
+        if self.loaded and not force and self.monitor is not None and not self._changed():
+            return 0, 0
+        added = removed = 0
+        for family, path in self.paths.items():
+            try:
+                with open(path) as f:
+                    rows = f.read().splitlines()
+            except OSError:
+                rows = []
+            current = self.lines[family]
+            wanted = set(rows)
+            # Only rows that appeared or disappeared touch the trie
+            for line in [line for line in current if line not in wanted]:
+                route = current.pop(line)
+                self.tries[family].remove(self._key(family, route.destination), route.prefix_len, route)
+                removed += 1
+            for line in wanted:
+                if line in current:
+                    continue
+                route = self.parsers[family](line)
+                if route is None:
+                    continue
+                current[line] = route
+                self.tries[family].insert(self._key(family, route.destination), route.prefix_len, route)
+                added += 1
+        self.loaded = True
+        return added, removed
+
+    def lookup(self, destination):
+        """Route serving an IP address (lowest metric among the longest match), or None"""
+        if not self.loaded:
+            self.refresh()
+        family = socket.AF_INET6 if ':' in destination else socket.AF_INET
+        routes = self.tries[family].lookup(self._key(family, destination))
+        return min(routes, key=lambda route: route.metric) if routes else None
+
+    def exact(self, destination, prefix_len):
+        """Routes installed for exactly destination/prefix_len"""
+        if not self.loaded:
+            self.refresh()
+        family = socket.AF_INET6 if ':' in destination else socket.AF_INET
+        return list(self.tries[family].get(self._key(family, destination), prefix_len))
+
+    def candidates(self, destination):
+        """Every route that could carry traffic to destination, most specific and cheapest first"""
+        if not self.loaded:
+            self.refresh()
+        family = socket.AF_INET6 if ':' in destination else socket.AF_INET
+        routes = self.tries[family].covering(self._key(family, destination))
+        return sorted((route for route in routes if not route.flags & RTF_REJECT),
+                      key=lambda route: (-route.prefix_len, route.metric))
+
+    def lookup_many(self, destinations):
+        return {destination: self.lookup(destination) for destination in destinations}
+
+    def default_route(self, family=socket.AF_INET):
+        """Best default route that is not a reject route, or None"""
+        if not self.loaded:
+            self.refresh()
+        defaults = [route for route in self.tries[family].root.routes if not route.flags & RTF_REJECT]
+        return min(defaults, key=lambda route: route.metric) if defaults else None
+
+    def routes(self, family=None):
+        """All routes, most specific first"""
+        if not self.loaded:
+            self.refresh()
+        families = [family] if family else list(WIDTH)
+        return sorted((route for fam in families for route in self.lines[fam].values()),
+                      key=lambda route: (route.family, -route.prefix_len, route.metric))
+
+    def __len__(self):
+        return sum(len(lines) for lines in self.lines.values())
+
+    def close(self):
+        if self.monitor is not None:
+            self.monitor.close()
+            self.monitor = None
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Sock Diag - Per-process TCP throughput from NETLINK_SOCK_DIAG
+Dumps tcp_info byte counters for every socket in one netlink request per
+address family, diffs consecutive snapshots by socket cookie and sums the
+measured bytes/s per owning process
+"""
+
+import os
+import socket
+import struct
+import time
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+# Set on dump messages when the socket table changed mid-dump; entries may be missing
+NLM_F_DUMP_INTR = 0x10
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+INET_DIAG_INFO = 2
+
+# Every TCP state except LISTEN, TIME_WAIT and SYN_RECV, which carry no payload counters
+TCP_STATES = 0xfff & ~((1 << 10) | (1 << 6) | (1 << 3))
+
+NLMSGHDR = struct.Struct('=IHHII')
+# inet_diag_req_v2: family, protocol, ext, pad, states, then a zeroed inet_diag_sockid
+REQUEST = struct.Struct('=BBBxI48x')
+MESSAGE_HEADER = struct.Struct('=IHH')
+# Socket cookie at offset 44 of inet_diag_msg (60 from the netlink header) and inode at 68
+COOKIE_INODE = struct.Struct('=Q16xI')
+ATTRIBUTE = struct.Struct('=HH')
+# tcp_info.bytes_acked and bytes_received (Linux 4.1+)
+TCP_BYTES = struct.Struct('=QQ')
+TCP_BYTES_OFFSET = 120
+INET_DIAG_MSG_SIZE = 72
+
+# Ceiling for sockets first seen within an interval when no interface reports a speed, in bits/s
+DEFAULT_MAX_NEW_RATE = 10 ** 10
+
+
+def available():
+    """True if the kernel answers sock_diag requests"""
+    try:
+        with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG):
+            return True
+    except (OSError, AttributeError):
+        return False
+
+
+def fastest_link_rate(sys_net='/sys/class/net'):
+    """Highest negotiated speed of any non-loopback interface in bits/s, or None"""
+    fastest = None
+    try:
+        interfaces = os.listdir(sys_net)
+    except OSError:
+        return None
+    for interface in interfaces:
+        if interface == 'lo':
+            continue
+        try:
+            with open(os.path.join(sys_net, interface, 'speed')) as f:
+                speed = int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+        # Down links and drivers without a speed report -1
+        if speed > 0 and (fastest is None or speed * 10 ** 6 > fastest):
+            fastest = speed * 10 ** 6
+    return fastest
+
+
+class SockDiag:
+    """TCP socket dumps over one reused NETLINK_SOCK_DIAG socket"""
+
+    def __init__(self, buffer_size=1 << 20):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+        self.buffer = bytearray(buffer_size)
+        self.sequence = 0
+
+    def _layout(self, buffer, message, end):
+        """Struct reading cookie, inode, the INET_DIAG_INFO header and the byte counters
+        from one message layout, or None if the message has no usable tcp_info"""
+        attribute = message + INET_DIAG_MSG_SIZE
+        while attribute + 4 <= end:
+            attribute_length, attribute_type = ATTRIBUTE.unpack_from(buffer, attribute)
+            if attribute_length < 4:
+                return None
+            if attribute_type == INET_DIAG_INFO:
+                if attribute_length < 4 + TCP_BYTES_OFFSET + TCP_BYTES.size:
+                    return None
+                gap = attribute - (message + 44 + COOKIE_INODE.size)
+                return struct.Struct(f'=Q16xI{gap}xHH{TCP_BYTES_OFFSET}xQQ')
+            attribute += (attribute_length + 3) & ~3
+        return None
+
+    def _dump(self, family, counters):
+        """Add one family's sockets to counters; True if the dump was interrupted"""
+        self.sequence += 1
+        request = REQUEST.pack(family, socket.IPPROTO_TCP, 1 << (INET_DIAG_INFO - 1), TCP_STATES)
+        self.sock.send(NLMSGHDR.pack(NLMSGHDR.size + len(request), SOCK_DIAG_BY_FAMILY,
+                                     NLM_F_REQUEST | NLM_F_DUMP, self.sequence, 0) + request)
+        buffer = self.buffer
+        view = memoryview(buffer)
+        unpack_header = MESSAGE_HEADER.unpack_from
+        # Messages of one dump almost always share a layout, so one unpack reads a whole socket
+        layouts = {}
+        flags = 0
+        while True:
+            size = self.sock.recv_into(view)
+            offset = 0
+            while offset < size:
+                length, kind, message_flags = unpack_header(buffer, offset)
+                flags |= message_flags
+                if kind == SOCK_DIAG_BY_FAMILY:
+                    layout = layouts.get(length)
+                    if layout is None:
+                        layout = layouts[length] = self._layout(buffer, offset + 16, offset + length)
+                    if layout is not None:
+                        cookie, inode, _, attribute_type, acked, received = layout.unpack_from(
+                            buffer, offset + 60)
+                        if attribute_type == INET_DIAG_INFO:
+                            counters[cookie] = (inode, acked, received)
+                        else:
+                            # Same length, different attribute order: learn this one separately
+                            layout = self._layout(buffer, offset + 16, offset + length)
+                            if layout is not None:
+                                cookie, inode, _, _, acked, received = layout.unpack_from(buffer, offset + 60)
+                                counters[cookie] = (inode, acked, received)
+                elif kind == NLMSG_DONE:
+                    return bool(flags & NLM_F_DUMP_INTR)
+                elif kind == NLMSG_ERROR:
+                    error = -struct.unpack_from('=i', buffer, offset + 16)[0]
+                    if error:
+                        raise OSError(error, os.strerror(error))
+                    return bool(flags & NLM_F_DUMP_INTR)
+                offset += (length + 3) & ~3
+
+    def tcp_counters(self, attempts=3):
+        """{socket cookie: (inode, bytes_acked, bytes_received)} for every TCP socket"""
+        counters = {}
+        for family in (socket.AF_INET, socket.AF_INET6):
+            # Socket churn during a dump can skip live sockets: redo it, keeping the
+            # last attempt if the table never holds still
+            for _ in range(attempts):
+                found = {}
+                if not self._dump(family, found):
+                    break
+            counters.update(found)
+        return counters
+
+    def close(self):
+        self.sock.close()
+
+
+class ThroughputAccountant:
+    """Bytes per second per process from consecutive sock_diag snapshots"""
+
+    def __init__(self, snapshot=None, max_new_rate=None):
+        from conn_snapshot import ConnectionSnapshot
+        self.diag = SockDiag()
+        # Fastest a socket opened within an interval could have moved data, in bits/s
+        self.max_new_rate = max_new_rate or fastest_link_rate() or DEFAULT_MAX_NEW_RATE
+        # Shared inode -> (pid, comm) index; only PIDs that changed are rescanned
+        self.snapshot = snapshot or ConnectionSnapshot()
+        self.previous = None
+        self.sampled_at = None
+
+    def sample(self):
+        """Per-PID rates since the previous call: {pid: {name, tx_bps, rx_bps, sockets}}
+
+        Only processes with sockets that moved data are listed; 'sockets'
+        counts those active sockets.
+
+        The first call only sets the baseline and returns {}. Sockets first
+        seen after the baseline count from zero, since they opened within
+        the interval, unless they moved more than max_new_rate allows: those
+        are older sockets the baseline missed and only join the next interval.
+        Bytes of sockets closed within the interval are not seen.
+        """
+        now = time.monotonic()
+        counters = self.diag.tcp_counters()
+        previous, elapsed = self.previous, (now - self.sampled_at) if self.sampled_at else 0.0
+        self.previous, self.sampled_at = counters, now
+        if previous is None or elapsed <= 0:
+            return {}
+
+        # Idle sockets drop out after one dict lookup and a tuple compare
+        active = []
+        previous_get = previous.get
+        for cookie, value in counters.items():
+            before = previous_get(cookie)
+            if before != value:
+                active.append((value, before))
+        # Only sockets that moved data need an owner
+        self.snapshot.resolve(value[0] for value, _ in active)
+        owner = self.snapshot.inode_owner
+        new_limit = self.max_new_rate * elapsed / 8
+        totals = {}
+        for (inode, acked, received), before in active:
+            if before is None:
+                if acked + received > new_limit:
+                    continue
+                sent, got = acked, received
+            else:
+                sent, got = max(0, acked - before[1]), max(0, received - before[2])
+            pid = owner.get(inode)
+            if pid is None:
+                continue
+            entry = totals.get(pid)
+            if entry is None:
+                entry = totals[pid] = [0, 0, 0]
+            entry[0] += sent
+            entry[1] += got
+            entry[2] += 1
+
+        processes = self.snapshot.processes
+        return {pid: {'name': processes[pid]['comm'], 'tx_bps': sent * 8 / elapsed,
+                      'rx_bps': received * 8 / elapsed, 'sockets': sockets}
+                for pid, (sent, received, sockets) in totals.items()}
+
+    def measure(self, duration=2.0):
+        """Rates averaged over one window of the given length"""
+        self.sample()
+        time.sleep(duration)
+        return self.sample()
+
+    def close(self):
+        self.diag.close()
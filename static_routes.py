@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Static Routes - Diff-based bulk installation of pinned routes
+Compares a desired route set with the live table and applies only the
+additions and removals through a single `ip -batch` run
+"""
+
+import json
+import os
+import socket
+import subprocess
+import tempfile
+from collections import namedtuple
+from pathlib import Path
+
+from routing_table import RoutingTable
+
+DEFAULT_STATE_FILE = Path.home() / '.route_optimizer_static_routes.json'
+
+StaticRoute = namedtuple('StaticRoute', 'destination gateway interface metric')
+
+
+def _family(address):
+    return socket.AF_INET6 if ':' in address else socket.AF_INET
+
+
+def normalize_prefix(destination):
+    """(network address, prefix length) with host bits cleared; ValueError if malformed"""
+    address, _, length = destination.partition('/')
+    family = _family(address)
+    width = 128 if family == socket.AF_INET6 else 32
+    try:
+        key = int.from_bytes(socket.inet_pton(family, address), 'big')
+        length = int(length) if length else width
+    except (OSError, ValueError):
+        raise ValueError(f"invalid destination '{destination}'")
+    if not 0 <= length <= width:
+        raise ValueError(f"invalid prefix length in '{destination}'")
+    key = key >> (width - length) << (width - length)
+    return socket.inet_ntop(family, key.to_bytes(width // 8, 'big')), length
+
+
+def make_route(destination, gateway, interface=None, metric=1):
+    """StaticRoute with the destination normalized to network/prefix form
+
+    A gateway of None makes an on-link route, which needs an interface.
+    """
+    network, length = normalize_prefix(destination)
+    if gateway is None and not interface:
+        raise ValueError(f"route to '{destination}' needs a gateway or an interface")
+    try:
+        if gateway is not None:
+            gateway = socket.inet_ntop(_family(gateway), socket.inet_pton(_family(gateway), gateway))
+    except OSError:
+        raise ValueError(f"invalid gateway '{gateway}'")
+    return StaticRoute(f"{network}/{length}", gateway, interface or None, int(metric))
+
+
+def route_args(route):
+    """`ip route` arguments selecting one route"""
+    args = route.destination
+    if route.gateway:
+        args += f" via {route.gateway}"
+    if route.interface:
+        args += f" dev {route.interface}"
+    return f"{args} metric {route.metric}"
+
+
+def parse_batch_errors(stderr):
+    """{batch line number: error message} from `ip -force -batch` stderr"""
+    errors = {}
+    message = []
+    for line in stderr.splitlines():
+        if line.startswith('Command failed -:'):
+            try:
+                errors[int(line.rsplit(':', 1)[1])] = ' '.join(message) or 'failed'
+            except ValueError:
+                pass
+            message = []
+        elif line.strip():
+            message.append(line.strip())
+    return errors
+
+
+class StaticRouteManager:
+    """Keep the kernel's pinned routes equal to a desired set"""
+
+    def __init__(self, table=None, state_file=DEFAULT_STATE_FILE, ip_command='ip'):
+        self.table = table or RoutingTable()
+        # Routes this tool installed; only these are ever removed
+        self.state_file = Path(state_file)
+        self.ip_command = ip_command
+
+    def load_state(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                return {StaticRoute(*row) for row in json.load(f)}
+        except (OSError, ValueError, TypeError):
+            return set()
+
+    def save_state(self, routes):
+        """Atomically rewrite the managed-route list"""
+        payload = json.dumps(sorted((list(route) for route in routes), key=str), separators=(',', ':'))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=str(self.state_file.parent), prefix='.static_routes.')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(payload)
+                os.replace(tmp_path, str(self.state_file))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            print(f"[-] Could not save static route state: {e}")
+            return False
+        return True
+
+    def _live(self, route):
+        network, _, length = route.destination.partition('/')
+        return self.table.exact(network, int(length))
+
+    @staticmethod
+    def _matches(live, route):
+        return (live.gateway == route.gateway and live.metric == route.metric
+                and route.interface in (None, live.interface))
+
+    def installed(self, route):
+        """True if the live table already has this exact route"""
+        return any(self._matches(live, route) for live in self._live(route))
+
+    def conflict(self, route, removing=()):
+        """A live route with the same prefix and metric but another next hop, or None
+
+        Adding over it would replace it (IPv4) or merge into it as a multipath
+        route (IPv6); either way a route this tool did not install would change.
+        """
+        for live in self._live(route):
+            if live.metric != route.metric or self._matches(live, route):
+                continue
+            if not any(self._matches(live, removed) for removed in removing):
+                return live
+        return None
+
+    def diff(self, desired, prune=True, managed=None):
+        """(to_add, to_remove) needed to reach the desired set"""
+        self.table.refresh()
+        desired = set(desired)
+        to_add = sorted((route for route in desired if not self.installed(route)), key=str)
+        to_remove = []
+        if prune:
+            managed = self.load_state() if managed is None else managed
+            to_remove = sorted((route for route in managed - desired if self.installed(route)), key=str)
+        return to_add, to_remove
+
+    def apply(self, desired, prune=True, dry_run=False):
+        """Install missing routes and remove stale managed ones in one batch"""
+        desired = set(desired)
+        managed = self.load_state()
+        to_add, to_remove = self.diff(desired, prune, managed)
+        report = {'added': [], 'removed': [], 'failed': [],
+                  'unchanged': len(desired) - len(to_add)}
+        for route in list(to_add):
+            live = self.conflict(route, to_remove)
+            if live is None:
+                continue
+            owned = next((old for old in managed
+                          if old.destination == route.destination and self._matches(live, old)), None)
+            if owned is not None:
+                # One of ours moving to a new next hop: it is removed before the add
+                to_remove.append(owned)
+                continue
+            to_add.remove(route)
+            via = f"via {live.gateway}" if live.gateway else f"dev {live.interface}"
+            report['failed'].append({'route': route, 'action': 'add',
+                                     'error': f"an existing route {via} has the same metric"})
+        if dry_run:
+            report.update({'added': to_add, 'removed': to_remove})
+            return report
+
+        if to_add or to_remove:
+            # Removals first, so a prefix moving to a new gateway never has two routes
+            commands = ([('del', route) for route in to_remove] +
+                        [('add', route) for route in to_add])
+            # add, not replace: a route that appeared since the diff fails with EEXIST
+            # instead of being overwritten
+            program = ''.join(f"route {verb} {route_args(route)}\n" for verb, route in commands)
+            try:
+                result = subprocess.run([self.ip_command, '-force', '-batch', '-'], input=program,
+                                        capture_output=True, text=True)
+                errors = parse_batch_errors(result.stderr)
+                if result.returncode != 0 and not errors:
+                    errors = {line: result.stderr.strip() or 'failed'
+                              for line in range(1, len(commands) + 1)}
+            except OSError as e:
+                errors = {line: str(e) for line in range(1, len(commands) + 1)}
+
+            for line, (verb, route) in enumerate(commands, 1):
+                if line in errors:
+                    report['failed'].append({'route': route, 'action': verb, 'error': errors[line]})
+                elif verb == 'add':
+                    report['added'].append(route)
+                else:
+                    report['removed'].append(route)
+
+        failed_adds = {failure['route'] for failure in report['failed'] if failure['action'] == 'add'}
+        failed_removals = {failure['route'] for failure in report['failed'] if failure['action'] == 'del'}
+        # Only routes this tool installed are owned; live ones another tool or the admin
+        # added stay theirs, so a later prune never removes them
+        added = set(report['added'])
+        if prune:
+            state = (managed & desired) | added | failed_removals
+        else:
+            state = (managed | added) - set(report['removed'])
+        state -= failed_adds
+        if state != managed:
+            self.save_state(state)
+        return report
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Sysctl Engine - Transactional kernel parameter writes through /proc/sys
+Skips values that already match and rolls back every change if a write fails
+"""
+
+import os
+
+# Low-latency TCP profile applied by optimize_tcp_linux
+TCP_LATENCY_SETTINGS = {
+    'net.ipv4.tcp_fastopen': '3',
+    'net.ipv4.tcp_low_latency': '1',
+    'net.ipv4.tcp_timestamps': '1',
+    'net.ipv4.tcp_sack': '1',
+    'net.core.netdev_max_backlog': '5000',
+    'net.ipv4.tcp_congestion_control': 'bbr',
+}
+
+
+def normalize(value):
+    """Collapse whitespace so '4096\\t87380' and '4096 87380' compare equal"""
+    return ' '.join(str(value).split())
+
+
+class SysctlTransaction:
+    """Apply a set of sysctl keys in one pass with all-or-nothing semantics"""
+
+    def __init__(self, settings, proc_sys='/proc/sys'):
+        self.settings = dict(settings)
+        self.proc_sys = proc_sys
+        self.previous = {}
+        self.changed = []
+        self.unchanged = []
+        self.unsupported = []
+        self.failed = []
+        self.rolled_back = False
+        self.rollback_errors = []
+
+    def path(self, key):
+        return os.path.join(self.proc_sys, *key.split('.'))
+
+    def read(self, key):
+        with open(self.path(key), 'r') as f:
+            return normalize(f.read())
+
+    def write(self, key, value):
+        with open(self.path(key), 'w') as f:
+            f.write(str(value))
+
+    def apply(self):
+        """Write every key that differs; on any failure restore what was written"""
+        for key, value in self.settings.items():
+            wanted = normalize(value)
+            try:
+                current = self.read(key)
+            except FileNotFoundError:
+                # Key not provided by this kernel (e.g. tcp_low_latency after 4.14)
+                self.unsupported.append(key)
+                continue
+            except OSError as e:
+                self.failed.append((key, e.strerror or str(e)))
+                break
+
+            if current == wanted:
+                self.unchanged.append(key)
+                continue
+
+            try:
+                self.write(key, wanted)
+            except OSError as e:
+                self.failed.append((key, e.strerror or str(e)))
+                break
+
+            self.previous[key] = current
+            self.changed.append((key, current, wanted))
+
+        if self.failed:
+            self.rollback()
+        return not self.failed
+
+    def rollback(self):
+        """Restore the previous value of every key this transaction changed"""
+        for key, old, _ in reversed(self.changed):
+            try:
+                self.write(key, old)
+            except OSError as e:
+                self.rollback_errors.append((key, e.strerror or str(e)))
+        self.rolled_back = True
+        return not self.rollback_errors
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Target Catalog - Large endpoint lists and budgeted adaptive selection
+Loads candidate servers grouped by region and finds the best few per region
+with successive halving: every round drops the worst targets and spends the
+freed probes on the close contenders
+"""
+
+import csv
+import json
+import math
+from collections import OrderedDict, namedtuple
+
+from latency_probe import LatencyProber
+from probe_stats import score, summarize_sequence
+
+Target = namedtuple('Target', 'name address region')
+
+# Leave room for the interpreter, the cache file and resolver sockets
+FD_RESERVE = 64
+
+
+def load_catalog(path, default_region='default'):
+    """Targets from a JSON or CSV/text catalog file
+
+    JSON is either {"region": ["host", ...] or {"name": "host", ...}} or a list
+    of {"address", "name", "region"} objects. Text lines are
+    "address[,region[,name]]"; blank lines and # comments are skipped.
+    """
+    with open(path, 'r') as f:
+        content = f.read()
+
+    targets = []
+    if content.lstrip()[:1] in ('{', '['):
+        data = json.loads(content)
+        if isinstance(data, dict):
+            for region, entries in data.items():
+                if isinstance(entries, dict):
+                    targets.extend(Target(name, address, region) for name, address in entries.items())
+                else:
+                    targets.extend(Target(address, address, region) for address in entries)
+        else:
+            for entry in data:
+                address = entry['address']
+                targets.append(Target(entry.get('name', address), address,
+                                      entry.get('region', default_region)))
+    else:
+        for row in csv.reader(line for line in content.splitlines()
+                              if line.strip() and not line.lstrip().startswith('#')):
+            row = [field.strip() for field in row]
+            address = row[0]
+            region = row[1] if len(row) > 1 and row[1] else default_region
+            targets.append(Target(row[2] if len(row) > 2 and row[2] else address, address, region))
+
+    # One entry per address; the first occurrence wins
+    return list(OrderedDict((target.address, target) for target in targets).values())
+
+
+def group_by_region(targets):
+    regions = OrderedDict()
+    for target in targets:
+        regions.setdefault(target.region, []).append(target)
+    return regions
+
+
+def fd_batch_size(reserve=FD_RESERVE):
+    """How many targets can have a probe socket open at once under RLIMIT_NOFILE"""
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, ValueError, OSError):
+        return 512
+    if soft == resource.RLIM_INFINITY:
+        return 4096
+    return max(16, soft - reserve)
+
+
+class AdaptiveSelector:
+    """Successive halving over a catalog under a fixed total probe budget"""
+
+    def __init__(self, k=3, budget=None, samples_per_target=4, eta=3, interval=0.05, timeout=1.0,
+                 jitter_weight=1.0, first_round_samples=2, loss_samples=5, max_round_samples=30,
+                 max_in_flight=1024,
+                 batch_size=None, **probe_options):
+        self.k = k
+        # Total probes across all rounds; defaults to samples_per_target per candidate
+        self.budget = budget
+        self.samples_per_target = samples_per_target
+        # Keep 1/eta of each region's survivors per round
+        self.eta = eta
+        self.interval = interval
+        self.timeout = timeout
+        self.jitter_weight = jitter_weight
+        # One lost probe must not eliminate a target: the first round takes several
+        # samples, and loss only counts once a target has loss_samples of them
+        self.first_round_samples = first_round_samples
+        self.loss_samples = loss_samples
+        # Probes to one target go out an interval apart, so this bounds a round's duration;
+        # the budget is then an upper limit rather than a target
+        self.max_round_samples = max_round_samples
+        self.max_in_flight = max_in_flight
+        # A batch larger than the in-flight limit would starve probes past their deadline
+        self.batch_size = batch_size or min(fd_batch_size(), max_in_flight)
+        self.probe_options = probe_options
+
+    def rounds(self, regions):
+        """Halving rounds needed to cut the largest region down to k"""
+        largest = max((len(targets) for targets in regions.values()), default=0)
+        if largest <= self.k:
+            return 1
+        return max(1, math.ceil(math.log(largest / self.k, self.eta))) + 1
+
+    def _rank_key(self, rtts):
+        summary = summarize_sequence(rtts)
+        if summary['received'] and len(rtts) < self.loss_samples:
+            summary['loss'] = 0.0
+        return score(summary, jitter_weight=self.jitter_weight)
+
+    def _probe(self, addresses, count):
+        """{address: rtt list}, probing in batches that fit the descriptor limit"""
+        prober = LatencyProber(count=count, interval=self.interval, timeout=self.timeout,
+                               max_in_flight=self.max_in_flight, **self.probe_options)
+        results = {}
+        for start in range(0, len(addresses), self.batch_size):
+            batch = addresses[start:start + self.batch_size]
+            for address, result in prober.probe_many(batch).items():
+                results[address] = result['sequence']
+        return results
+
+    def _survivors(self, members, samples, keep):
+        """Best keep members that answered at least once, ranked on their samples so far"""
+        ranked = sorted(members, key=lambda target: self._rank_key(samples[target.address]))
+        answered = [target for target in ranked if any(
+            rtt is not None for rtt in samples[target.address])]
+        return answered[:keep]
+
+    def select(self, targets, on_round=None):
+        """Best k targets per region; returns {region: [result, ...]} and probe accounting"""
+        regions = group_by_region(targets)
+        total = sum(len(members) for members in regions.values())
+        budget = self.budget or self.samples_per_target * total
+        rounds = self.rounds(regions)
+        samples = {target.address: [] for target in targets}
+        survivors = OrderedDict((region, list(members)) for region, members in regions.items())
+        spent = 0
+
+        for round_index in range(rounds):
+            alive = [target for members in survivors.values() for target in members]
+            if not alive:
+                break
+            # Split what is left evenly over the remaining rounds and survivors, but never
+            # past what is left of the budget; stop once it cannot cover one sample each
+            per_target = max(self.first_round_samples if round_index == 0 else 1,
+                             (budget - spent) // ((rounds - round_index) * len(alive)))
+            per_target = min(per_target, self.max_round_samples, (budget - spent) // len(alive))
+            if per_target <= 0:
+                break
+            probed = self._probe([target.address for target in alive], per_target)
+            for address, rtts in probed.items():
+                samples[address].extend(rtts)
+            spent += per_target * len(alive)
+
+            last = round_index == rounds - 1
+            for region, members in survivors.items():
+                # Unreachable targets are dropped at once; the rest shrink by eta per round
+                keep = self.k if last else max(self.k, math.ceil(len(members) / self.eta))
+                survivors[region] = self._survivors(members, samples, keep)
+            if on_round:
+                on_round(round_index, per_target, sum(len(m) for m in survivors.values()), spent)
+
+        # Only changes anything if the budget ran out before the final round's cut to k
+        for region, members in survivors.items():
+            survivors[region] = self._survivors(members, samples, self.k)
+
+        selection = OrderedDict()
+        for region, members in survivors.items():
+            selection[region] = []
+            for target in members:
+                result = summarize_sequence(samples[target.address])
+                result.update({'name': target.name, 'target': target.address, 'region': region,
+                               'score': score(result, jitter_weight=self.jitter_weight)})
+                selection[region].append(result)
+        return {'selection': selection, 'probes': spent, 'budget': budget,
+                'targets': total, 'rounds': rounds}
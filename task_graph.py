@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Task Graph - Dependency-ordered parallel execution of optimization steps
+Runs independent steps on a worker pool and times every step
+"""
+
+import io
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class _StepOutput(io.TextIOBase):
+    """stdout proxy that buffers worker-thread output per thread"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        buffer = self.buffers.get(threading.get_ident())
+        if buffer is None:
+            with self.lock:
+                return self.stream.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def capture(self):
+        self.buffers[threading.get_ident()] = []
+
+    def release(self):
+        return ''.join(self.buffers.pop(threading.get_ident(), []))
+
+
+class TaskGraph:
+    """A set of named steps with dependencies, executed as a DAG"""
+
+    def __init__(self):
+        self.steps = OrderedDict()
+        self.wall_time = 0.0
+
+    def add(self, name, func, deps=()):
+        """Register a step; deps must name steps that were added earlier"""
+        for dep in deps:
+            if dep not in self.steps:
+                raise ValueError(f"Step '{name}' depends on unknown step '{dep}'")
+        self.steps[name] = {'func': func, 'deps': tuple(deps)}
+        return self
+
+    def run(self, max_workers=4):
+        """Run all steps; returns {name: report} in registration order"""
+        output = _StepOutput(sys.stdout)
+        reports = OrderedDict((name, {'status': 'pending', 'result': None, 'error': None,
+                                      'start': None, 'duration': 0.0})
+                              for name in self.steps)
+        origin = time.perf_counter()
+
+        def execute(name):
+            output.capture()
+            reports[name]['start'] = time.perf_counter() - origin
+            try:
+                return self.steps[name]['func']()
+            finally:
+                reports[name]['duration'] = time.perf_counter() - origin - reports[name]['start']
+                reports[name]['output'] = output.release()
+
+        real_stdout = sys.stdout
+        sys.stdout = output
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                running = {}
+                while True:
+                    for name, step in self.steps.items():
+                        if reports[name]['status'] != 'pending':
+                            continue
+                        states = [reports[dep]['status'] for dep in step['deps']]
+                        if any(state in ('failed', 'skipped') for state in states):
+                            reports[name]['status'] = 'skipped'
+                        elif all(state == 'done' for state in states):
+                            reports[name]['status'] = 'running'
+                            running[pool.submit(execute, name)] = name
+
+                    if not running:
+                        break
+
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        name = running.pop(future)
+                        report = reports[name]
+                        try:
+                            report['result'] = future.result()
+                            report['status'] = 'done'
+                        except Exception as e:
+                            report['error'] = e
+                            report['status'] = 'failed'
+                        # Print each step's output as one block, in completion order
+                        real_stdout.write(report.get('output', ''))
+                        real_stdout.flush()
+        finally:
+            sys.stdout = real_stdout
+
+        self.wall_time = time.perf_counter() - origin
+        return reports
+
+    def print_report(self, reports):
+        """Per-step timing table plus wall-clock vs. serial total"""
+        print("\n[*] Step Timing:")
+        print("-" * 60)
+        for name, report in reports.items():
+            detail = f" ({report['error']})" if report['error'] else ''
+            print(f"  {name:20} {report['status']:8} start {report['start'] or 0:6.2f}s "
+                  f"took {report['duration']:6.2f}s{detail}")
+        serial = sum(report['duration'] for report in reports.values())
+        print(f"  {'total':20} wall {self.wall_time:.2f}s (serial would be {serial:.2f}s)")
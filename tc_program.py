@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+TC Program - Traffic-control hierarchies compiled into one `tc -batch` run
+Deduplicates the port set, folds it into mask-aligned blocks placed in u32
+hash tables keyed on the port, installs qdisc, classes and filters in a
+single invocation, removes a half-built hierarchy on failure and verifies
+the installed state against the compiled one; class rates can be derived
+from the link capacity and retuned in place
+"""
+
+import os
+import re
+import subprocess
+from collections import namedtuple
+
+from static_routes import parse_batch_errors
+
+HTBClass = namedtuple('HTBClass', 'classid rate ceil prio parent', defaults=('1:',))
+# keys: ((value, mask, offset), ...) all of which must match; target is a classid
+U32Filter = namedtuple('U32Filter', 'keys flowid')
+
+# Fixed-rate gaming, streaming and default classes, for callers that do not know the link
+DEFAULT_CLASSES = (
+    HTBClass('1:10', '80mbit', '100mbit', 0),
+    HTBClass('1:20', '60mbit', '90mbit', 1),
+    HTBClass('1:30', '30mbit', '80mbit', 2),
+)
+
+# Parent class of the link-derived hierarchy; its children borrow from it up to the shaped rate
+LINK_CLASS = '1:1'
+# (classid, share of the shaped rate guaranteed, prio) for gaming, streaming and default traffic
+CLASS_SHARES = (('1:10', 0.4, 0), ('1:20', 0.35, 1), ('1:30', 0.25, 2))
+# Shape just under the bottleneck so the queue builds here, where HTB can prioritize it
+SHAPING_FACTOR = 0.9
+
+# Offset of the TCP/UDP port word in an option-less IPv4 header
+PORTS_OFFSET = 20
+# Offset of the IPv4 word holding TTL, protocol and checksum; the protocol is its second byte
+PROTOCOL_OFFSET = 8
+
+# u32 hash tables for destination and source ports, bucketed on the port's low byte
+DPORT_TABLE, SPORT_TABLE = 2, 3
+HASH_BUCKETS = 256
+
+RATE_UNITS = {'bit': 1, 'kbit': 10 ** 3, 'mbit': 10 ** 6, 'gbit': 10 ** 9, 'tbit': 10 ** 12,
+              'bps': 8, 'kbps': 8 * 10 ** 3, 'mbps': 8 * 10 ** 6, 'gbps': 8 * 10 ** 9}
+
+_CLASS_RE = re.compile(r'class htb (\S+) .*?rate (\S+) ceil (\S+)')
+_LEAF_RE = re.compile(r'qdisc (\S+) \S+ parent (\S+)')
+_MATCH_RE = re.compile(r'match ([0-9a-f]{8})/([0-9a-f]{8}) at (-?\d+)')
+
+
+def parse_rate(text):
+    """Bits per second from a tc rate such as '80mbit' or '100Mbit'"""
+    match = re.fullmatch(r'([\d.]+)([a-z]*)', str(text).strip().lower())
+    if not match or match.group(2) not in RATE_UNITS:
+        raise ValueError(f"invalid rate '{text}'")
+    return int(float(match.group(1)) * RATE_UNITS[match.group(2)])
+
+
+def format_rate(bps):
+    """tc rate for bits per second, in whole kbit so it reads back exactly"""
+    return f"{max(8, int(bps) // 1000)}kbit"
+
+
+def qdisc_available(kind):
+    """True if the kernel can create a qdisc kind, checked without touching any interface:
+    the module is loaded, is the default qdisc or can be loaded now"""
+    if os.path.isdir(f'/sys/module/sch_{kind}'):
+        return True
+    try:
+        with open('/proc/sys/net/core/default_qdisc', 'r') as f:
+            if f.read().strip() == kind:
+                return True
+    except OSError:
+        pass
+    try:
+        return subprocess.run(['modprobe', '-q', f'sch_{kind}'], capture_output=True).returncode == 0
+    except OSError:
+        return False
+
+
+def link_classes(capacity_bps, factor=SHAPING_FACTOR):
+    """HTB classes for a link: a parent at the shaped rate and children guaranteed
+    their share of it, each allowed to borrow up to the whole"""
+    shaped = format_rate(capacity_bps * factor)
+    classes = [HTBClass(LINK_CLASS, shaped, shaped, 0)]
+    for classid, share, prio in CLASS_SHARES:
+        classes.append(HTBClass(classid, format_rate(parse_rate(shaped) * share), shaped, prio, LINK_CLASS))
+    return classes
+
+
+def unique_ports(groups):
+    """Sorted set of valid ports from an iterable of port lists"""
+    ports = set()
+    for group in groups:
+        for port in group:
+            port = int(port)
+            if not 0 < port < 65536:
+                raise ValueError(f"invalid port {port}")
+            ports.add(port)
+    return sorted(ports)
+
+
+def port_blocks(ports):
+    """Fewest (value, mask) pairs matching exactly the given ports
+
+    Runs of consecutive ports are split into power-of-two blocks aligned on
+    their size, e.g. 27014-27018 becomes 27014/0xfffe, 27016/0xfffe, 27018/0xffff.
+    """
+    blocks = []
+    ports = sorted(set(ports))
+    i = 0
+    while i < len(ports):
+        start = end = ports[i]
+        while i + 1 < len(ports) and ports[i + 1] == end + 1:
+            i += 1
+            end = ports[i]
+        i += 1
+        while start <= end:
+            size = start & -start if start else 1 << 16
+            while size > end - start + 1:
+                size >>= 1
+            blocks.append((start, 0xffff & ~(size - 1)))
+            start += size
+    return blocks
+
+
+def port_filters(ports, flowid):
+    """One destination- and one source-port filter per port block"""
+    filters = []
+    for value, mask in port_blocks(ports):
+        filters.append(U32Filter(((value, mask, PORTS_OFFSET),), flowid))
+        filters.append(U32Filter(((value << 16, mask << 16, PORTS_OFFSET),), flowid))
+    return filters
+
+
+def hash_placement(item):
+    """(table, buckets) for a port filter, or None if it is too wide to hash
+
+    Buckets are the low byte of the port, so a block of up to 256 ports lands
+    in one bucket per low-byte value it covers.
+    """
+    (value, mask, offset), = item.keys
+    if offset != PORTS_OFFSET:
+        return None
+    table, shift = (SPORT_TABLE, 16) if mask > 0xffff else (DPORT_TABLE, 0)
+    value, mask = value >> shift, mask >> shift
+    if mask & 0xff00 != 0xff00:
+        return None
+    low = value & 0xff
+    return table, range(low, low + ((~mask & 0xff) + 1))
+
+
+def filter_args(keys):
+    return ' '.join(f"match u32 0x{value:08x} 0x{mask:08x} at {offset}" for value, mask, offset in keys)
+
+
+def parse_filters(text):
+    """[U32Filter] from `tc filter show` output; link and hash-table entries are skipped"""
+    filters = []
+    flowid = None
+    keys = []
+    for line in text.splitlines():
+        if line.startswith('filter '):
+            if flowid is not None:
+                filters.append(U32Filter(tuple(sorted(keys)), flowid))
+            match = re.search(r'flowid (\S+)', line)
+            flowid = match.group(1) if match else None
+            keys = []
+        else:
+            match = _MATCH_RE.search(line)
+            if match and flowid is not None:
+                keys.append((int(match.group(1), 16), int(match.group(2), 16), int(match.group(3))))
+    if flowid is not None:
+        filters.append(U32Filter(tuple(sorted(keys)), flowid))
+    return filters
+
+
+class TCProgram:
+    """HTB hierarchy with u32 port filters for one interface, applied as one batch"""
+
+    def __init__(self, interface, classes=DEFAULT_CLASSES, default_class='1:30', classifier='hashed',
+                 leaf_qdisc='fq_codel', tc_command='tc'):
+        self.interface = interface
+        self.classes = list(classes)
+        self.default_class = default_class
+        # Queue under each leaf class; fq_codel keeps sparse flows such as game traffic
+        # ahead of bulk transfers sharing the class. None leaves HTB's default fifo
+        self.leaf_qdisc = leaf_qdisc
+        # 'hashed': port-keyed u32 hash tables; 'linear': one flat filter chain
+        self.classifier = classifier
+        self.tc_command = tc_command
+        # port -> classid; the first class a port is given keeps it
+        self.ports = {}
+        # IP protocol number -> classid, for traffic without ports such as ICMP
+        self.protocols = {}
+
+    def add_ports(self, ports, flowid):
+        """Send traffic to or from these ports to a class; ports already placed are skipped"""
+        for port in unique_ports([ports]):
+            self.ports.setdefault(port, flowid)
+
+    def add_protocol(self, protocol, flowid):
+        """Send every packet of an IP protocol (e.g. 1 for ICMP) to a class"""
+        self.protocols.setdefault(int(protocol), flowid)
+
+    def leaves(self):
+        """Classids of the classes no other class hangs from"""
+        parents = {item.parent for item in self.classes}
+        return [item.classid for item in self.classes if item.classid not in parents]
+
+    def filters(self):
+        by_class = {}
+        for port, flowid in sorted(self.ports.items()):
+            by_class.setdefault(flowid, []).append(port)
+        filters = [U32Filter(((protocol << 16, 0x00ff0000, PROTOCOL_OFFSET),), flowid)
+                   for protocol, flowid in sorted(self.protocols.items())]
+        return filters + [item for flowid, ports in by_class.items() for item in port_filters(ports, flowid)]
+
+    def layout(self):
+        """(root filters, {table: {bucket: [filters]}}) for the configured classifier"""
+        root, tables = [], {}
+        for item in self.filters():
+            placement = hash_placement(item) if self.classifier == 'hashed' else None
+            if placement is None:
+                root.append(item)
+                continue
+            table, buckets = placement
+            for bucket in buckets:
+                tables.setdefault(table, {}).setdefault(bucket, []).append(item)
+        return root, tables
+
+    def installed_filters(self):
+        """Leaf filters as they appear in the kernel; hashed blocks repeat once per bucket"""
+        root, tables = self.layout()
+        return root + [item for buckets in tables.values() for items in buckets.values() for item in items]
+
+    def cost(self):
+        """Worst-case u32 nodes a packet visits: wide rules, links, then one bucket per table"""
+        root, tables = self.layout()
+        return len(root) + sum(1 + max(len(items) for items in buckets.values())
+                               for buckets in tables.values())
+
+    def compile(self):
+        """The batch program (one tc command per line, without the leading `tc`)"""
+        dev = self.interface
+        default = self.default_class.split(':', 1)[1]
+        lines = [f"qdisc del dev {dev} root",
+                 f"qdisc add dev {dev} root handle 1: htb default {default}"]
+        for item in self.classes:
+            lines.append(f"class add dev {dev} parent {item.parent} classid {item.classid} htb "
+                         f"rate {item.rate} ceil {item.ceil} prio {item.prio}")
+        if self.leaf_qdisc:
+            for classid in self.leaves():
+                lines.append(f"qdisc add dev {dev} parent {classid} {self.leaf_qdisc}")
+        # One filter priority keeps every rule in a single u32 classifier instance
+        prefix = f"filter add dev {dev} parent 1: protocol ip prio 1"
+        root, tables = self.layout()
+        for item in root:
+            lines.append(f"{prefix} u32 {filter_args(item.keys)} flowid {item.flowid}")
+        for table, buckets in sorted(tables.items()):
+            lines.append(f"{prefix} handle {table}: u32 divisor {HASH_BUCKETS}")
+            for bucket, items in sorted(buckets.items()):
+                for item in items:
+                    lines.append(f"{prefix} u32 ht {table}:{bucket:x}: {filter_args(item.keys)} "
+                                 f"flowid {item.flowid}")
+        # Packets missing the first table's bucket fall through to the next link
+        for table in sorted(tables):
+            hashkey = 0xff << 16 if table == SPORT_TABLE else 0xff
+            lines.append(f"{prefix} u32 ht 800:: match u32 0 0 at 0 "
+                         f"hashkey mask 0x{hashkey:08x} at {PORTS_OFFSET} link {table}:")
+        return lines
+
+    def link_rate(self):
+        """Bits per second of the widest ceiling, i.e. what the hierarchy lets through"""
+        return max(parse_rate(item.ceil) for item in self.classes)
+
+    def retune(self, rate_bps):
+        """Scale every class so the hierarchy passes rate_bps, with one `tc -batch` of class changes
+
+        Guaranteed rates keep their proportions and no ceiling exceeds the new
+        rate. Returns {line: (command, message)} errors; the classes are only
+        updated once tc accepted every change.
+        """
+        factor = rate_bps / self.link_rate()
+        limit = parse_rate(format_rate(rate_bps))
+        classes = [item._replace(rate=format_rate(min(parse_rate(item.rate) * factor, limit)),
+                                 ceil=format_rate(min(parse_rate(item.ceil) * factor, limit)))
+                   for item in self.classes]
+        lines = [f"class change dev {self.interface} parent {item.parent} classid {item.classid} htb "
+                 f"rate {item.rate} ceil {item.ceil} prio {item.prio}" for item in classes]
+        try:
+            result = subprocess.run([self.tc_command, '-force', '-batch', '-'], input='\n'.join(lines) + '\n',
+                                    capture_output=True, text=True)
+        except OSError as e:
+            return {0: (self.tc_command, str(e))}
+        errors = {line: (lines[line - 1], message) for line, message in parse_batch_errors(result.stderr).items()
+                  if 0 < line <= len(lines)}
+        if not errors:
+            self.classes = classes
+        return errors
+
+    def _show(self, *args):
+        result = subprocess.run([self.tc_command, *args], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise OSError(result.stderr.strip() or f"tc {' '.join(args)} failed")
+        return result.stdout
+
+    def installed(self):
+        """{'qdisc', 'classes', 'leaves', 'filters', 'links'} as currently configured on the interface"""
+        qdisc = self._show('qdisc', 'show', 'dev', self.interface, 'root').strip()
+        leaves = {}
+        for line in self._show('qdisc', 'show', 'dev', self.interface).splitlines():
+            match = _LEAF_RE.match(line)
+            if match:
+                leaves[match.group(2)] = match.group(1)
+        classes = {}
+        for line in self._show('class', 'show', 'dev', self.interface).splitlines():
+            match = _CLASS_RE.match(line)
+            if match:
+                classes[match.group(1)] = (parse_rate(match.group(2)), parse_rate(match.group(3)))
+        output = self._show('filter', 'show', 'dev', self.interface, 'parent', '1:')
+        links = sum(1 for line in output.splitlines() if line.startswith('filter ') and ' link ' in line)
+        return {'qdisc': qdisc, 'classes': classes, 'leaves': leaves, 'filters': parse_filters(output),
+                'links': links}
+
+    def differences(self, state):
+        """Human-readable list of ways the installed state differs from this program"""
+        problems = []
+        default = '0x' + self.default_class.split(':', 1)[1]
+        if not state['qdisc'].startswith('qdisc htb 1: root') or f"default {default}" not in state['qdisc']:
+            problems.append(f"root qdisc is '{state['qdisc'] or 'none'}'")
+        for item in self.classes:
+            wanted = (parse_rate(item.rate), parse_rate(item.ceil))
+            if state['classes'].get(item.classid) != wanted:
+                problems.append(f"class {item.classid} missing or with different rates")
+        extra = set(state['classes']) - {item.classid for item in self.classes}
+        if extra:
+            problems.append(f"unexpected classes {', '.join(sorted(extra))}")
+        if self.leaf_qdisc:
+            kind = self.leaf_qdisc.split()[0]
+            missing = [classid for classid in self.leaves() if state['leaves'].get(classid) != kind]
+            if missing:
+                problems.append(f"no {kind} under {', '.join(missing)}")
+        wanted = sorted(U32Filter(tuple(sorted(item.keys)), item.flowid) for item in self.installed_filters())
+        if sorted(state['filters']) != wanted:
+            problems.append(f"{len(state['filters'])} filters installed, {len(wanted)} expected")
+        links = len(self.layout()[1])
+        if state['links'] != links:
+            problems.append(f"{state['links']} hash-table links installed, {links} expected")
+        return problems
+
+    def apply(self, force=False):
+        """Install the hierarchy unless it is already in place; returns a report dict
+
+        The program runs as one `tc -force -batch` so every line is attempted;
+        if any line fails or the result does not verify, the root qdisc is
+        deleted so the interface falls back to its default queueing instead
+        of running a partial hierarchy.
+        """
+        report = {'changed': False, 'commands': 0, 'errors': {}, 'verified': False}
+        if not force:
+            try:
+                if not self.differences(self.installed()):
+                    report['verified'] = True
+                    return report
+            except (OSError, ValueError):
+                pass
+
+        lines = self.compile()
+        report.update({'changed': True, 'commands': len(lines)})
+        try:
+            result = subprocess.run([self.tc_command, '-force', '-batch', '-'], input='\n'.join(lines) + '\n',
+                                    capture_output=True, text=True)
+            errors = parse_batch_errors(result.stderr)
+        except OSError as e:
+            report['errors'] = {0: (self.tc_command, str(e))}
+            return report
+        # Deleting a root qdisc that does not exist is expected to fail
+        errors.pop(1, None)
+        report['errors'] = {line: (lines[line - 1], message) for line, message in errors.items()
+                            if 0 < line <= len(lines)}
+
+        if not report['errors']:
+            try:
+                problems = self.differences(self.installed())
+            except (OSError, ValueError) as e:
+                problems = [str(e)]
+            report['verified'] = not problems
+            if problems:
+                report['errors'][0] = ('verify', '; '.join(problems))
+
+        if report['errors']:
+            subprocess.run([self.tc_command, 'qdisc', 'del', 'dev', self.interface, 'root'],
+                           capture_output=True)
+        return report
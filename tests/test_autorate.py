@@ -0,0 +1,60 @@
+import os
+import signal
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autorate import AutorateController  # noqa: E402
+
+
+class FakeProgram:
+    interface = 'lo'
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    def link_rate(self):
+        return self.rate
+
+    def retune(self, rate):
+        self.rate = rate
+        return {}
+
+
+def controller(rate=20e6):
+    # UDP transport skips the ICMP socket check; no probe is ever sent
+    return AutorateController(FakeProgram(rate), reflectors=['192.0.2.1'], transport='udp')
+
+
+def test_outage_holds_rate():
+    ctl = controller()
+    for _ in range(20):
+        assert ctl.step(None, 0.0, 0.0) == 20e6
+    assert ctl.resting_rate == 20e6
+
+
+def test_idle_spike_does_not_cut():
+    ctl = controller()
+    assert ctl.step(200.0, 0.0, 0.0) == 20e6
+    # A download's ACK stream is not uplink load either
+    assert ctl.step(200.0, 1e6, 50e6) == 20e6
+    assert ctl.resting_rate == 20e6
+    for _ in range(60):
+        ctl.step(1.0, 0.0, 0.0)
+    assert ctl.rate == 20e6
+
+
+def test_loaded_bloat_cuts_below_achieved_rate():
+    ctl = controller()
+    rate = ctl.step(40.0, 19e6, 0.5e6)
+    assert rate == 19e6 * ctl.decrease
+    assert ctl.resting_rate == rate
+    # Refractory cycles do not cut again while the queue drains
+    assert ctl.step(40.0, rate, 0.5e6) == rate
+
+
+def test_run_restores_signal_handlers():
+    before = signal.getsignal(signal.SIGINT), signal.getsignal(signal.SIGTERM)
+    ctl = AutorateController(FakeProgram(20e6), reflectors=['127.0.0.1'], transport='udp', interval=0.05)
+    ctl.run(cycles=1)
+    assert (signal.getsignal(signal.SIGINT), signal.getsignal(signal.SIGTERM)) == before
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dns_probe import DNSProbeEngine, UNCACHED_ZONE, build_query, parse_response  # noqa: E402
+
+RCODE_REFUSED = 5
+
+
+def query_name(data):
+    labels, offset = [], 12
+    while data[offset]:
+        length = data[offset]
+        labels.append(data[offset + 1:offset + 1 + length].decode('ascii'))
+        offset += 1 + length
+    return '.'.join(labels)
+
+
+class StubResolver(asyncio.DatagramProtocol):
+    """Loopback resolver answering every query after a fixed delay"""
+
+    def __init__(self, cached_ms, uncached_ms=None, rcode=0):
+        self.cached_ms = cached_ms
+        self.uncached_ms = cached_ms if uncached_ms is None else uncached_ms
+        self.rcode = rcode
+        self.queries = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.queries += 1
+        qid, flags = struct.unpack_from('!HH', data)
+        # Question echoed back, no answers
+        reply = struct.pack('!HHHHHH', qid, 0x8000 | (flags & 0x0100) | 0x0080 | self.rcode,
+                            1, 0, 0, 0) + data[12:]
+        delay = self.uncached_ms if query_name(data).endswith(UNCACHED_ZONE) else self.cached_ms
+        asyncio.get_running_loop().call_later(delay / 1000, self.transport.sendto, reply, addr)
+
+
+async def serve(stubs, port=0):
+    """Bind each stub to its own loopback address on one shared port"""
+    loop = asyncio.get_running_loop()
+    transports = []
+    for address, stub in stubs.items():
+        transport, _ = await loop.create_datagram_endpoint(lambda stub=stub: stub, local_addr=(address, port))
+        port = transport.get_extra_info('sockname')[1]
+        transports.append(transport)
+    return port, transports
+
+
+def probe(stubs, **options):
+    async def run():
+        port, transports = await serve(stubs)
+        try:
+            engine = DNSProbeEngine(port=port, **options)
+            return engine, await engine.probe_async(list(stubs))
+        finally:
+            for transport in transports:
+                transport.close()
+    return asyncio.run(run())
+
+
+def test_parse_response_flags_error_rcodes():
+    query = build_query(0x1234, 'www.example.com')
+    assert parse_response(query) is None
+    answered = struct.pack('!HH', 0x1234, 0x8180) + query[4:]
+    nxdomain = struct.pack('!HH', 0x1234, 0x8183) + query[4:]
+    refused = struct.pack('!HH', 0x1234, 0x8185) + query[4:]
+    assert parse_response(answered) == (0x1234, True)
+    assert parse_response(nxdomain) == (0x1234, True)
+    assert parse_response(refused) == (0x1234, False)
+
+
+def test_cached_and_uncached_rtt_split():
+    stub = StubResolver(cached_ms=20, uncached_ms=80)
+    _, results = probe({'127.0.0.1': stub}, samples=4, timeout=2.0)
+    result = results['127.0.0.1']
+    assert result['cached']['received'] == 4
+    assert result['uncached']['received'] == 4
+    assert 20 <= result['cached']['min'] and result['cached']['max'] < 80
+    assert result['uncached']['min'] >= 80
+    # Warm-up query plus both sample sets, all on one socket
+    assert stub.queries == 9
+
+
+def test_refused_queries_count_as_lost():
+    stub = StubResolver(cached_ms=5, rcode=RCODE_REFUSED)
+    _, results = probe({'127.0.0.1': stub}, samples=3, timeout=1.0)
+    assert results['127.0.0.1']['received'] == 0
+    assert results['127.0.0.1']['loss'] == 1.0
+
+
+def test_rank_prefers_faster_resolver():
+    stubs = {'127.0.0.1': StubResolver(cached_ms=60), '127.0.0.2': StubResolver(cached_ms=5)}
+    engine, results = probe(stubs, samples=3, timeout=2.0)
+    providers = {'Slow': ['127.0.0.1'], 'Fast': ['127.0.0.2']}
+    assert [entry['name'] for entry in engine.rank(providers, results)] == ['Fast', 'Slow']
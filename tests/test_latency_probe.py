@@ -0,0 +1,81 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from latency_probe import LatencyProber, parse_payload  # noqa: E402
+
+
+class EchoResponder(asyncio.DatagramProtocol):
+    """Loopback UDP echo that holds every reply for delay_ms and drops the given sequence numbers"""
+
+    def __init__(self, delay_ms, drop=()):
+        self.delay_ms = delay_ms
+        self.drop = set(drop)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if parse_payload(data) in self.drop:
+            return
+        asyncio.get_running_loop().call_later(self.delay_ms / 1000, self.transport.sendto, data, addr)
+
+
+def probe(responders, **options):
+    async def run():
+        loop = asyncio.get_running_loop()
+        port, transports = 0, []
+        for address, responder in responders.items():
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda responder=responder: responder, local_addr=(address, port))
+            port = transport.get_extra_info('sockname')[1]
+            transports.append(transport)
+        prober = LatencyProber(transport='udp', udp_port=port, **options)
+        try:
+            return await prober.probe_many_async(list(responders))
+        finally:
+            prober.close()
+            for transport in transports:
+                transport.close()
+    return asyncio.run(run())
+
+
+def test_sequence_loss_and_percentiles():
+    results = probe({'127.0.0.1': EchoResponder(30, drop={2, 5})}, count=8, interval=0.01, timeout=0.5)
+    result = results['127.0.0.1']
+    assert result['transport'] == 'udp'
+    assert result['sent'] == 8 and result['received'] == 6
+    assert result['loss'] == pytest.approx(0.25)
+    assert [rtt is None for rtt in result['sequence']] == [i in (2, 5) for i in range(8)]
+    assert 30 <= result['min'] <= result['p50'] <= result['p95'] <= result['p99'] <= result['max'] < 300
+
+
+def test_unanswered_probes_time_out_as_lost():
+    results = probe({'127.0.0.1': EchoResponder(400)}, count=3, interval=0.01, timeout=0.1)
+    assert results['127.0.0.1']['sequence'] == [None, None, None]
+    assert results['127.0.0.1']['loss'] == 1.0
+
+
+def test_shared_sockets_match_replies_per_target():
+    responders = {'127.0.0.1': EchoResponder(10), '127.0.0.2': EchoResponder(60)}
+    results = probe(responders, count=4, interval=0.01, timeout=0.5, shared_sockets=True)
+    fast, slow = results['127.0.0.1'], results['127.0.0.2']
+    assert fast['received'] == slow['received'] == 4
+    assert 10 <= fast['max'] < 60 <= slow['min']
+
+
+def test_shared_socket_counts_port_unreachable_as_reply():
+    async def run():
+        # Nothing listens on the probe port, so the kernel answers with ICMP port unreachable
+        prober = LatencyProber(transport='udp', udp_port=9, count=3, interval=0.01, timeout=0.5,
+                               shared_sockets=True)
+        try:
+            return await prober.probe_many_async(['127.0.0.1', '127.0.0.2'])
+        finally:
+            prober.close()
+    results = asyncio.run(run())
+    assert [result['received'] for result in results.values()] == [3, 3]
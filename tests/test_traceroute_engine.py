@@ -0,0 +1,74 @@
+import os
+import socket
+import struct
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from traceroute_engine import (  # noqa: E402
+    IP_RECVERR, SO_EE_ORIGIN_ICMP, TRACE_MAGIC, SimulatedTraceTransport, TracerouteEngine,
+    UDPTraceTransport, same_address)
+
+PATH = [('10.0.0.1', 5), ('10.0.1.1', 15), ('10.0.2.1', 30), ('192.0.2.10', 40)]
+
+
+def trace(transport, **options):
+    options.setdefault('timeout', 1.0)
+    engine = TracerouteEngine(max_hops=8, probes_per_hop=3, spacing=0.01,
+                              transport_factory=lambda: transport, **options)
+    return engine.trace('192.0.2.10')
+
+
+def test_hops_and_rtts_follow_the_path():
+    result = trace(SimulatedTraceTransport(PATH))
+    assert result['reached'] and result['error'] is None
+    assert [hop['address'] for hop in result['hops']] == [address for address, _ in PATH]
+    for hop, (_, delay_ms) in zip(result['hops'], PATH):
+        assert hop['received'] == 3
+        assert delay_ms <= hop['min'] and hop['max'] < delay_ms + 100
+
+
+def test_silent_hop_is_reported_without_address():
+    result = trace(SimulatedTraceTransport(PATH, silent={2}))
+    assert result['reached']
+    silent = result['hops'][1]
+    assert silent['address'] is None and silent['received'] == 0 and silent['loss'] == 1.0
+    assert result['hops'][2]['address'] == '10.0.2.1'
+
+
+def test_lost_probes_count_per_hop():
+    result = trace(SimulatedTraceTransport(PATH, loss=lambda probe_id, ttl: ttl == 3 and probe_id < 8))
+    assert result['reached']
+    assert result['hops'][2]['received'] == 2
+
+
+def test_router_unreachable_ends_the_path_short():
+    result = trace(SimulatedTraceTransport(PATH, unreachable=2), timeout=0.3)
+    assert not result['reached']
+    assert [hop['address'] for hop in result['hops']] == ['10.0.0.1', '10.0.1.1']
+    assert result['error'] == 'unreachable (ICMP type 3 code 1) from 10.0.1.1'
+
+
+def test_transport_that_cannot_open_is_an_error():
+    class Refused(SimulatedTraceTransport):
+        async def open(self, address, family, on_reply):
+            raise PermissionError('Operation not permitted')
+    result = trace(Refused(PATH))
+    assert not result['reached'] and result['hops'] == []
+    assert result['error'] == 'Operation not permitted'
+
+
+def test_same_address_canonicalizes_and_tolerates_missing_offender():
+    assert same_address('2001:db8::1', '2001:DB8:0:0:0:0:0:1', socket.AF_INET6)
+    assert not same_address(None, '192.0.2.10', socket.AF_INET)
+
+
+def test_error_without_offender_is_dispatched():
+    replies = []
+    transport = UDPTraceTransport()
+    transport.address, transport.family = '192.0.2.10', socket.AF_INET
+    transport.on_reply = lambda *reply: replies.append(reply)
+    # sock_extended_err for a host unreachable with an unspecified offender address
+    extended = struct.pack('=IBBBBII', 113, SO_EE_ORIGIN_ICMP, 3, 1, 0, 0, 0) + bytes(8)
+    transport._handle_error(TRACE_MAGIC + struct.pack('!I', 7), [(socket.IPPROTO_IP, IP_RECVERR, extended)], 1.0)
+    assert replies == [(7, None, True, 1.0, 'unreachable (ICMP type 3 code 1)')]
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Traceroute Engine - In-process parallel-TTL path discovery
+Sends the probes for every TTL at once, matches ICMP time-exceeded replies
+back to them and traces many destinations over one event loop
+"""
+
+import asyncio
+import socket
+import struct
+import time
+
+from probe_stats import summarize_sequence
+
+# linux/in.h and linux/in6.h; not exported by the socket module
+IP_RECVERR = 11
+IPV6_RECVERR = 25
+SO_EE_ORIGIN_ICMP = 2
+SO_EE_ORIGIN_ICMP6 = 3
+
+ICMP_DEST_UNREACH = 3
+ICMP_TIME_EXCEEDED = 11
+ICMPV6_DEST_UNREACH = 1
+ICMPV6_TIME_EXCEEDED = 3
+
+DEFAULT_PORT = 33434
+TRACE_MAGIC = b'NOTR'
+
+
+def same_address(a, b, family):
+    """Compare two address literals in canonical form (IPv6 text has many spellings)"""
+    try:
+        return socket.inet_pton(family, a) == socket.inet_pton(family, b)
+    except (OSError, ValueError, TypeError):
+        # TypeError: an error message without an offender address
+        return a == b
+
+
+def parse_extended_error(data):
+    """(origin, icmp type, icmp code, offender address) from a sock_extended_err"""
+    if len(data) < 20:
+        return None
+    _, origin, icmp_type, code, _, _, _ = struct.unpack_from('=IBBBBII', data)
+    family = struct.unpack_from('=H', data, 16)[0]
+    offender = None
+    if family == socket.AF_INET and len(data) >= 24:
+        offender = socket.inet_ntop(socket.AF_INET, data[20:24])
+    elif family == socket.AF_INET6 and len(data) >= 40:
+        offender = socket.inet_ntop(socket.AF_INET6, data[24:40])
+    return origin, icmp_type, code, offender
+
+
+class UDPTraceTransport:
+    """Unprivileged UDP probes; ICMP errors arrive on the socket error queue (IP_RECVERR)"""
+
+    def __init__(self, port=DEFAULT_PORT):
+        # One destination port for every TTL keeps ECMP routers on one path
+        self.port = port
+        self.sock = None
+        self.loop = None
+
+    @staticmethod
+    def available():
+        return hasattr(socket, 'MSG_ERRQUEUE')
+
+    async def open(self, address, family, on_reply):
+        self.loop = asyncio.get_running_loop()
+        self.address = address
+        self.family = family
+        self.on_reply = on_reply
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        if family == socket.AF_INET6:
+            self.sock.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVERR, 1)
+        else:
+            self.sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+        # Queued errors raise EPOLLERR, which the selector reports as readable
+        self.loop.add_reader(self.sock.fileno(), self._on_readable)
+
+    def send(self, probe_id, ttl):
+        if self.family == socket.AF_INET6:
+            self.sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS, ttl)
+        else:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+        try:
+            self.sock.sendto(TRACE_MAGIC + struct.pack('!I', probe_id), (self.address, self.port))
+        except OSError:
+            # Lost probe; a pending error from an earlier probe is still on the queue
+            pass
+
+    def _on_readable(self):
+        now = time.perf_counter()
+        while True:
+            try:
+                data, ancdata, _, _ = self.sock.recvmsg(64, 512, socket.MSG_ERRQUEUE)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                break
+            self._handle_error(data, ancdata, now)
+        # A destination that answers the UDP probe itself has been reached
+        while True:
+            try:
+                data = self.sock.recv(64)
+            except OSError:
+                break
+            self._dispatch(data, self.address, True, now)
+
+    def _handle_error(self, data, ancdata, now):
+        for level, kind, cmsg in ancdata:
+            if (level, kind) not in ((socket.IPPROTO_IP, IP_RECVERR),
+                                     (socket.IPPROTO_IPV6, IPV6_RECVERR)):
+                continue
+            parsed = parse_extended_error(cmsg)
+            if parsed is None:
+                continue
+            origin, icmp_type, code, offender = parsed
+            if origin == SO_EE_ORIGIN_ICMP:
+                exceeded = icmp_type == ICMP_TIME_EXCEEDED
+            elif origin == SO_EE_ORIGIN_ICMP6:
+                exceeded = icmp_type == ICMPV6_TIME_EXCEEDED
+            else:
+                continue
+            if exceeded:
+                self._dispatch(data, offender, False, now)
+            elif same_address(offender, self.address, self.family):
+                # The destination's own port unreachable: reached
+                self._dispatch(data, offender, True, now)
+            else:
+                # A router refusing to forward (net/host/admin unreachable) ends the path short
+                source = f" from {offender}" if offender else ''
+                self._dispatch(data, offender, True, now,
+                               error=f"unreachable (ICMP type {icmp_type} code {code}){source}")
+
+    def _dispatch(self, data, hop, final, now, error=None):
+        if len(data) >= 8 and data[:4] == TRACE_MAGIC:
+            self.on_reply(struct.unpack_from('!I', data, 4)[0], hop, final, now, error)
+
+    def close(self):
+        if self.sock is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+
+class SimulatedTraceTransport:
+    """Replays a fixed multi-hop path in-process; hops are (address, delay_ms) ending at the target"""
+
+    def __init__(self, hops, silent=(), loss=None, unreachable=None):
+        self.hops = list(hops)
+        # TTLs whose router never answers, as with ICMP-filtering hops
+        self.silent = set(silent)
+        # Optional callable(probe_id, ttl) -> True to drop that probe
+        self.loss = loss
+        # TTL whose router has no route onward and answers every probe reaching it unreachable
+        self.unreachable = unreachable
+        self.handles = []
+
+    async def open(self, address, family, on_reply):
+        self.loop = asyncio.get_running_loop()
+        self.on_reply = on_reply
+
+    def send(self, probe_id, ttl):
+        if ttl in self.silent or (self.loss and self.loss(probe_id, ttl)):
+            return
+        index = min(ttl, len(self.hops)) - 1
+        final, error = index == len(self.hops) - 1, None
+        if self.unreachable and ttl >= self.unreachable:
+            index = self.unreachable - 1
+            final = True
+            error = f"unreachable (ICMP type {ICMP_DEST_UNREACH} code 1) from {self.hops[index][0]}"
+        address, delay_ms = self.hops[index]
+        self.handles.append(self.loop.call_later(
+            delay_ms / 1000, lambda: self.on_reply(probe_id, address, final, time.perf_counter(), error)))
+
+    def close(self):
+        for handle in self.handles:
+            handle.cancel()
+        self.handles = []
+
+
+class TracerouteEngine:
+    """Trace the path to many destinations at once, all TTLs in flight together"""
+
+    def __init__(self, max_hops=15, probes_per_hop=3, timeout=2.0, spacing=0.05,
+                 transport_factory=None, max_in_flight=64):
+        self.max_hops = max_hops
+        self.probes_per_hop = probes_per_hop
+        self.timeout = timeout
+        # Pause between rounds so per-router ICMP rate limits are not tripped
+        self.spacing = spacing
+        self.transport_factory = transport_factory or UDPTraceTransport
+        self.max_in_flight = max_in_flight
+
+    async def _resolve(self, target):
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                socket.inet_pton(family, target)
+                return family, target
+            except (OSError, ValueError):
+                pass
+        loop = asyncio.get_running_loop()
+        infos = await asyncio.wait_for(
+            loop.getaddrinfo(target, None, type=socket.SOCK_DGRAM), self.timeout)
+        family, _, _, _, sockaddr = infos[0]
+        return family, sockaddr[0]
+
+    async def trace_async(self, target, semaphore=None):
+        """Trace one destination; hop list with per-hop RTT distributions"""
+        semaphore = semaphore or asyncio.Semaphore(self.max_in_flight)
+        try:
+            family, address = await self._resolve(target)
+        except (OSError, UnicodeError, asyncio.TimeoutError):
+            return self._result(target, None, {}, None, error='could not resolve')
+
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            probes = {}
+            # replies[ttl][round] = (address, rtt ms)
+            replies = {ttl: [None] * self.probes_per_hop for ttl in range(1, self.max_hops + 1)}
+            # final: lowest TTL that ended the path; error: why, if it ended short of the target
+            state = {'final': None, 'error': None}
+            done = loop.create_future()
+
+            def complete():
+                final = state['final']
+                if final is None or done.done():
+                    return
+                # Finished once every probe at or below the final hop is answered
+                if all(all(replies[ttl]) for ttl in range(1, final + 1)):
+                    done.set_result(None)
+
+            def on_reply(probe_id, hop, final, received, error=None):
+                probe = probes.pop(probe_id, None)
+                if probe is None:
+                    return
+                ttl, round_index, sent = probe
+                replies[ttl][round_index] = (hop, (received - sent) * 1000)
+                if final and (state['final'] is None or ttl < state['final']):
+                    state['final'], state['error'] = ttl, error
+                complete()
+
+            transport = self.transport_factory()
+            try:
+                await transport.open(address, family, on_reply)
+            except OSError as e:
+                return self._result(target, address, {}, None, error=str(e))
+
+            try:
+                for round_index in range(self.probes_per_hop):
+                    if round_index:
+                        await asyncio.sleep(self.spacing)
+                    for ttl in range(1, (state['final'] or self.max_hops) + 1):
+                        probe_id = round_index * self.max_hops + ttl
+                        probes[probe_id] = (ttl, round_index, time.perf_counter())
+                        transport.send(probe_id, ttl)
+                try:
+                    await asyncio.wait_for(asyncio.shield(done), self.timeout)
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                transport.close()
+
+        return self._result(target, address, replies, state['final'], state['error'])
+
+    def _result(self, target, address, replies, final, error=None):
+        last = final or max((ttl for ttl, answers in replies.items() if any(answers)), default=0)
+        hops = []
+        for ttl in range(1, last + 1):
+            answers = replies[ttl]
+            addresses = list(dict.fromkeys(answer[0] for answer in answers if answer))
+            hop = summarize_sequence([answer[1] if answer else None for answer in answers])
+            hop.update({'ttl': ttl, 'address': addresses[0] if addresses else None,
+                        'addresses': addresses})
+            hops.append(hop)
+        return {'target': target, 'address': address, 'reached': final is not None and error is None,
+                'hops': hops, 'error': error}
+
+    async def trace_many_async(self, targets):
+        targets = list(dict.fromkeys(targets))
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        results = await asyncio.gather(*(self.trace_async(target, semaphore) for target in targets))
+        return dict(zip(targets, results))
+
+    def trace_many(self, targets):
+        """Blocking wrapper around trace_many_async"""
+        return asyncio.run(self.trace_many_async(targets))
+
+    def trace(self, target):
+        return self.trace_many([target])[target]
@@ -4,17 +4,15 @@ Traffic Prioritizer Pro - QoS and Gaming Traffic Optimization
 Prioritizes gaming and streaming traffic over background downloads
 """
 
+# psutil is imported by the connection views that need it
 import os
-import sys
-import platform
 import subprocess
-import psutil
-import json
-from pathlib import Path
+
+from os_detect import os_type
 
 class TrafficPrioritizer:
     def __init__(self):
-        self.os_type = platform.system()
+        self.os_type = os_type()
         self.is_admin = self.check_admin()
         
         # Gaming ports (common games)
@@ -43,6 +41,17 @@ class TrafficPrioritizer:
             'Discord Voice': [50000, 50010, 50020],
             'Zoom': [8801, 8802, 8803, 8804],
         }
+        
+        # Process-name substrings of known bandwidth hogs
+        self.bandwidth_hogs = [
+            'chrome', 'firefox', 'edge', 'steam', 'epicgameslauncher',
+            'origin', 'battle.net', 'uplay', 'torrent', 'bittorrent',
+            'utorrent', 'qbittorrent', 'onedrive', 'dropbox', 'googledrivesync',
+            'backup', 'windows update', 'software update'
+        ]
+        self._app_index = None
+        self.conn_snapshot = None
+        self.throughput = None
     
     def check_admin(self):
         """Check if running with admin/root privileges"""
@@ -55,6 +64,40 @@ class TrafficPrioritizer:
         except:
             return False
     
+    @property
+    def app_index(self):
+        """Port and process-name classifier compiled from the profiles on first use"""
+        if self._app_index is None:
+            from app_index import AppIndex
+            self._app_index = AppIndex({'gaming': self.gaming_ports, 'streaming': self.streaming_ports},
+                                       {'hog': self.bandwidth_hogs})
+        return self._app_index
+    
+    def list_connections(self, states=None):
+        """SocketEntry rows with owning PID and process name, via the /proc inode index where available"""
+        from conn_snapshot import ConnectionSnapshot, SocketEntry
+        if ConnectionSnapshot.available():
+            if self.conn_snapshot is None:
+                self.conn_snapshot = ConnectionSnapshot()
+            return self.conn_snapshot.refresh().connections(states)
+        
+        # Other platforms: look each PID up once instead of once per socket
+        import psutil
+        names = {}
+        entries = []
+        for conn in psutil.net_connections(kind='inet'):
+            if states and conn.status not in states:
+                continue
+            if conn.pid and conn.pid not in names:
+                try:
+                    names[conn.pid] = psutil.Process(conn.pid).name()
+                except Exception:
+                    names[conn.pid] = None
+            raddr, rport = conn.raddr if conn.raddr else ('', 0)
+            entries.append(SocketEntry('tcp' if conn.type == 1 else 'udp', conn.laddr.ip, conn.laddr.port,
+                                       raddr, rport, conn.status, None, conn.pid, names.get(conn.pid)))
+        return entries
+    
     def print_banner(self):
         print("=" * 70)
         print("   TRAFFIC PRIORITIZER PRO - QoS & Gaming Optimization")
@@ -101,91 +144,152 @@ class TrafficPrioritizer:
         print("[+] Windows QoS configured")
         return True
     
-    def setup_tc_linux(self, interface='eth0'):
-        """Setup Traffic Control (tc) on Linux"""
+    def link_capacity(self, interface):
+        """Negotiated link speed in bits/s from psutil, or None if the driver does not report one"""
+        try:
+            import psutil
+            speed = psutil.net_if_stats()[interface].speed
+        except Exception:
+            return None
+        return speed * 10 ** 6 if speed and speed > 0 else None
+    
+    def setup_tc_linux(self, interface='eth0', capacity_mbit=None):
+        """Setup Traffic Control (tc) on Linux, shaped to the uplink capacity
+        
+        capacity_mbit is the measured uplink speed; without it the NIC's
+        negotiated speed is used as a hint. Returns the TCProgram, or False.
+        """
         if not self.is_admin:
             print("[-] Root privileges required for Traffic Control setup")
             return False
         
         print(f"\n[*] Setting up Linux Traffic Control on {interface}...")
         
-        # Clear existing rules
-        subprocess.run(f'tc qdisc del dev {interface} root 2>/dev/null', shell=True)
-        
-        # Create HTB qdisc (Hierarchical Token Bucket)
-        subprocess.run(f'tc qdisc add dev {interface} root handle 1: htb default 30', shell=True)
-        
-        # Create classes with different priorities
-        # Class 1:10 - Gaming (highest priority, 80% bandwidth)
-        subprocess.run(f'tc class add dev {interface} parent 1: classid 1:10 htb rate 80mbit ceil 100mbit prio 0', shell=True)
+        from tc_program import TCProgram, link_classes, qdisc_available
+        if capacity_mbit:
+            capacity, source = capacity_mbit * 10 ** 6, 'measured'
+        else:
+            capacity, source = self.link_capacity(interface), 'link speed'
+            if capacity is None:
+                # The previous fixed hierarchy topped out at 100 Mbit/s
+                capacity, source = 100 * 10 ** 6, 'default, link speed unknown'
+        classes = link_classes(capacity)
+        print(f"[*] Capacity {capacity / 1e6:g} Mbit/s ({source}), shaping at {classes[0].rate}")
+        
+        # Without sch_fq_codel the leaves keep HTB's fifo; class priorities still apply
+        leaf_qdisc = 'fq_codel'
+        if not qdisc_available(leaf_qdisc):
+            print(f"[!] {leaf_qdisc} is not available in this kernel, leaf classes keep HTB's default fifo")
+            leaf_qdisc = None
+        program = TCProgram(interface, classes=classes, leaf_qdisc=leaf_qdisc)
+        # Shared ports (27015 is used by four games) get one filter pair each,
+        # and the whole hierarchy is installed by a single tc process
+        program.add_ports([port for ports in self.gaming_ports.values() for port in ports], '1:10')
+        # Pings share the gaming class, so latency probes (and autorate) see what game traffic sees
+        program.add_protocol(1, '1:10')
+        report = program.apply()
+        
+        if report['errors']:
+            for line, (command, message) in sorted(report['errors'].items()):
+                print(f"[-] {command}: {message[:200]}")
+            print(f"[-] Traffic Control setup failed, {interface} left on its default qdisc")
+            return False
+        if not report['changed']:
+            print(f"[+] Traffic Control already configured on {interface} ({len(program.ports)} ports)")
+            return program
         
-        # Class 1:20 - Streaming (medium priority, 60% bandwidth)
-        subprocess.run(f'tc class add dev {interface} parent 1: classid 1:20 htb rate 60mbit ceil 90mbit prio 1', shell=True)
+        print(f"[+] Installed {report['commands']} tc commands in one batch ({len(program.ports)} unique ports), verified")
+        print(f"[+] Port-hashed classifier: at most {program.cost()} rules checked per packet")
+        print("[+] Linux Traffic Control configured")
+        print("[+] Gaming traffic prioritized on", interface)
+        return program
+    
+    def run_autorate(self, interface='eth0', capacity_mbit=None, target_delay_ms=15.0, cycles=None):
+        """Install the hierarchy, then keep its rate just under the usable uplink capacity until stopped"""
+        program = self.setup_tc_linux(interface, capacity_mbit)
+        if not program:
+            return False
+        if not capacity_mbit:
+            # Cuts only happen while the uplink carries most of the shaped rate
+            print("[!] No measured uplink speed: the rate only comes down once the link is loaded near it")
         
-        # Class 1:30 - Default (low priority, 30% bandwidth)
-        subprocess.run(f'tc class add dev {interface} parent 1: classid 1:30 htb rate 30mbit ceil 80mbit prio 2', shell=True)
+        from autorate import AutorateController
         
-        # Add filters for gaming ports
-        for game, ports in self.gaming_ports.items():
-            for port in ports:
-                # UDP filter
-                subprocess.run(f'tc filter add dev {interface} protocol ip parent 1:0 prio 0 u32 match ip dport {port} 0xffff flowid 1:10', shell=True, capture_output=True)
-                # TCP filter
-                subprocess.run(f'tc filter add dev {interface} protocol ip parent 1:0 prio 0 u32 match ip sport {port} 0xffff flowid 1:10', shell=True, capture_output=True)
+        def on_change(change):
+            delay = 'lost' if change['delay_ms'] is None else f"{change['delay_ms']:.1f} ms"
+            print(f"[*] {change['interface']}: {change['before'] / 1e6:.1f} -> {change['after'] / 1e6:.1f} Mbit/s "
+                  f"(sending {change['tx_bps'] / 1e6:.1f} Mbit/s, queueing delay {delay})")
         
-        print("[+] Linux Traffic Control configured")
-        print("[+] Gaming traffic prioritized on", interface)
+        try:
+            controller = AutorateController(program, target_delay_ms=target_delay_ms, on_change=on_change)
+        except OSError as e:
+            print(f"[-] Autorate unavailable: {e}")
+            return False
+        print(f"[*] Adapting {interface} to keep queueing delay under {target_delay_ms:g} ms (Ctrl+C to stop)")
+        controller.run(cycles)
+        print(f"[+] Autorate stopped: {controller.report()}")
         return True
     
-    def kill_bandwidth_hogs(self):
-        """Identify and optionally kill bandwidth-consuming processes"""
+    def measure_process_throughput(self, duration=2.0):
+        """Measured TCP bytes/s per PID over duration via sock_diag, or None where unavailable"""
+        import sock_diag
+        if self.os_type != 'Linux' or not sock_diag.available():
+            return None
+        if self.throughput is None:
+            from conn_snapshot import ConnectionSnapshot
+            if self.conn_snapshot is None:
+                self.conn_snapshot = ConnectionSnapshot()
+            self.throughput = sock_diag.ThroughputAccountant(self.conn_snapshot)
+        return self.throughput.measure(duration)
+    
+    def kill_bandwidth_hogs(self, duration=2.0, threshold_mbps=10.0):
+        """Identify and optionally suspend processes moving more than threshold_mbps"""
         print("\n[*] Scanning for bandwidth-consuming processes...")
         print("-" * 70)
         
-        # Get all connections
-        connections = psutil.net_connections(kind='inet')
+        rates = self.measure_process_throughput(duration)
         
-        # Count connections per process
+        # Count connections per process; processes talking on game ports are never suspended
+        index = self.app_index
         process_connections = {}
-        for conn in connections:
-            if conn.pid:
-                try:
-                    proc = psutil.Process(conn.pid)
-                    name = proc.name()
-                    
-                    if name not in process_connections:
-                        process_connections[name] = {
-                            'pid': conn.pid,
-                            'connections': 0,
-                            'process': proc
-                        }
-                    process_connections[name]['connections'] += 1
-                except:
-                    pass
-        
-        # Sort by connection count
-        sorted_procs = sorted(process_connections.items(), 
-                            key=lambda x: x[1]['connections'], 
-                            reverse=True)[:15]
-        
-        # Known bandwidth hogs
-        bandwidth_hogs = [
-            'chrome', 'firefox', 'edge', 'steam', 'epicgameslauncher',
-            'origin', 'battle.net', 'uplay', 'torrent', 'bittorrent',
-            'utorrent', 'qbittorrent', 'onedrive', 'dropbox', 'googledrivesync',
-            'backup', 'windows update', 'software update'
-        ]
+        for conn in self.list_connections():
+            if conn.pid and conn.name:
+                info = process_connections.get(conn.pid)
+                if info is None:
+                    info = process_connections[conn.pid] = {'name': conn.name, 'connections': 0,
+                                                            'gaming': False}
+                info['connections'] += 1
+                if not info['gaming']:
+                    info['gaming'] = any(app.category == 'gaming'
+                                         for app in index.label(conn.proto, conn.lport, conn.rport))
         
-        print("\nTop Network Consumers:")
         potential_hogs = []
-        
-        for i, (name, info) in enumerate(sorted_procs, 1):
-            is_hog = any(hog in name.lower() for hog in bandwidth_hogs)
-            marker = "⚠️  BANDWIDTH HOG" if is_hog else ""
-            print(f"{i:2}. {name:30} (PID: {info['pid']:6}) - {info['connections']:3} connections {marker}")
-            
-            if is_hog:
-                potential_hogs.append((name, info))
+        if rates is not None:
+            print(f"\nTop Network Consumers (measured over {duration:g}s, TCP):")
+            sorted_procs = sorted(rates.items(), key=lambda x: x[1]['tx_bps'] + x[1]['rx_bps'],
+                                  reverse=True)[:15]
+            if not sorted_procs:
+                print("  No TCP traffic measured")
+            for i, (pid, rate) in enumerate(sorted_procs, 1):
+                info = process_connections.get(pid, {'connections': rate['sockets'], 'gaming': False})
+                total_mbps = (rate['tx_bps'] + rate['rx_bps']) / 1e6
+                is_hog = total_mbps >= threshold_mbps and not info['gaming']
+                marker = "⚠️  BANDWIDTH HOG" if is_hog else ("(game)" if info['gaming'] else "")
+                print(f"{i:2}. {rate['name']:30} (PID: {pid:6}) - up {rate['tx_bps'] / 1e6:7.1f} Mbit/s | "
+                      f"down {rate['rx_bps'] / 1e6:7.1f} Mbit/s | {info['connections']:3} connections {marker}")
+                if is_hog:
+                    potential_hogs.append((rate['name'], {'pid': pid}))
+        else:
+            # No per-socket counters on this platform: fall back to connection counts and known names
+            print("\nTop Network Consumers:")
+            sorted_procs = sorted(process_connections.items(), key=lambda x: x[1]['connections'],
+                                  reverse=True)[:15]
+            for i, (pid, info) in enumerate(sorted_procs, 1):
+                is_hog = 'hog' in index.match_name(info['name']) and not info['gaming']
+                marker = "⚠️  BANDWIDTH HOG" if is_hog else ""
+                print(f"{i:2}. {info['name']:30} (PID: {pid:6}) - {info['connections']:3} connections {marker}")
+                if is_hog:
+                    potential_hogs.append((info['name'], {'pid': pid}))
         
         if potential_hogs:
             print("\n[!] Detected potential bandwidth hogs!")
@@ -193,9 +297,10 @@ class TrafficPrioritizer:
             choice = input().strip().lower()
             
             if choice == 'y':
+                import psutil
                 for name, info in potential_hogs:
                     try:
-                        proc = info['process']
+                        proc = psutil.Process(info['pid'])
                         proc.suspend()
                         print(f"[+] Suspended: {name} (PID: {info['pid']})")
                     except Exception as e:
@@ -203,6 +308,7 @@ class TrafficPrioritizer:
     
     def optimize_for_game(self, game_name):
         """Optimize network for specific game"""
+        import psutil
         if game_name not in self.gaming_ports:
             print(f"[-] Game '{game_name}' not found in database")
             print("[*] Available games:")
@@ -236,31 +342,26 @@ class TrafficPrioritizer:
         print("\n[*] Active Network Connections:")
         print("-" * 90)
         
-        connections = psutil.net_connections(kind='inet')
-        
-        # Group by process
+        # Group by process; each socket is labelled with the apps its ports belong to
+        index = self.app_index
         process_conns = {}
-        for conn in connections:
-            if conn.pid and conn.status == 'ESTABLISHED':
-                try:
-                    proc = psutil.Process(conn.pid)
-                    name = proc.name()
-                    
-                    if name not in process_conns:
-                        process_conns[name] = []
-                    
-                    process_conns[name].append({
-                        'local': f"{conn.laddr.ip}:{conn.laddr.port}",
-                        'remote': f"{conn.raddr.ip}:{conn.raddr.port}" if conn.raddr else "N/A",
-                        'type': 'TCP' if conn.type == 1 else 'UDP'
-                    })
-                except:
-                    pass
+        for conn in self.list_connections(states=('ESTABLISHED',)):
+            if not conn.pid or not conn.name:
+                continue
+            process_conns.setdefault(conn.name, []).append({
+                'local': f"{conn.laddr}:{conn.lport}",
+                'remote': f"{conn.raddr}:{conn.rport}" if conn.raddr else "N/A",
+                'type': conn.proto.upper(),
+                'apps': index.label(conn.proto, conn.lport, conn.rport),
+            })
         
         for name, conns in sorted(process_conns.items()):
-            print(f"\n{name} ({len(conns)} connections):")
+            apps = list(dict.fromkeys(app.name for conn in conns for app in conn['apps']))
+            tag = f" [{', '.join(apps)}]" if apps else ""
+            print(f"\n{name} ({len(conns)} connections){tag}:")
             for conn in conns[:5]:  # Show first 5
-                print(f"  {conn['type']:4} {conn['local']:25} -> {conn['remote']:25}")
+                labels = ', '.join(app.name for app in conn['apps'])
+                print(f"  {conn['type']:4} {conn['local']:25} -> {conn['remote']:25} {labels}")
             if len(conns) > 5:
                 print(f"  ... and {len(conns) - 5} more")
     
@@ -303,6 +404,15 @@ class TrafficPrioritizer:
         
         return True
     
+    def ask_capacity(self):
+        """Uplink speed in Mbit/s from a speed test, or None to use the link speed"""
+        answer = input("Uplink speed in Mbit/s (blank: detect from link): ").strip()
+        try:
+            return float(answer) if answer else None
+        except ValueError:
+            print("[-] Not a number, detecting from link")
+            return None
+    
     def show_menu(self):
         """Interactive menu"""
         while True:
@@ -315,10 +425,11 @@ class TrafficPrioritizer:
             print("4. Scan for Bandwidth Hogs")
             print("5. Create Firewall Rules for Game")
             print("6. Setup QoS/Traffic Control")
-            print("7. Exit")
+            print("7. Adaptive Rate Control (Linux)")
+            print("8. Exit")
             print("=" * 70)
             
-            choice = input("\nSelect option (1-7): ").strip()
+            choice = input("\nSelect option (1-8): ").strip()
             
             if choice == '1':
                 self.list_gaming_ports()
@@ -339,8 +450,14 @@ class TrafficPrioritizer:
                     self.setup_qos_windows()
                 elif self.os_type == 'Linux':
                     iface = input("Enter network interface (default: eth0): ").strip() or 'eth0'
-                    self.setup_tc_linux(iface)
+                    self.setup_tc_linux(iface, self.ask_capacity())
             elif choice == '7':
+                if self.os_type == 'Linux':
+                    iface = input("Enter network interface (default: eth0): ").strip() or 'eth0'
+                    self.run_autorate(iface, self.ask_capacity())
+                else:
+                    print("[-] Adaptive rate control requires Linux tc")
+            elif choice == '8':
                 print("\n[+] Thanks for using Traffic Prioritizer Pro!")
                 break
             else: